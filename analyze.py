@@ -0,0 +1,50 @@
+import argparse
+import json
+from dataclasses import asdict
+from optimiser.energy_analyzer import EnergyAnalyzer
+
+
+if __name__ == "__main__":
+    """
+    Summarises the energy charged into the car, the powerwall cycling, the commands sent and the errors by day or
+    hour from the optimiser's data.csv, log.txt and errors.txt. Progress is checkpointed so each run only reads the
+    lines written since the last one.
+    """
+    parser = argparse.ArgumentParser(description='Summarise the optimiser logs by day or hour')
+    parser.add_argument('--directory', type=str, default='.',
+                        help='The directory the optimiser writes its files to')
+    parser.add_argument('--checkpoint', type=str, default='analysis_checkpoint.json',
+                        help='The file the progress and summaries are kept in between runs')
+    parser.add_argument('--rescan', action='store_true',
+                        help='Ignore the checkpoint and read every file from the start')
+    parser.add_argument('--hourly', action='store_true',
+                        help='Summarise each hour rather than each day')
+    parser.add_argument('--days', type=int, default=14,
+                        help='The number of most recent days to show, 0 for all of them')
+    parser.add_argument('--voltage', type=int, default=240,
+                        help='The voltage of the charger, used to convert the charging amps to W')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the summaries as json')
+    args = parser.parse_args()
+
+    analyzer = EnergyAnalyzer(
+        directory=args.directory,
+        checkpoint_path=args.checkpoint,
+        voltage=args.voltage)
+    if args.rescan:
+        analyzer.checkpoint.files = {}
+        analyzer.checkpoint.last_row = None
+        analyzer.checkpoint.hours = {}
+    line_count = analyzer.update()
+
+    summaries = analyzer.hourly() if args.hourly else analyzer.daily()
+    if args.days > 0 and len(summaries) > 0:
+        days = sorted({summary.period[:10] for summary in summaries})[-args.days:]
+        summaries = [summary for summary in summaries if summary.period[:10] >= days[0]]
+
+    if args.json:
+        print(json.dumps([asdict(summary) for summary in summaries], indent=2))
+    else:
+        print(f"Read {line_count} new lines")
+        for summary in summaries:
+            print(summary)
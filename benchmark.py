@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+from optimiser.benchmark import (
+    DEFAULT_HISTORY_COUNTS, find_regressions, format_report, load_results, run_benchmarks, save_results)
+
+
+def integer_list(text: str):
+    """ Parses a comma separated list of integers """
+    return [int(value) for value in text.split(',')]
+
+
+if __name__ == "__main__":
+    """
+    Times the per tick work of the optimiser, from formatting the solar charge state to a full simulated tick, and
+    compares the times with a saved baseline so changes that slow the optimiser down are caught.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the optimiser')
+    parser.add_argument('--history-count', type=integer_list, default=','.join(map(str, DEFAULT_HISTORY_COUNTS)),
+                        help='The sizes of spare capacity history to run each benchmark with')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='The time in seconds each simulated api request takes in the full tick')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='The number of times each benchmark is timed, the best time is reported')
+    parser.add_argument('--filter', type=str,
+                        help='Only run the benchmarks with this text in their name')
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+                        help='The file to save the results to')
+    parser.add_argument('--baseline', type=str, default='benchmark_baseline.json',
+                        help='The saved results to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='The fraction slower than the baseline that is reported as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        history_counts=args.history_count,
+        latency=args.latency,
+        repeats=args.repeats,
+        name_filter=args.filter)
+    save_results(results, args.output)
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(format_report(results))
+        print(f"Saved the baseline to {args.baseline}")
+    else:
+        baseline = load_results(args.baseline) if os.path.exists(args.baseline) else None
+        print(format_report(results, baseline, args.threshold))
+        regressions = find_regressions(results, baseline or {}, args.threshold)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} benchmarks are more than {args.threshold * 100:.0f}% slower than the baseline")
+            sys.exit(1)
@@ -0,0 +1,119 @@
+import argparse
+import os
+import tempfile
+import threading
+from optimiser.fake_tesla_service import ENDPOINT_GROUPS, FakeTeslaService, LatencyDistribution, use_fake_service
+from optimiser.force_charge_command import ForceChargeCommand
+from optimiser.load_test import create_optimiser, run_optimiser, run_server_load, service_counts, start_server
+from optimiser.replay import load_samples
+
+
+def group_values(values, parse):
+    """ Parses GROUP=VALUE options into a dict for every endpoint group, the group 'all' sets every group """
+    result = {}
+    for text in values or []:
+        group, _, value = text.partition('=')
+        if group != 'all' and group not in ENDPOINT_GROUPS:
+            raise ValueError(f"{group} is not one of all,{','.join(ENDPOINT_GROUPS)}")
+        for name in (ENDPOINT_GROUPS if group == 'all' else [group]):
+            result[name] = parse(value)
+    return result
+
+
+if __name__ == "__main__":
+    """
+    Runs the optimiser and the web server against a local fake of the Tesla API, measuring the throughput and tail
+    latency of the optimiser's ticks and the server's endpoints without touching the real car. The fake api can be
+    made slow, unreliable or sleepy to see how the optimiser copes.
+    """
+    parser = argparse.ArgumentParser(description='Load test the optimiser and server against a fake Tesla API')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='The time in seconds to run for')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='The number of clients requesting the server at the same time')
+    parser.add_argument('--vehicles', type=int, default=1,
+                        help='The number of cars in the fake account')
+    parser.add_argument('--poll-interval', type=float, default=0,
+                        help='The time in seconds between optimiser ticks, 0 to run them back to back')
+    parser.add_argument('--latency', action='append', metavar='GROUP=MEDIAN[:SIGMA]',
+                        help=f"The response time of an endpoint group ({','.join(ENDPOINT_GROUPS)} or all), "
+                             f"log-normal in seconds. Can be repeated.")
+    parser.add_argument('--error-rate', action='append', metavar='GROUP=RATE',
+                        help='The fraction of requests to an endpoint group that fail. Can be repeated.')
+    parser.add_argument('--error-status', type=int, default=503,
+                        help='The status code of a failed request')
+    parser.add_argument('--sleep-after', type=float, default=600,
+                        help='The time in seconds without requests before a car that is not charging falls asleep')
+    parser.add_argument('--wake-up-seconds', type=float, default=10,
+                        help='The time in seconds a car takes to wake up')
+    parser.add_argument('--samples', type=str,
+                        help='A data.csv or log_difference.txt file to play back as the solar profile')
+    parser.add_argument('--time-scale', type=float, default=60,
+                        help='The number of simulated seconds of the solar profile that pass each real second')
+    parser.add_argument('--seed', type=int,
+                        help='The seed for the random latencies and errors')
+    parser.add_argument('--port', type=int, default=5055,
+                        help='The port for the web server')
+    parser.add_argument('--production', action='store_true',
+                        help='Run the web server under gunicorn')
+    parser.add_argument('--no-server', action='store_true',
+                        help='Only run the optimiser')
+    parser.add_argument('--no-optimiser', action='store_true',
+                        help='Only run the web server, it serves the state the optimiser wrote when it started')
+    args = parser.parse_args()
+
+    service = FakeTeslaService(
+        samples=load_samples(args.samples) if args.samples is not None else None,
+        time_scale=args.time_scale,
+        vehicle_count=args.vehicles,
+        latencies=group_values(args.latency, LatencyDistribution.parse),
+        error_rates=group_values(args.error_rate, float),
+        error_status=args.error_status,
+        sleep_after=args.sleep_after,
+        wake_up_seconds=args.wake_up_seconds,
+        seed=args.seed)
+
+    # The optimiser and server share their files in a scratch directory, as they would in the repo directory
+    os.chdir(tempfile.mkdtemp(prefix='tso_load_test_'))
+    print(f"Working in {os.getcwd()}")
+    ForceChargeCommand().save()
+    username = 'load-test@example.com'
+    use_fake_service(service.start(), username)
+
+    optimiser = create_optimiser(username, vehicle_count=args.vehicles)
+    # The first tick writes the state so the server has something to serve
+    optimiser.tick()
+
+    results = []
+    optimiser_thread = None
+    if not args.no_optimiser:
+        def run():
+            results.append(run_optimiser(optimiser, args.duration, args.poll_interval))
+        optimiser_thread = threading.Thread(target=run, name='optimiser')
+        optimiser_thread.start()
+
+    server = None
+    try:
+        if not args.no_server:
+            server = start_server(args.port, args.production)
+            results.extend(run_server_load(f'http://127.0.0.1:{args.port}', args.duration, args.clients))
+        if optimiser_thread is not None:
+            optimiser_thread.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        service.stop()
+
+    for summary in results:
+        print(summary)
+    print()
+    print('Fake Tesla API requests')
+    for group, count, errors in service_counts(service):
+        print(f"{group.ljust(15)} | {f'{count} requests'.ljust(15)} | {errors} injected errors")
+    print()
+    print('Optimiser errors')
+    for line in optimiser.metrics.render().splitlines():
+        if line.startswith(('tso_request_', 'tesla_api_errors_total', 'tesla_api_retries_total',
+                            'tesla_vehicle_wake_ups_total', 'tso_commands_total')):
+            print(line)
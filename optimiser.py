@@ -1,8 +1,9 @@
 import argparse
-from optimiser.tesla_api import TeslaAPI
-from optimiser.tesla_solar_optimiser import TeslaSolarOptimiser
-from optimiser.console_logger import ConsoleLogger
-from optimiser.local_file_logger import LocalFileLogger
+from optimiser.comm import create_comm
+from optimiser.metrics import MetricsRegistry
+from optimiser.optimiser_app import build_optimiser
+from optimiser.tick_profiler import MODES, SAMPLING
+from optimiser.vehicle import Vehicle
 
 
 if __name__ == "__main__":
@@ -14,17 +15,37 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Boot the TSO servers')
     parser.add_argument('username', type=str,
                         help='The username used for the Tesla API')
+    parser.add_argument('--comm-type', type=str,
+                        help='How the state is shared with the server, LOCAL for shared memory or FILE (default)')
+    parser.add_argument('--car', type=Vehicle.parse, action='append', dest='vehicles', metavar='CAR',
+                        help='A car to charge as INDEX[:PRIORITY[:CHARGE_TARGET]], repeat to split the spare capacity '
+                             'between several cars. Defaults to the first car.')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics at /metrics on this port')
+    parser.add_argument('--forecast', action='store_true',
+                        help='Set the charging amps from a forecast of the spare capacity rather than its average')
+    parser.add_argument('--profile', nargs='?', const=SAMPLING, choices=MODES,
+                        help='Profile each tick with the sampling profiler (default) or cProfile and track its memory')
+    parser.add_argument('--profile-dir', type=str, default='profiles',
+                        help='The directory the profiles of the latest ticks are written to')
+    parser.add_argument('--profile-keep', type=int, default=100,
+                        help='The number of ticks to keep the profiles of')
     args = parser.parse_args()
 
-    # The data logger logs the state to a csv file
-    data_logger = LocalFileLogger('data.csv', include_timestamp=False)
-    tso = TeslaSolarOptimiser(
-        tesla_api=TeslaAPI(username=args.username),
-        data_logger=data_logger)
+    # The api and the optimiser record their metrics in the same registry
+    metrics = MetricsRegistry()
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
 
-    # Also log messages to the console and a file output
-    tso.attach_logger(ConsoleLogger())
-    tso.attach_logger(LocalFileLogger('log.txt', 'errors.txt'))
+    tso = build_optimiser(
+        username=args.username,
+        comm=create_comm(args.comm_type),
+        metrics=metrics,
+        vehicles=args.vehicles,
+        forecast=args.forecast,
+        profile=args.profile,
+        profile_dir=args.profile_dir,
+        profile_keep=args.profile_keep)
 
     # Connect the api and run the loop to check status and make decisions
     tso.connect()
@@ -0,0 +1,291 @@
+import datetime
+import json
+import os
+import platform
+import tempfile
+import timeit
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from optimiser.file_comm import FileComm
+from optimiser.force_charge_command import ForceChargeCommand
+from optimiser.local_file_logger import LocalFileLogger
+from optimiser.metrics import MetricsRegistry
+from optimiser.replay import ReplayOptimiser
+from optimiser.sample_store import SampleStore
+from optimiser.simulated_tesla_api import SimulatedClock, SimulatedTeslaAPI
+from optimiser.solar_charge_state import SolarChargeState
+from optimiser.spare_capacity_forecaster import SpareCapacityForecaster
+
+DEFAULT_HISTORY_COUNTS = (30, 300, 3000)
+# A charging afternoon with some cloud, so the decisions take the charging branch
+BASE_LOAD = 600
+GENERATION = 3200
+
+
+@dataclass
+class BenchmarkResult:
+    """
+    The time taken by one benchmark
+
+    Args:
+        name: The name of the benchmark, including its parameters
+        seconds: The fastest time in seconds of one call, the least disturbed by other work on the machine
+        mean_seconds: The mean time in seconds of one call over every repeat
+        calls: The number of calls timed in each repeat
+        repeats: The number of repeats
+    """
+    name: str
+    seconds: float
+    mean_seconds: float
+    calls: int
+    repeats: int
+
+
+def filled_solar_charge_state(history_count: int) -> SolarChargeState:
+    """
+    Creates a solar charge state with a full spare capacity history
+    Args:
+        history_count: The number of samples in the history
+
+    Returns:
+        The solar charge state
+    """
+    solar_charge_state = SolarChargeState(
+        current_load=BASE_LOAD,
+        current_generation=GENERATION,
+        charge_state='Charging',
+        charge_current_request=8,
+        vehicle_charge=60,
+        battery_charge=100,
+        history_count=history_count)
+    start = datetime.datetime(2022, 3, 27, 12).timestamp()
+    for i in range(history_count):
+        solar_charge_state.update_spare_capacity(start + i * 10, GENERATION - BASE_LOAD + (i * 137) % 800 - 400)
+    return solar_charge_state
+
+
+def benchmarks(
+        directory: str,
+        history_counts: Sequence[int] = DEFAULT_HISTORY_COUNTS,
+        latency: float = 0.01) -> Iterator[Tuple[str, Callable]]:
+    """
+    The per tick work of the optimiser to time
+    Args:
+        directory: A directory for the files a full tick writes
+        history_counts: The sizes of spare capacity history to time each benchmark with
+        latency: The time in seconds each request takes in the full tick
+
+    Returns:
+        The name and the function to time of each benchmark
+    """
+    for history_count in history_counts:
+        solar_charge_state = filled_solar_charge_state(history_count)
+        suffix = f"[history_count={history_count}]"
+        yield f"solar_charge_state.str{suffix}", solar_charge_state.__str__
+        yield f"solar_charge_state.csv{suffix}", lambda state=solar_charge_state: state.csv
+        yield f"solar_charge_state.json{suffix}", lambda state=solar_charge_state: state.json
+        yield f"solar_charge_state.avg_spare_capacity{suffix}", lambda state=solar_charge_state: state.avg_spare_capacity
+
+        clock, optimiser = simulated_optimiser(history_count)
+        yield f"determine_command{suffix}", SimulatedTick(clock, optimiser, decision_only=True)
+
+        clock, optimiser = simulated_optimiser(history_count, forecaster=SpareCapacityForecaster())
+        yield f"determine_command_forecast{suffix}", SimulatedTick(clock, optimiser, decision_only=True)
+
+        path = os.path.join(directory, str(history_count))
+        os.makedirs(path, exist_ok=True)
+        clock, optimiser = simulated_optimiser(history_count, latency=latency, directory=path)
+        yield f"tick[history_count={history_count},latency={latency}]", SimulatedTick(clock, optimiser)
+
+
+def simulated_optimiser(
+        history_count: int,
+        latency: float = 0,
+        directory: Optional[str] = None,
+        forecaster: SpareCapacityForecaster = None) -> Tuple[SimulatedClock, ReplayOptimiser]:
+    """
+    Creates an optimiser for a simulated car that is charging
+    Args:
+        history_count: The number of samples in the spare capacity history
+        latency: The time in seconds each request to the simulated api takes
+        directory: A directory to write the state, data log, messages and samples to as the optimiser would, nothing
+            is written if None
+        forecaster: The spare capacity forecaster for the optimiser
+
+    Returns:
+        The clock of the simulation and the optimiser
+    """
+    clock = SimulatedClock(datetime.datetime(2022, 3, 27, 12))
+    tesla_api = SimulatedTeslaAPI(clock, charge_state='Charging', charge_current_request=8, latency=latency)
+    tesla_api.set_sample(BASE_LOAD, GENERATION, 100)
+
+    options = {}
+    if directory is not None:
+        options = {
+            'comm': FileComm(os.path.join(directory, 'current_state.json')),
+            'data_logger': LocalFileLogger(
+                os.path.join(directory, 'data.csv'), include_timestamp=False, buffered=True),
+            'sample_store': SampleStore(os.path.join(directory, 'data'))}
+    optimiser = ReplayOptimiser(
+        force_charge_command=ForceChargeCommand(min_vehicle_charge=0),
+        tesla_api=tesla_api,
+        clock=clock.now,
+        metrics=MetricsRegistry(),
+        forecaster=forecaster,
+        **options)
+    optimiser.solar_charge_state = filled_solar_charge_state(history_count)
+    if directory is not None:
+        optimiser.attach_logger(LocalFileLogger(
+            os.path.join(directory, 'log.txt'), os.path.join(directory, 'errors.txt'), buffered=True))
+    return clock, optimiser
+
+
+class SimulatedTick:
+
+    def __init__(self, clock: SimulatedClock, optimiser: ReplayOptimiser, decision_only: bool = False):
+        """
+        Runs ticks of an optimiser, moving the simulated clock on by a poll each time
+        Args:
+            clock: The clock of the simulation
+            optimiser: The optimiser to tick
+            decision_only: If True only the charging decision is made, otherwise the state is fetched, published and
+                logged as well
+        """
+        self.clock = clock
+        self.optimiser = optimiser
+        self.decision_only = decision_only
+
+    def __call__(self):
+        self.clock.set(self.clock.now() + datetime.timedelta(seconds=10))
+        if self.decision_only:
+            self.optimiser._determine_command()
+        else:
+            self.optimiser.tick()
+
+    def close(self):
+        """ Closes any files the optimiser writes to """
+        for logger in self.optimiser._loggers + [self.optimiser.data_logger]:
+            if logger is not None:
+                logger.close()
+        if self.optimiser.sample_store is not None:
+            self.optimiser.sample_store.close()
+
+
+def run_benchmarks(
+        history_counts: Sequence[int] = DEFAULT_HISTORY_COUNTS,
+        latency: float = 0.01,
+        repeats: int = 5,
+        name_filter: Optional[str] = None) -> List[BenchmarkResult]:
+    """
+    Times each benchmark. The number of calls in a repeat is picked so a repeat takes at least 0.2 seconds.
+    Args:
+        history_counts: The sizes of spare capacity history to time each benchmark with
+        latency: The time in seconds each request takes in the full tick
+        repeats: The number of times each benchmark is timed
+        name_filter: Only run the benchmarks with this text in their name, all are run if None
+
+    Returns:
+        The result of each benchmark
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, function in benchmarks(directory, history_counts, latency):
+            if name_filter is None or name_filter in name:
+                timer = timeit.Timer(function)
+                calls, _ = timer.autorange()
+                times = [total / calls for total in timer.repeat(repeat=repeats, number=calls)]
+                results.append(BenchmarkResult(name, min(times), sum(times) / len(times), calls, repeats))
+            if isinstance(function, SimulatedTick):
+                function.close()  # Before the directory is removed
+    return results
+
+
+def save_results(results: List[BenchmarkResult], path: str):
+    """
+    Saves benchmark results to a json file
+    Args:
+        results: The results to save
+        path: The path of the file
+    """
+    with open(path, 'w') as results_file:
+        json.dump({
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': [asdict(result) for result in results]}, results_file, indent=2)
+
+
+def load_results(path: str) -> Dict[str, BenchmarkResult]:
+    """
+    Loads benchmark results saved by save_results
+    Args:
+        path: The path of the file
+
+    Returns:
+        The results by benchmark name
+    """
+    with open(path) as results_file:
+        return {result['name']: BenchmarkResult(**result) for result in json.load(results_file)['results']}
+
+
+def find_regressions(
+        results: List[BenchmarkResult],
+        baseline: Dict[str, BenchmarkResult],
+        threshold: float = 0.2) -> List[BenchmarkResult]:
+    """
+    Finds the benchmarks that have got slower than the baseline
+    Args:
+        results: The latest results
+        baseline: The baseline results by benchmark name
+        threshold: The fraction slower than the baseline that counts as a regression
+
+    Returns:
+        The results that are slower than their baseline by more than the threshold
+    """
+    return [
+        result for result in results
+        if result.name in baseline and result.seconds > baseline[result.name].seconds * (1 + threshold)]
+
+
+def format_report(
+        results: List[BenchmarkResult],
+        baseline: Optional[Dict[str, BenchmarkResult]] = None,
+        threshold: float = 0.2) -> str:
+    """
+    Formats the results as a table, compared with the baseline if there is one
+    Args:
+        results: The latest results
+        baseline: The baseline results by benchmark name
+        threshold: The fraction slower than the baseline that counts as a regression
+
+    Returns:
+        The table as text
+    """
+    baseline = baseline or {}
+    regressions = {result.name for result in find_regressions(results, baseline, threshold)}
+    width = max([len(result.name) for result in results] + [9])
+    header = f"{'Benchmark'.ljust(width)} | {'Best'.ljust(10)} | {'Mean'.ljust(10)} | {'Baseline'.ljust(10)} | Change"
+    lines = [header, '-' * len(header)]
+    for result in results:
+        change = ''
+        baseline_time = ''
+        if result.name in baseline:
+            baseline_seconds = baseline[result.name].seconds
+            baseline_time = _format_time(baseline_seconds)
+            change = f"{(result.seconds / baseline_seconds - 1) * 100:+.1f}%"
+            if result.name in regressions:
+                change += ' REGRESSION'
+        lines.append(
+            f"{result.name.ljust(width)} | {_format_time(result.seconds).ljust(10)} | "
+            f"{_format_time(result.mean_seconds).ljust(10)} | {baseline_time.ljust(10)} | {change}")
+    return '\n'.join(lines)
+
+
+def _format_time(seconds: float) -> str:
+    """ Formats a time with the unit that suits its size """
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.2f} us"
@@ -0,0 +1,67 @@
+import datetime
+import hashlib
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+
+class CachedFile:
+
+    def __init__(self, path: str, check_interval: float = 0.25):
+        """
+        Keeps the contents of a file in memory and only reads it again when its modified time or size changes
+        Args:
+            path: The path of the file
+            check_interval: The minimum time in seconds between checking if the file has changed
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._next_check = 0.0
+        self._content: Optional[str] = None
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[datetime.datetime] = None
+
+    def read(self) -> Tuple[str, str, datetime.datetime]:
+        """
+        Gets the contents of the file, reading it again if it has changed
+        Returns:
+            The contents, an etag that changes with the contents and the time the file was last modified
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist and has never been read
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._content is None or now >= self._next_check:
+                self._next_check = now + self.check_interval
+                self._reload()
+            return self._content, self._etag, self._last_modified
+
+    def invalidate(self):
+        """ Checks the file for changes on the next read, e.g. after this process has written to it """
+        with self._lock:
+            self._next_check = 0.0
+
+    def _reload(self):
+        """ Reads the file if its modified time, size or inode has changed since it was last read """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._content is None:
+                raise
+            return  # Keep serving the last contents, the file may be in the middle of being replaced
+
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature == self._signature:
+            return
+
+        with open(self.path) as data_file:
+            content = data_file.read()
+        self._signature = signature
+        if content != self._content:
+            self._content = content
+            self._etag = hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+            self._last_modified = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc)
@@ -0,0 +1,27 @@
+from typing import TYPE_CHECKING, Optional, Union
+if TYPE_CHECKING:  # The comm modules are only imported when they are used
+    from optimiser.file_comm import FileComm
+    from optimiser.memory_comm import MemoryComm
+    from optimiser.shared_memory_comm import SharedMemoryComm
+
+
+def create_comm(comm_type: Optional[str] = None) -> Union['FileComm', 'SharedMemoryComm', 'MemoryComm']:
+    """
+    Creates the communication between the optimiser and the server
+    Args:
+        comm_type: LOCAL to share memory between processes on this machine, MEMORY when both run in this process,
+            FILE or None to use json files
+
+    Returns:
+        The comm object used by both processes
+    """
+    if comm_type is None or comm_type.upper() == 'FILE':
+        from optimiser.file_comm import FileComm
+        return FileComm()
+    if comm_type.upper() == 'LOCAL':
+        from optimiser.shared_memory_comm import SharedMemoryComm
+        return SharedMemoryComm()
+    if comm_type.upper() == 'MEMORY':
+        from optimiser.memory_comm import MemoryComm
+        return MemoryComm()
+    raise ValueError(f"Comm type {comm_type} is not supported, use LOCAL, MEMORY or FILE")
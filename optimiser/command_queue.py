@@ -0,0 +1,118 @@
+import datetime
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from optimiser.solar_charge_state import SolarChargeState
+
+# Commands that can't both be sent in one batch, the later one replaces the earlier one
+CONFLICTING_COMMANDS = {
+    'START_CHARGE': 'STOP_CHARGE',
+    'STOP_CHARGE': 'START_CHARGE',
+}
+
+
+@dataclass
+class QueuedCommand:
+    """
+    A command waiting to be sent to the car
+
+    Args:
+        command: The command to send
+        kwargs: Any additional parameters required with the command
+        message: A message to log when the command succeeds, the command is logged if None
+        severity: The severity of the log message
+        force_command: If True the command is sent even if one of its type was sent recently
+    """
+    command: str
+    kwargs: Dict = field(default_factory=dict)
+    message: Optional[str] = None
+    severity: str = 'DEBUG'
+    force_command: bool = False
+
+
+class CommandQueue:
+
+    def __init__(self, new_command_interval: int = 120):
+        """
+        Collects the commands decided on in a tick so they can be sent as one batch. Commands that replace each other
+        are merged, commands that wouldn't change the car are dropped and each type of command is only sent once per
+        new_command_interval.
+        Args:
+            new_command_interval: The time in seconds to wait between sending commands of the same type
+        """
+        self.new_command_interval = new_command_interval
+        self.last_command_times: Dict[str, datetime.datetime] = {}
+        self._queue: List[QueuedCommand] = []
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, command: str, message: str = None, severity: str = 'DEBUG', force_command: bool = False, **kwargs):
+        """
+        Queues a command, replacing any queued command it makes redundant
+        Args:
+            command: The command to send
+            message: A message to log when the command succeeds, the command is logged if None
+            severity: The severity of the log message
+            force_command: If True the command is sent even if one of its type was sent recently
+            **kwargs: Any additional parameters required with the command
+        """
+        # Only the latest of a type of command matters, e.g. the last charging amps decided on
+        replaced = (command, CONFLICTING_COMMANDS.get(command))
+        self._queue = [queued for queued in self._queue if queued.command not in replaced]
+        self._queue.append(QueuedCommand(command, kwargs, message, severity, force_command))
+
+    def secs_since_last_command(self, command: str, now: datetime.datetime) -> Optional[float]:
+        """ Returns the number of seconds since a type of command was last sent, None if it hasn't been """
+        last_command_time = self.last_command_times.get(command)
+        if last_command_time is None:
+            return None
+        return (now - last_command_time).total_seconds()
+
+    def commands_allowed(self, command: str, now: datetime.datetime) -> bool:
+        """ Returns true if a type of command can be sent """
+        secs_since_last_command = self.secs_since_last_command(command, now)
+        return secs_since_last_command is None or secs_since_last_command > self.new_command_interval
+
+    @staticmethod
+    def is_no_op(queued: QueuedCommand, solar_charge_state: SolarChargeState) -> bool:
+        """
+        Checks if the car is already in the state a command would put it in
+        Args:
+            queued: The command
+            solar_charge_state: The last known state of the car
+
+        Returns:
+            True if sending the command wouldn't change anything
+        """
+        if queued.command == 'START_CHARGE':
+            return solar_charge_state.charge_state == 'Charging'
+        if queued.command == 'STOP_CHARGE':
+            return solar_charge_state.charge_state in ('Stopped', 'Complete', 'Disconnected')
+        if queued.command == 'CHARGING_AMPS':
+            return queued.kwargs.get('charging_amps') == solar_charge_state.charge_current_request
+        if queued.command == 'CHARGE_PORT_DOOR_OPEN':
+            return solar_charge_state.port_open is True
+        return False
+
+    def take(self, solar_charge_state: SolarChargeState, now: datetime.datetime) -> List[QueuedCommand]:
+        """
+        Empties the queue, returning the commands that should be sent in the order they were queued. The commands
+        are recorded as sent at now.
+        Args:
+            solar_charge_state: The last known state of the car, used to drop commands that wouldn't change it
+            now: The current time
+
+        Returns:
+            The commands to send
+        """
+        commands = []
+        for queued in self._queue:
+            if self.is_no_op(queued, solar_charge_state):
+                continue
+            if not queued.force_command and not self.commands_allowed(queued.command, now):
+                continue
+            self.last_command_times[queued.command] = now
+            commands.append(queued)
+        self._queue = []
+        return commands
@@ -0,0 +1,295 @@
+import dataclasses
+import datetime
+import json
+import types
+import typing
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Type, TypeVar
+
+T = TypeVar('T')
+
+# The key the schema version is written under
+VERSION_KEY = '_version'
+# Older files and the web app write times in this format as well as timestamps and ISO strings
+DISPLAY_TIME_FORMAT = '%d/%m/%Y %H:%M:%S'
+_ENCODER = 'dataclass_codec_encoder'
+_DECODER = 'dataclass_codec_decoder'
+# Optional[X] and Union[X, Y] are typing.Union, X | None is types.UnionType
+_UNION_TYPES = (typing.Union, types.UnionType)
+
+
+def codec_field(encoder: Callable[[Any], Any] = None, decoder: Callable[[Any], Any] = None) -> Dict[str, Callable]:
+    """
+    Overrides how a field is converted, for types the codec doesn't know about
+    e.g. field(default=None, metadata=codec_field(encoder=..., decoder=...))
+    Args:
+        encoder: Converts the field's value to json compatible values
+        decoder: Converts the json compatible values back to the field's value
+
+    Returns:
+        The metadata for the field
+    """
+    metadata = {}
+    if encoder is not None:
+        metadata[_ENCODER] = encoder
+    if decoder is not None:
+        metadata[_DECODER] = decoder
+    return metadata
+
+
+class DataclassCodec:
+
+    def __init__(self, cls: type):
+        """
+        Converts a dataclass to and from json compatible dicts. The schema is read once and compiled into an encode
+        and a decode function that only do the conversions each field needs, rather than inspecting the types of
+        every value on every call. Handles datetimes, deques, lists, tuples, dicts, Optional and nested dataclasses.
+        A decoded deque has the maxlen of the field's default, so a bounded history stays bounded.
+
+        The data is written with the class's schema_version. Data written by an older version is upgraded with the
+        class's migrations, a dict of functions that each take the data of a version and return it as the next one.
+        Data without a version is version 1. Keys that aren't fields are ignored and missing fields take their
+        defaults, so adding or removing a field doesn't need a migration.
+        Args:
+            cls: The dataclass
+        """
+        if not dataclasses.is_dataclass(cls):
+            raise TypeError(f"{cls.__name__} is not a dataclass")
+        self.cls = cls
+        self.version: int = getattr(cls, 'schema_version', 1)
+        self.migrations: Dict[int, Callable[[Dict], Dict]] = getattr(cls, 'migrations', {})
+        self.encode: Callable[[Any], Dict] = None
+        self._decode: Callable[[Dict], Any] = None
+        self._compile()
+
+    def decode(self, data: Dict) -> Any:
+        """
+        Creates an instance of the dataclass from a dict created by encode
+        Args:
+            data: The dict
+
+        Returns:
+            The instance
+        """
+        version = data.get(VERSION_KEY, 1)
+        if version != self.version:
+            data = self._migrate(data, version)
+        return self._decode(data)
+
+    def to_json(self, obj: Any) -> str:
+        """ Encodes an instance of the dataclass as a json string """
+        return json.dumps(self.encode(obj))
+
+    def from_json(self, text: str) -> Any:
+        """ Decodes an instance of the dataclass from a json string """
+        return self.decode(json.loads(text))
+
+    def _compile(self):
+        """ Generates the encode and decode functions for the fields of the dataclass """
+        namespace: Dict[str, Any] = {'cls': self.cls}
+        hints = typing.get_type_hints(self.cls)
+        encode_items = [f"{VERSION_KEY!r}: {self.version}"]
+        decode_lines = []
+        post_init_lines = []
+        for index, data_field in enumerate(dataclasses.fields(self.cls)):
+            name = data_field.name
+            encoder = data_field.metadata.get(_ENCODER) or _encoder_for(hints.get(name, Any))
+            decoder = data_field.metadata.get(_DECODER) or _decoder_for(
+                hints.get(name, Any), maxlen=_default_maxlen(data_field, hints.get(name, Any)))
+
+            value = f"obj.{name}"
+            if encoder is not None:
+                namespace[f'encode_{index}'] = encoder
+                value = f"encode_{index}({value})"
+            encode_items.append(f"{name!r}: {value}")
+
+            value = f"data[{name!r}]"
+            if decoder is not None:
+                namespace[f'decode_{index}'] = decoder
+                value = f"decode_{index}({value})"
+            if data_field.init:
+                decode_lines.append(f"    if {name!r} in data: kwargs[{name!r}] = {value}")
+            else:
+                post_init_lines.append(f"    if {name!r} in data: obj.{name} = {value}")
+
+        source = '\n'.join(
+            ["def encode(obj):", f"    return {{{', '.join(encode_items)}}}",
+             "def decode(data):", "    kwargs = {}"]
+            + decode_lines
+            + ["    obj = cls(**kwargs)"]
+            + post_init_lines
+            + ["    return obj"])
+        exec(compile(source, f"<dataclass_codec {self.cls.__qualname__}>", 'exec'), namespace)
+        self.encode = namespace['encode']
+        self._decode = namespace['decode']
+
+    def _migrate(self, data: Dict, version: int) -> Dict:
+        """
+        Upgrades data written by another version of the schema
+        Args:
+            data: The data
+            version: The version the data was written by
+
+        Returns:
+            The data as the current version would write it
+
+        Raises:
+            ValueError: If the data was written by a newer version, or there is no migration from its version
+        """
+        if version > self.version:
+            raise ValueError(
+                f"{self.cls.__name__} data is version {version}, newer than the supported version {self.version}")
+        while version < self.version:
+            if version not in self.migrations:
+                raise ValueError(f"{self.cls.__name__} has no migration from version {version}")
+            data = self.migrations[version](dict(data))
+            version += 1
+        return data
+
+
+_codecs: Dict[type, DataclassCodec] = {}
+
+
+def codec_for(cls: Type[T]) -> DataclassCodec:
+    """
+    The codec of a dataclass, compiled on first use
+    Args:
+        cls: The dataclass
+
+    Returns:
+        The codec
+    """
+    codec = _codecs.get(cls)
+    if codec is None:
+        codec = _codecs[cls] = DataclassCodec(cls)
+    return codec
+
+
+def encode_datetime(value: datetime.datetime) -> float:
+    """ Encodes a datetime as a unix timestamp """
+    return value.timestamp()
+
+
+def decode_datetime(value: Any) -> datetime.datetime:
+    """
+    Decodes a datetime from a unix timestamp, an ISO string or a string in the display format
+    Args:
+        value: The encoded datetime
+
+    Returns:
+        The datetime
+
+    Raises:
+        ValueError: If the value isn't in any of the formats
+    """
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value)
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.datetime.strptime(value, DISPLAY_TIME_FORMAT)
+
+
+def _default_maxlen(data_field: dataclasses.Field, annotation: Any) -> Optional[int]:
+    """
+    The maximum length of a deque field, taken from its default so a decoded deque is bounded like a new one
+    Args:
+        data_field: The field
+        annotation: The type of the field
+
+    Returns:
+        The maximum length, None if the field isn't a deque or its default isn't bounded
+    """
+    if typing.get_origin(annotation) in _UNION_TYPES:
+        annotation = next((arg for arg in typing.get_args(annotation) if arg is not type(None)), None)
+    if deque not in (annotation, typing.get_origin(annotation)):
+        return None
+    if data_field.default_factory is not dataclasses.MISSING:
+        default = data_field.default_factory()
+    else:
+        default = data_field.default
+    return default.maxlen if isinstance(default, deque) else None
+
+
+def _encoder_for(annotation: Any) -> Optional[Callable[[Any], Any]]:
+    """
+    Builds the function that encodes a value of a type
+    Args:
+        annotation: The type
+
+    Returns:
+        The function, None if the value can be used as it is
+    """
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin in _UNION_TYPES:
+        encoders = {_encoder_for(arg) for arg in args if arg is not type(None)}
+        if len(encoders) != 1:
+            return None  # A union of several types is only supported for json compatible values
+        encoder = encoders.pop()
+        return None if encoder is None else lambda value: None if value is None else encoder(value)
+    if annotation is datetime.datetime:
+        return encode_datetime
+    if dataclasses.is_dataclass(annotation):
+        return lambda value: codec_for(annotation).encode(value)
+    if annotation in (deque, list, tuple) or origin in (deque, list, tuple):
+        if (origin or annotation) is tuple and len(args) > 0 and args[-1] is not Ellipsis:
+            item_encoders = [_encoder_for(arg) for arg in args]
+            if all(item_encoder is None for item_encoder in item_encoders):
+                return list
+            return lambda value: [
+                item if item_encoder is None else item_encoder(item) for item_encoder, item in zip(item_encoders, value)]
+        item_encoder = _encoder_for(args[0]) if len(args) > 0 else None
+        if item_encoder is None:
+            return list
+        return lambda value: [item_encoder(item) for item in value]
+    if origin is dict and len(args) == 2:
+        item_encoder = _encoder_for(args[1])
+        if item_encoder is not None:
+            return lambda value: {key: item_encoder(item) for key, item in value.items()}
+    return None
+
+
+def _decoder_for(annotation: Any, maxlen: Optional[int] = None) -> Optional[Callable[[Any], Any]]:
+    """
+    Builds the function that decodes a value of a type
+    Args:
+        annotation: The type
+        maxlen: The maximum length of a decoded deque, None for no limit
+
+    Returns:
+        The function, None if the decoded json value can be used as it is
+    """
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin in _UNION_TYPES:
+        decoders = {_decoder_for(arg, maxlen) for arg in args if arg is not type(None)}
+        if len(decoders) != 1:
+            return None
+        decoder = decoders.pop()
+        return None if decoder is None else lambda value: None if value is None else decoder(value)
+    if annotation is datetime.datetime:
+        return decode_datetime
+    if dataclasses.is_dataclass(annotation):
+        return lambda value: codec_for(annotation).decode(value)
+    if annotation in (deque, list, tuple) or origin in (deque, list, tuple):
+        container = origin or annotation
+        if container is tuple and len(args) > 0 and args[-1] is not Ellipsis:
+            item_decoders = [_decoder_for(arg) for arg in args]
+            if all(item_decoder is None for item_decoder in item_decoders):
+                return tuple
+            return lambda value: tuple(
+                item if item_decoder is None else item_decoder(item) for item_decoder, item in zip(item_decoders, value))
+        item_decoder = _decoder_for(args[0]) if len(args) > 0 else None
+        if container is deque:
+            if item_decoder is None:
+                return lambda value: deque(value, maxlen)
+            return lambda value: deque((item_decoder(item) for item in value), maxlen)
+        if item_decoder is None:
+            return None if container is list else container
+        return lambda value: container(item_decoder(item) for item in value)
+    if origin is dict and len(args) == 2:
+        item_decoder = _decoder_for(args[1])
+        if item_decoder is not None:
+            return lambda value: {key: item_decoder(item) for key, item in value.items()}
+    return None
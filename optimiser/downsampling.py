@@ -0,0 +1,107 @@
+from typing import Dict, List, Sequence
+import numpy as np
+
+# The sample fields that can be requested as chart series
+SERIES_NAMES = ('load', 'generation', 'spare_capacity', 'amps')
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Chooses the points that best keep the shape of a series with Largest-Triangle-Three-Buckets. The first and last
+    points are always kept, every other bucket keeps the point that makes the largest triangle with the point kept
+    from the previous bucket and the average of the next bucket.
+    Args:
+        x: The x values in ascending order
+        y: The y values
+        points: The number of points to keep
+
+    Returns:
+        The indices of the kept points in ascending order
+    """
+    count = len(x)
+    if points >= count:
+        return np.arange(count)
+    if points < 3:  # Not enough points for a bucket between the first and last
+        return np.linspace(0, count - 1, max(points, 0)).astype(int)
+
+    # Every point except the first and last is split into points - 2 buckets
+    edges = np.linspace(1, count - 1, points - 1).astype(int)
+    indices = np.empty(points, dtype=int)
+    indices[0] = 0
+    indices[-1] = count - 1
+
+    selected = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        # Twice the triangle area, the constant factor doesn't change which point is largest
+        areas = np.abs(
+            (x[selected] - next_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+
+    return indices
+
+
+def min_max_indices(y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Chooses the minimum and maximum point of each of points / 2 equal buckets, so no peak or trough is lost
+    Args:
+        y: The y values
+        points: The number of points to keep
+
+    Returns:
+        The indices of the kept points in ascending order
+    """
+    count = len(y)
+    buckets = points // 2
+    if points >= count or buckets < 1:
+        return np.arange(min(count, max(points, 0)))
+
+    edges = np.linspace(0, count, buckets + 1).astype(int)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        indices.append(start + int(np.argmin(bucket)))
+        indices.append(start + int(np.argmax(bucket)))
+    return np.unique(indices)
+
+
+def downsample(
+        samples: np.ndarray,
+        points: int,
+        method: str = 'lttb',
+        series: Sequence[str] = SERIES_NAMES) -> Dict[str, List[Dict[str, float]]]:
+    """
+    Reduces samples to a number of points per series that a chart can draw quickly. Each series is downsampled on
+    its own so the points that define its shape are kept.
+    Args:
+        samples: A structured array of samples in time order with a timestamp field
+        points: The maximum number of points in each series
+        method: 'lttb' to keep the visual shape or 'minmax' to keep the minimum and maximum of each bucket
+        series: The fields of the samples to return
+
+    Returns:
+        Each series as a list of {timestamp, value} entries, the same form as the spare capacity history
+    """
+    if method not in ('lttb', 'minmax'):
+        raise ValueError(f"Downsampling method {method} is not supported, use lttb or minmax")
+
+    timestamps = np.asarray(samples['timestamp'], dtype=np.float64)
+    result = {}
+    for name in series:
+        values = np.asarray(samples[name], dtype=np.float64)
+        if method == 'lttb':
+            indices = lttb_indices(timestamps, values, points)
+        else:
+            indices = min_max_indices(values, points)
+        result[name] = [
+            {'timestamp': timestamp, 'value': value}
+            for timestamp, value in zip(timestamps[indices].tolist(), values[indices].tolist())]
+    return result
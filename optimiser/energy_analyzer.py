@@ -0,0 +1,372 @@
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from optimiser.file_comm import write_atomic
+
+CHECKPOINT_VERSION = 1
+# A command logged when it was sent, with the car's name first when there is more than one car
+COMMAND_PATTERN = re.compile(
+    r'^(?:[^:|]+: )?(?:(START_CHARGE|STOP_CHARGE|CHARGE_PORT_DOOR_OPEN)|Setting (CHARGING) (AMPS) to \d+)$')
+ERROR_TYPES = (
+    ('battery', 'Could not connect to battery'),
+    ('car', 'Could not connect to car'),
+    ('timeout', 'did not arrive within'),
+    ('tick_budget', 'The tick ran out of time'))
+
+
+@dataclass
+class EnergySummary:
+    """
+    The charging and the optimiser's activity over a period
+
+    Args:
+        period: The hour as YYYY-MM-DD HH or the day as YYYY-MM-DD
+        ticks: The number of samples in data.csv, one per tick of the optimiser
+        hours: The time covered by the samples in hours, gaps where the optimiser was off aren't counted
+        charging_hours: The time the car was charging in hours
+        car_energy: The energy in kWh charged into the car
+        solar_energy: The energy in kWh charged into the car from spare solar
+        grid_energy: The energy in kWh charged into the car that wasn't covered by spare solar, i.e. imported from
+            the grid or the powerwall while charging
+        powerwall_charged: The total rise in the powerwall charge in percentage points
+        powerwall_discharged: The total fall in the powerwall charge in percentage points
+        commands: The number of commands sent of each type
+        errors: The number of errors of each type logged to errors.txt
+    """
+    period: str
+    ticks: int = 0
+    hours: float = 0
+    charging_hours: float = 0
+    car_energy: float = 0
+    solar_energy: float = 0
+    grid_energy: float = 0
+    powerwall_charged: float = 0
+    powerwall_discharged: float = 0
+    commands: Dict[str, int] = field(default_factory=dict)
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def powerwall_cycles(self) -> float:
+        """ The number of full discharges the powerwall's discharging adds up to """
+        return self.powerwall_discharged / 100
+
+    @property
+    def error_count(self) -> int:
+        """ The number of errors of every type """
+        return sum(self.errors.values())
+
+    @property
+    def error_rate(self) -> float:
+        """ The number of errors per tick """
+        return self.error_count / self.ticks if self.ticks > 0 else 0
+
+    def add(self, other: 'EnergySummary'):
+        """
+        Adds the totals of another period to this one, e.g. to build a day from its hours
+        Args:
+            other: The period to add
+        """
+        self.ticks += other.ticks
+        self.hours += other.hours
+        self.charging_hours += other.charging_hours
+        self.car_energy += other.car_energy
+        self.solar_energy += other.solar_energy
+        self.grid_energy += other.grid_energy
+        self.powerwall_charged += other.powerwall_charged
+        self.powerwall_discharged += other.powerwall_discharged
+        self.commands = dict(Counter(self.commands) + Counter(other.commands))
+        self.errors = dict(Counter(self.errors) + Counter(other.errors))
+
+    def __str__(self) -> str:
+        commands = ', '.join(f"{command}: {count}" for command, count in sorted(self.commands.items()))
+        return f"{self.period.ljust(13)} | " \
+               f"{f'Car: {self.car_energy:.2f} kWh'.ljust(17)} | " \
+               f"{f'Solar: {self.solar_energy:.2f} kWh'.ljust(19)} | " \
+               f"{f'Grid: {self.grid_energy:.2f} kWh'.ljust(18)} | " \
+               f"{f'Powerwall: {self.powerwall_cycles:.2f} cycles'.ljust(23)} | " \
+               f"{f'Errors: {self.error_count} ({self.error_rate:.1%})'.ljust(20)} | " \
+               f"Commands: {sum(self.commands.values())} {commands}"
+
+
+class DataRow(NamedTuple):
+    """ A line of data.csv, the load includes the car """
+    time: datetime.datetime
+    charge_state: str
+    load: float
+    generation: float
+    charge_current_request: float
+    battery_charge: float
+
+
+class Checkpoint:
+
+    def __init__(self):
+        """
+        How far the analysis has got, so the next run only reads the lines appended since. Files are recognised by
+        a hash of their first line, so a file that has been rotated, renamed or compressed is still recognised.
+        """
+        self.files: Dict[str, Dict] = {}
+        self.last_row: Optional[DataRow] = None
+        self.hours: Dict[str, EnergySummary] = {}
+
+    @classmethod
+    def load(cls, path: str) -> 'Checkpoint':
+        """
+        Loads a checkpoint saved by save
+        Args:
+            path: The path of the checkpoint file
+
+        Returns:
+            The checkpoint, an empty one if the file doesn't exist or is from another version
+        """
+        checkpoint = cls()
+        if not os.path.exists(path):
+            return checkpoint
+        with open(path) as checkpoint_file:
+            data = json.load(checkpoint_file)
+        if data.get('version') != CHECKPOINT_VERSION:
+            return checkpoint
+        checkpoint.files = data['files']
+        if data['last_row'] is not None:
+            time, *values = data['last_row']
+            checkpoint.last_row = DataRow(datetime.datetime.fromisoformat(time), *values)
+        checkpoint.hours = {summary['period']: EnergySummary(**summary) for summary in data['hours']}
+        return checkpoint
+
+    def save(self, path: str):
+        """
+        Saves the checkpoint, replacing the file in one step so an interrupted run leaves the last one in place
+        Args:
+            path: The path of the checkpoint file
+        """
+        last_row = None
+        if self.last_row is not None:
+            last_row = [self.last_row.time.isoformat()] + list(self.last_row[1:])
+        write_atomic(path, json.dumps({
+            'version': CHECKPOINT_VERSION,
+            'files': self.files,
+            'last_row': last_row,
+            'hours': [asdict(summary) for summary in self.hours.values()]}))
+
+
+class EnergyAnalyzer:
+
+    def __init__(
+            self,
+            directory: str = '.',
+            checkpoint_path: Optional[str] = 'analysis_checkpoint.json',
+            data_file: str = 'data.csv',
+            log_file: str = 'log.txt',
+            error_file: str = 'errors.txt',
+            voltage: int = 240,
+            max_gap: float = 300,
+            time_format: str = '%Y-%m-%dT%H:%M:%S'):
+        """
+        Summarises the optimiser's data.csv, log.txt and errors.txt by hour. The files are streamed a line at a time
+        so memory doesn't grow with their size, and rotated files next to them, plain or gzipped, are read first.
+        Args:
+            directory: The directory the optimiser writes its files to
+            checkpoint_path: The file that records the progress and the summaries so far, None to read everything
+                every time
+            data_file: The name of the data logger's csv file
+            log_file: The name of the log file, used to count the commands sent
+            error_file: The name of the error log file, used to count the errors
+            voltage: The voltage of the charger, used to convert the charging amps to W
+            max_gap: Gaps between samples longer than this many seconds aren't counted, e.g. when the optimiser was off
+            time_format: The format of the time in data.csv
+        """
+        self.directory = directory
+        self.checkpoint_path = checkpoint_path
+        self.data_file = data_file
+        self.log_file = log_file
+        self.error_file = error_file
+        self.voltage = voltage
+        self.max_gap = max_gap
+        self.time_format = time_format
+        self.checkpoint = Checkpoint.load(checkpoint_path) if checkpoint_path is not None else Checkpoint()
+
+    def update(self) -> int:
+        """
+        Reads the lines appended to the files since the last update and saves the checkpoint
+        Returns:
+            The number of lines read
+        """
+        line_count = 0
+        seen_files: Dict[str, Dict] = {}
+        for line in self._read_lines(self.data_file, seen_files):
+            self._add_data_line(line)
+            line_count += 1
+        for line in self._read_lines(self.log_file, seen_files):
+            self._add_log_line(line)
+            line_count += 1
+        for line in self._read_lines(self.error_file, seen_files):
+            self._add_error_line(line)
+            line_count += 1
+
+        # Files that have been deleted are forgotten so the checkpoint doesn't grow forever
+        self.checkpoint.files = seen_files
+        if self.checkpoint_path is not None:
+            self.checkpoint.save(self.checkpoint_path)
+        return line_count
+
+    def hourly(self) -> List[EnergySummary]:
+        """ The summary of each hour, oldest first """
+        return [self.checkpoint.hours[period] for period in sorted(self.checkpoint.hours)]
+
+    def daily(self) -> List[EnergySummary]:
+        """ The summary of each day, oldest first """
+        days: Dict[str, EnergySummary] = {}
+        for summary in self.hourly():
+            day = summary.period[:10]
+            days.setdefault(day, EnergySummary(day)).add(summary)
+        return list(days.values())
+
+    def _read_lines(self, file_name: str, seen_files: Dict[str, Dict]) -> Iterator[str]:
+        """
+        Yields the complete lines of a file and its rotated copies that haven't been read before, oldest first.
+        The progress through each file is recorded as the lines are yielded.
+        Args:
+            file_name: The name of the file in the directory
+            seen_files: The progress through every file found so far, by the hash of its first line
+
+        Returns:
+            Each new line without its line ending
+        """
+        path = os.path.join(self.directory, file_name)
+        # The logger renames rotated files with a timestamp suffix, so they sort in the order they were written
+        rotated_paths = sorted(
+            rotated_path for rotated_path in glob.glob(glob.escape(path) + '.*') if not rotated_path.endswith('.tmp'))
+        for file_path in rotated_paths + [path]:
+            is_rotated = file_path != path
+            if not os.path.exists(file_path):
+                continue
+            with (gzip.open(file_path, 'rb') if file_path.endswith('.gz') else open(file_path, 'rb')) as source:
+                fingerprint = _fingerprint(source)
+                if fingerprint is None:
+                    continue  # Empty, or the first line is still being written
+                progress = self.checkpoint.files.get(fingerprint, {'offset': 0, 'complete': False})
+                seen_files[fingerprint] = progress
+                if progress['complete']:
+                    continue
+                source.seek(progress['offset'])
+                for line in source:
+                    if not line.endswith(b'\n'):
+                        break  # Still being written, it is read next time
+                    progress['offset'] += len(line)
+                    yield line.decode(errors='replace').rstrip('\r\n')
+                # A rotated file doesn't change again so it is never opened past its first line again
+                progress['complete'] = is_rotated
+
+    def _hour(self, period: str) -> EnergySummary:
+        """ The summary of an hour, created if it doesn't exist yet """
+        summary = self.checkpoint.hours.get(period)
+        if summary is None:
+            summary = self.checkpoint.hours[period] = EnergySummary(period)
+        return summary
+
+    def _add_data_line(self, line: str):
+        """ Adds a line of data.csv to the summary of its hour """
+        row = self._parse_data_line(line)
+        if row is None:
+            return
+        self._hour(row.time.strftime('%Y-%m-%d %H')).ticks += 1
+
+        previous = self.checkpoint.last_row
+        self.checkpoint.last_row = row
+        if previous is None:
+            return
+
+        # The power during the period is taken from the sample at its start
+        summary = self._hour(previous.time.strftime('%Y-%m-%d %H'))
+        change = row.battery_charge - previous.battery_charge
+        summary.powerwall_charged += max(0.0, change)
+        summary.powerwall_discharged += max(0.0, -change)
+
+        seconds = (row.time - previous.time).total_seconds()
+        if not 0 < seconds <= self.max_gap:
+            return
+        summary.hours += seconds / 3600
+        if previous.charge_state != 'Charging':
+            return
+        car_power = previous.charge_current_request * self.voltage
+        solar_power = min(car_power, max(0.0, previous.generation - (previous.load - car_power)))
+        summary.charging_hours += seconds / 3600
+        summary.car_energy += car_power * seconds / 3600 / 1000
+        summary.solar_energy += solar_power * seconds / 3600 / 1000
+        summary.grid_energy += (car_power - solar_power) * seconds / 3600 / 1000
+
+    def _parse_data_line(self, line: str) -> Optional[DataRow]:
+        """ Parses a line of data.csv, None if it isn't a valid sample """
+        columns = line.split(',')
+        if len(columns) != 8:
+            return None
+        try:
+            # time, charge state, load, generation, spare capacity, amps, vehicle charge, powerwall charge
+            return DataRow(
+                time=datetime.datetime.strptime(columns[0], self.time_format),
+                charge_state=columns[1],
+                load=float(columns[2]),
+                generation=float(columns[3]),
+                charge_current_request=float(columns[5]),
+                battery_charge=float(columns[7]))
+        except ValueError:
+            return None
+
+    def _add_log_line(self, line: str):
+        """ Counts a command logged in log.txt """
+        period, message = _split_log_line(line)
+        if period is None:
+            return
+        match = COMMAND_PATTERN.match(message)
+        if match is not None:
+            command = match.group(1) or f"{match.group(2)}_{match.group(3)}"
+            commands = self._hour(period).commands
+            commands[command] = commands.get(command, 0) + 1
+
+    def _add_error_line(self, line: str):
+        """ Counts an error logged in errors.txt by its type """
+        period, message = _split_log_line(line)
+        if period is None:
+            return
+        error_type = next((name for name, text in ERROR_TYPES if text in message), 'other')
+        errors = self._hour(period).errors
+        errors[error_type] = errors.get(error_type, 0) + 1
+
+
+def _split_log_line(line: str) -> Tuple[Optional[str], str]:
+    """
+    Splits a line written by LocalFileLogger with a timestamp, e.g. "2022-03-27 12:00:00.123456: message". The
+    microseconds are left out of the timestamp when they are 0.
+    Args:
+        line: The line
+
+    Returns:
+        The hour of the line as YYYY-MM-DD HH, None if the line has no timestamp, and the message
+    """
+    separator = line.find(': ', 19, 28)
+    if separator == -1 or line[4] != '-' or line[10] != ' ':
+        return None, line
+    return line[:13], line[separator + 2:]
+
+
+def _fingerprint(source: BinaryIO) -> Optional[str]:
+    """
+    Identifies a file by its first line, which has the time the file was started
+    Args:
+        source: The file, positioned at the start
+
+    Returns:
+        The hash of the first line, None if the file doesn't have a complete line yet
+    """
+    first_line = source.readline()
+    if not first_line.endswith(b'\n'):
+        return None
+    return hashlib.blake2b(first_line, digest_size=16).hexdigest()
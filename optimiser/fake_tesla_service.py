@@ -0,0 +1,412 @@
+import bisect
+import datetime
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+import teslapy
+
+from optimiser.replay import Sample
+from optimiser.simulated_tesla_api import SimulatedClock, SimulatedTeslaAPI
+
+FAKE_ACCESS_TOKEN = 'fake-access-token'
+# The endpoint groups that latencies and error rates are configured for
+ENDPOINT_GROUPS = ('list', 'summary', 'wake_up', 'vehicle_data', 'command', 'battery')
+# The Owner API command names that the optimiser sends, by the name in the url
+COMMANDS = {
+    'charge_start': 'START_CHARGE',
+    'charge_stop': 'STOP_CHARGE',
+    'set_charging_amps': 'CHARGING_AMPS',
+    'charge_port_door_open': 'CHARGE_PORT_DOOR_OPEN',
+}
+ROUTES = [
+    ('GET', re.compile(r'^/api/1/vehicles$'), 'list'),
+    ('GET', re.compile(r'^/api/1/products$'), 'list'),
+    ('GET', re.compile(r'^/api/1/vehicles/(?P<id>\d+)$'), 'summary'),
+    ('POST', re.compile(r'^/api/1/vehicles/(?P<id>\d+)/wake_up$'), 'wake_up'),
+    ('GET', re.compile(r'^/api/1/vehicles/(?P<id>\d+)/vehicle_data$'), 'vehicle_data'),
+    ('POST', re.compile(r'^/api/1/vehicles/(?P<id>\d+)/command/(?P<command>\w+)$'), 'command'),
+    ('GET', re.compile(r'^/api/1/powerwalls/(?P<id>[\w-]+)$'), 'battery'),
+]
+
+
+@dataclass
+class LatencyDistribution:
+    """
+    A log-normal distribution of response times, so most responses are close to the median with a long tail
+
+    Args:
+        median: The median response time in seconds
+        sigma: The spread of the log of the response time, 0 for a constant response time
+        maximum: The longest response time in seconds
+    """
+    median: float = 0.05
+    sigma: float = 0.5
+    maximum: float = 30
+
+    def sample(self, rng: random.Random) -> float:
+        """ Picks a response time in seconds """
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return min(self.median, self.maximum)
+        return min(rng.lognormvariate(math.log(self.median), self.sigma), self.maximum)
+
+    @classmethod
+    def parse(cls, text: str) -> 'LatencyDistribution':
+        """
+        Parses a latency from the command line
+        Args:
+            text: MEDIAN[:SIGMA] in seconds, e.g. 0.2:0.8
+
+        Returns:
+            The latency distribution
+        """
+        parts = [float(part) for part in text.split(':')]
+        if not 1 <= len(parts) <= 2:
+            raise ValueError(f"{text} is not MEDIAN[:SIGMA]")
+        return cls(*parts)
+
+
+class FakeCar:
+
+    def __init__(self, car_index: int, car: SimulatedTeslaAPI, sleep_after: Optional[float], wake_up_seconds: float):
+        """
+        A car behind the fake service, the charging is modelled by a SimulatedTeslaAPI
+        Args:
+            car_index: The index of the car in the vehicle list
+            car: The model of the car's charging
+            sleep_after: The time in seconds without a data request or command before the car falls asleep, None to
+                keep it awake
+            wake_up_seconds: The time in seconds the car takes to come online after a wake up request
+        """
+        self.car_index = car_index
+        self.car = car
+        self.sleep_after = sleep_after
+        self.wake_up_seconds = wake_up_seconds
+        self.last_activity = time.monotonic()
+        self.online_time: Optional[float] = None
+
+    @property
+    def id(self) -> int:
+        return 1000 + self.car_index
+
+    def state(self, now: float) -> str:
+        """ The car's online state as reported by the vehicle list """
+        if self.online_time is not None:
+            if now < self.online_time:
+                return 'asleep'
+            self.online_time = None
+            self.last_activity = now
+        if self.sleep_after is not None and self.car.charge_state != 'Charging' and \
+                now - self.last_activity > self.sleep_after:
+            return 'asleep'
+        return 'online'
+
+    def wake_up(self, now: float):
+        """ Starts waking the car up """
+        if self.state(now) == 'asleep' and self.online_time is None:
+            self.online_time = now + self.wake_up_seconds
+
+    def summary(self, now: float) -> Dict:
+        """ The car as it appears in the vehicle list """
+        return {
+            'id': self.id,
+            'id_s': str(self.id),
+            'vehicle_id': 2000 + self.car_index,
+            'vin': f'5YJ3FAKE{self.car_index:09d}',
+            'display_name': f'Fake {self.car_index}',
+            'option_codes': '',
+            'state': self.state(now),
+            'in_service': False,
+        }
+
+    def vehicle_data(self, now: float) -> Dict:
+        """ The car's data, including the charge state the optimiser reads """
+        self.last_activity = now
+        car = self.car
+        data = self.summary(now)
+        data['charge_state'] = {
+            'charging_state': car.charge_state,
+            'charge_current_request': car.charge_current_request,
+            'charge_current_request_max': 32,
+            'battery_level': int(car.vehicle_charge),
+            'charge_limit_soc': int(car.charge_limit),
+            'charge_port_door_open': car.port_open,
+            'charger_voltage': car.voltage if car.charge_state == 'Charging' else 0,
+            'charger_actual_current': car.charge_current_request if car.charge_state == 'Charging' else 0,
+        }
+        return data
+
+
+class FakeTeslaService:
+
+    def __init__(
+            self,
+            samples: Sequence[Sample] = None,
+            time_scale: float = 1,
+            vehicle_count: int = 1,
+            latencies: Dict[str, LatencyDistribution] = None,
+            error_rates: Dict[str, float] = None,
+            error_status: int = 503,
+            sleep_after: Optional[float] = 600,
+            wake_up_seconds: float = 10,
+            car_options: Dict = None,
+            peak_generation: float = 5000,
+            base_load: float = 600,
+            seed: Optional[int] = None):
+        """
+        A local stand in for the Tesla Owner API endpoints that TeslaAPI uses through teslapy, so the optimiser and
+        the server can be load and fault tested without the real car. The household follows a scripted solar profile,
+        each car's charging is modelled by a SimulatedTeslaAPI and each response is delayed by a random latency.
+        Args:
+            samples: The solar profile to play back, looped when it ends. A clear sky day is used if None.
+            time_scale: The number of simulated seconds that pass each real second, e.g. 60 plays an hour a minute
+            vehicle_count: The number of cars in the vehicle list
+            latencies: The response times of each endpoint group in ENDPOINT_GROUPS, a group that isn't given
+                responds after the default LatencyDistribution
+            error_rates: The fraction of requests to each endpoint group that fail with the error status
+            error_status: The status code of a failed request
+            sleep_after: The real time in seconds without a data request or command before a car that isn't charging
+                falls asleep, None to keep the cars awake
+            wake_up_seconds: The real time in seconds a car takes to come online after a wake up request
+            car_options: The arguments for the SimulatedTeslaAPI of each car e.g. vehicle_charge, charge_state
+            peak_generation: The solar generation in W at noon of the clear sky day
+            base_load: The household load in W, not including the cars, of the clear sky day
+            seed: The seed for the random latencies and errors, so a run can be repeated
+        """
+        self.samples = list(samples) if samples is not None else None
+        self.time_scale = time_scale
+        self.latencies = latencies or {}
+        self.error_rates = error_rates or {}
+        self.error_status = error_status
+        self.peak_generation = peak_generation
+        self.base_load = base_load
+
+        # The clear sky day starts in the morning so a short run sees the car start charging
+        start = self.samples[0].time if self.samples else datetime.datetime.combine(
+            datetime.date.today(), datetime.time(8))
+        self.clock = SimulatedClock(start)
+        self.cars = [
+            FakeCar(index, SimulatedTeslaAPI(self.clock, **(car_options or {})), sleep_after, wake_up_seconds)
+            for index in range(vehicle_count)]
+        self.battery_charge = 100
+        self.request_counts: Dict[str, int] = {group: 0 for group in ENDPOINT_GROUPS}
+        self.error_counts: Dict[str, int] = {group: 0 for group in ENDPOINT_GROUPS}
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._start = start
+        self._last_update = self._start_time
+        self._sample_offsets = None
+        if self.samples:
+            self._sample_offsets = [(sample.time - start).total_seconds() for sample in self.samples]
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        """ The base url of the running service """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """
+        Serves the fake api from a background thread
+        Args:
+            host: The address to listen on
+            port: The port to listen on, 0 picks a free port
+
+        Returns:
+            The base url of the service
+        """
+        service = self
+
+        class FakeTeslaHandler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'  # Keep the connections alive as the real api does
+
+            def do_GET(self):
+                service._handle(self, 'GET')
+
+            def do_POST(self):
+                service._handle(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass  # Load tests would flood the console
+
+        self._server = ThreadingHTTPServer((host, port), FakeTeslaHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake_tesla', daemon=True).start()
+        return self.url
+
+    def stop(self):
+        """ Stops serving """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def household(self) -> Tuple[float, float, float]:
+        """
+        The household conditions at the current simulated time
+        Returns:
+            The solar generation in W, the load in W not including the cars and the Powerwall charge in %
+        """
+        if self.samples:
+            offset = (self.clock.now() - self._start).total_seconds()
+            sample = self.samples[max(0, bisect.bisect_right(
+                self._sample_offsets, offset % (self._sample_offsets[-1] + 1)) - 1)]
+            return sample.generation, sample.base_load, sample.battery_charge
+
+        now = self.clock.now()
+        hour = now.hour + now.minute / 60 + now.second / 3600
+        generation = self.peak_generation * max(0.0, math.sin(math.pi * (hour - 6) / 12))
+        return generation, self.base_load, self.battery_charge
+
+    def _update(self):
+        """ Moves the simulated time on to now, charging the cars for the time that has passed """
+        now = time.monotonic()
+        seconds = (now - self._last_update) * self.time_scale
+        self._last_update = now
+        self.clock.set(self.clock.now() + datetime.timedelta(seconds=seconds))
+        for car in self.cars:
+            car.car.advance(seconds)
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        """ Routes a request, delaying the response and failing it as configured """
+        path = handler.path.split('?')[0]
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+        for route_method, pattern, group in ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match is not None:
+                break
+        else:
+            self._respond(handler, 404, {'error': f'not_found: {path}'})
+            return
+
+        with self._lock:
+            self.request_counts[group] += 1
+            latency = self.latencies.get(group, LatencyDistribution()).sample(self._rng)
+            failed = self._rng.random() < self.error_rates.get(group, 0)
+            if failed:
+                self.error_counts[group] += 1
+        time.sleep(latency)
+
+        if handler.headers.get('Authorization') != f'Bearer {FAKE_ACCESS_TOKEN}':
+            self._respond(handler, 401, {'error': 'invalid bearer token'})
+            return
+        if failed:
+            self._respond(handler, self.error_status, {'error': 'upstream internal error'})
+            return
+
+        with self._lock:
+            self._update()
+            status, response = self._route(group, path, match.groupdict(), json.loads(body or b'{}'))
+        self._respond(handler, status, response)
+
+    def _route(self, group: str, path: str, parameters: Dict, body: Dict) -> Tuple[int, Dict]:
+        """
+        Builds the response to a request
+        Args:
+            group: The endpoint group of the request
+            path: The path of the request
+            parameters: The values captured from the path
+            body: The json body of the request
+
+        Returns:
+            The status code and the json response
+        """
+        now = time.monotonic()
+        if path == '/api/1/vehicles':
+            return 200, {'response': [car.summary(now) for car in self.cars], 'count': len(self.cars)}
+        if path == '/api/1/products':
+            return 200, {'response': [self._battery_summary()], 'count': 1}
+        if group == 'battery':
+            return self._battery_data(parameters['id'])
+
+        car = next((car for car in self.cars if str(car.id) == parameters['id']), None)
+        if car is None:
+            return 404, {'error': 'not_found'}
+        if group == 'summary':
+            return 200, {'response': car.summary(now)}
+        if group == 'wake_up':
+            car.wake_up(now)
+            return 200, {'response': car.summary(now)}
+        if car.state(now) != 'online':
+            return 408, {'error': 'vehicle unavailable: {:error=>"vehicle unavailable:"}'}
+        if group == 'vehicle_data':
+            return 200, {'response': car.vehicle_data(now)}
+
+        command = COMMANDS.get(parameters['command'])
+        if command is None:
+            return 404, {'error': f"not_found: {parameters['command']}"}
+        car.last_activity = now
+        reason, result = car.car.send_command(command, **body)
+        return 200, {'response': {'result': result, 'reason': '' if result else reason}}
+
+    def _battery_summary(self) -> Dict:
+        """ The Powerwall as it appears in the product list """
+        return {
+            'id': 'STE00000000-00000',
+            'energy_site_id': 3000,
+            'resource_type': 'battery',
+            'site_name': 'Fake Home',
+        }
+
+    def _battery_data(self, battery_id: str) -> Tuple[int, Dict]:
+        """ The Powerwall data the optimiser reads, the load includes the cars' charging """
+        if battery_id != self._battery_summary()['id']:
+            return 404, {'error': 'not_found'}
+        generation, base_load, battery_charge = self.household()
+        load = base_load + sum(car.car.car_power for car in self.cars)
+        total_pack_energy = 13500
+        return 200, {'response': {
+            'energy_left': total_pack_energy * battery_charge / 100,
+            'total_pack_energy': total_pack_energy,
+            'power_reading': [{
+                'timestamp': self.clock.now().isoformat(),
+                'load_power': load,
+                'solar_power': generation,
+                'grid_power': max(0.0, load - generation),
+                'battery_power': 0,
+            }],
+        }}
+
+    @staticmethod
+    def _respond(handler: BaseHTTPRequestHandler, status: int, response: Dict):
+        """ Writes a json response """
+        body = json.dumps(response).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def use_fake_service(url: str, username: str, cache_file: str = 'cache.json'):
+    """
+    Points teslapy at a fake service and gives it a token for the fake service, so TeslaAPI connects without a login
+    Args:
+        url: The base url of the fake service
+        username: The username that TeslaAPI will log in with
+        cache_file: The teslapy token cache to write, TeslaAPI reads cache.json from the working directory
+    """
+    teslapy.BASE_URL = url
+    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # The fake service is plain http on the local machine
+    token = {
+        'access_token': FAKE_ACCESS_TOKEN,
+        'refresh_token': 'fake-refresh-token',
+        'token_type': 'Bearer',
+        'expires_in': 10 * 365 * 24 * 3600,
+        'expires_at': time.time() + 10 * 365 * 24 * 3600,
+    }
+    with open(cache_file, 'w') as cache:
+        json.dump({username: {'url': teslapy.SSO_BASE_URL, 'sso': token}}, cache)
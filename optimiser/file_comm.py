@@ -0,0 +1,103 @@
+import datetime
+import os
+from pathlib import Path
+from typing import Tuple
+
+from optimiser.cached_file import CachedFile
+from optimiser.force_charge_command import ForceChargeCommand
+
+
+class FileComm:
+
+    def __init__(self, state_path: str = 'current_state.json'):
+        """
+        Shares the state and force charge command between the optimiser and the server through json files
+        Args:
+            state_path: The path of the file the optimiser writes its state to
+        """
+        self.state_path = state_path
+        self._state_file = CachedFile(state_path)
+        self._force_charge_file = CachedFile(ForceChargeCommand.file_path)
+
+    def publish_state(self, payload: str):
+        """
+        Makes the optimiser's state available to the server
+        Args:
+            payload: The state as a json string
+        """
+        write_atomic(self.state_path, payload)
+
+    def load_force_charge_command(self) -> ForceChargeCommand:
+        """ Gets the current force charge command for the optimiser """
+        return ForceChargeCommand.load()
+
+    def save_force_charge_command(self, force_charge_command: ForceChargeCommand):
+        """
+        Saves changes the optimiser has made to the force charge command
+        Args:
+            force_charge_command: The force charge command to save
+        """
+        force_charge_command.save()
+
+    def read_state(self) -> Tuple[str, str, datetime.datetime]:
+        """
+        Gets the optimiser's latest state for the server
+        Returns:
+            The state as a json string, an etag that changes with the state and the time it was last modified
+        """
+        return self._state_file.read()
+
+    def read_force_charge(self) -> Tuple[str, str, datetime.datetime]:
+        """
+        Gets the force charge command for the server
+        Returns:
+            The command as a json string, an etag that changes with the command and the time it was last modified
+        """
+        return self._force_charge_file.read()
+
+    def request_force_charge(self, force_charge: bool) -> str:
+        """
+        Turns force charging on or off from the server
+        Args:
+            force_charge: True to charge the car even if there is not enough solar
+
+        Returns:
+            The updated command as a json string
+        """
+        force_charge_command = ForceChargeCommand.load()
+        apply_force_charge_request(force_charge_command, force_charge, datetime.datetime.now())
+        force_charge_command.save()
+        self._force_charge_file.invalidate()
+        return force_charge_command.to_json()
+
+
+def apply_force_charge_request(
+        force_charge_command: ForceChargeCommand,
+        force_charge: bool,
+        request_time: datetime.datetime):
+    """
+    Updates a force charge command with a request to turn force charging on or off
+    Args:
+        force_charge_command: The command to update
+        force_charge: True to charge the car even if there is not enough solar
+        request_time: The time of the request, recorded as the start of the force charge when turning it on
+    """
+    force_charge_command.force_charge = force_charge
+    force_charge_command.request_time = request_time if force_charge else None
+
+
+def write_atomic(path: str, text: str):
+    """
+    Writes a file through a temporary file that replaces it, so a reader sees either the old or the new contents
+    and never a partially written file
+    Args:
+        path: The path of the file
+        text: The new contents
+    """
+    temp_path = Path(f"{path}.tmp")
+    with temp_path.open('w') as temp_file:
+        temp_file.write(text)
+        temp_file.flush()
+        # The contents must be on disk before the rename, or a power cut can leave an empty file in its place
+        os.fsync(temp_file.fileno())
+    os.replace(temp_path, path)
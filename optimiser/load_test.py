@@ -0,0 +1,211 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import requests
+
+from optimiser.fake_tesla_service import FakeTeslaService
+from optimiser.file_comm import FileComm
+from optimiser.metrics import MetricsRegistry
+from optimiser.poll_scheduler import PollScheduler
+from optimiser.sample_store import SampleStore
+from optimiser.tesla_api import TeslaAPI
+from optimiser.tesla_solar_optimiser import TeslaSolarOptimiser
+from optimiser.vehicle import Vehicle
+
+# The server endpoints requested by the web app, the stream is left out as it holds a connection open
+DEFAULT_SERVER_PATHS = ('/api/v1/solar_charge_state', '/api/v1/force_charge', '/api/v1/history?points=300')
+
+
+@dataclass
+class LatencySummary:
+    """
+    The throughput and latency percentiles of a set of timed operations
+
+    Args:
+        name: The name of the operation
+        count: The number of operations that completed
+        errors: The number of operations that failed
+        seconds: The length of the run in seconds
+        p50: The median latency in seconds
+        p95: The 95th percentile latency in seconds
+        p99: The 99th percentile latency in seconds
+        max: The longest latency in seconds
+    """
+    name: str
+    count: int
+    errors: int
+    seconds: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+    @property
+    def throughput(self) -> float:
+        """ The number of operations completed per second """
+        return self.count / self.seconds if self.seconds > 0 else 0
+
+    def __str__(self) -> str:
+        return f"{self.name.ljust(40)} | " \
+               f"{f'{self.count} ok'.ljust(10)} | " \
+               f"{f'{self.errors} errors'.ljust(10)} | " \
+               f"{f'{self.throughput:.1f}/s'.ljust(10)} | " \
+               f"{f'p50 {self.p50 * 1000:.1f} ms'.ljust(15)} | " \
+               f"{f'p95 {self.p95 * 1000:.1f} ms'.ljust(15)} | " \
+               f"{f'p99 {self.p99 * 1000:.1f} ms'.ljust(15)} | " \
+               f"{f'max {self.max * 1000:.1f} ms'.ljust(15)}"
+
+
+def summarise(name: str, latencies: Sequence[float], errors: int, seconds: float) -> LatencySummary:
+    """
+    Summarises timed operations
+    Args:
+        name: The name of the operation
+        latencies: The time in seconds of each operation that completed
+        errors: The number of operations that failed
+        seconds: The length of the run in seconds
+
+    Returns:
+        The summary
+    """
+    if len(latencies) == 0:
+        return LatencySummary(name, 0, errors, seconds, 0, 0, 0, 0)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return LatencySummary(name, len(latencies), errors, seconds, p50, p95, p99, max(latencies))
+
+
+def create_optimiser(username: str, vehicle_count: int = 1, car_interval: float = 0) -> TeslaSolarOptimiser:
+    """
+    Creates an optimiser that talks to the Tesla API through teslapy, so it can be pointed at a fake service. It
+    writes its state, force charge command and samples to the working directory as the real optimiser does.
+    Args:
+        username: The username to log in with
+        vehicle_count: The number of cars to charge
+        car_interval: The time in seconds between requests for the car data
+
+    Returns:
+        The optimiser
+    """
+    metrics = MetricsRegistry()
+    return TeslaSolarOptimiser(
+        tesla_api=TeslaAPI(username=username, metrics=metrics),
+        poll_scheduler=PollScheduler(car_interval=car_interval),
+        sample_store=SampleStore('data'),
+        comm=FileComm(),
+        metrics=metrics,
+        vehicles=[Vehicle(car_index=index) for index in range(vehicle_count)] if vehicle_count > 1 else None)
+
+
+def run_optimiser(
+        optimiser: TeslaSolarOptimiser,
+        duration: float,
+        poll_interval: float = 0) -> LatencySummary:
+    """
+    Runs ticks of the optimiser, timing each one
+    Args:
+        optimiser: The optimiser to run
+        duration: The time in seconds to run for
+        poll_interval: The time in seconds between the start of each tick, 0 to run them back to back
+
+    Returns:
+        The tick throughput and latency, a tick that raised counts as an error
+    """
+    optimiser.connect()
+    latencies = []
+    errors = 0
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        tick_start = time.monotonic()
+        try:
+            optimiser.tick()
+            latencies.append(time.monotonic() - tick_start)
+        except Exception:
+            errors += 1
+        time.sleep(max(0.0, poll_interval - (time.monotonic() - tick_start)))
+    optimiser.sample_store.close()
+    return summarise('optimiser tick', latencies, errors, time.monotonic() - start)
+
+
+def start_server(port: int, production: bool = False) -> subprocess.Popen:
+    """
+    Starts server.py in the working directory, so it reads the state the optimiser writes there
+    Args:
+        port: The port to listen on
+        production: If True the server runs under gunicorn
+
+    Returns:
+        The server process, once it is accepting requests
+    """
+    server_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+    command = [sys.executable, server_path, '--port', str(port)] + (['--production'] if production else [])
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with {process.returncode}")
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/v1/force_charge', timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("server.py did not start within 30 seconds")
+
+
+def run_server_load(
+        base_url: str,
+        duration: float,
+        clients: int = 8,
+        paths: Sequence[str] = DEFAULT_SERVER_PATHS) -> List[LatencySummary]:
+    """
+    Requests the server's endpoints as fast as possible from several clients at once
+    Args:
+        base_url: The url of the server e.g. http://127.0.0.1:5000
+        duration: The time in seconds to run for
+        clients: The number of clients requesting at the same time, each keeps its connection open
+        paths: The paths to request, each client takes them in turn
+
+    Returns:
+        The throughput and latency of each path, a response that isn't 200 or 304 counts as an error
+    """
+    lock = threading.Lock()
+    latencies: Dict[str, List[float]] = {path: [] for path in paths}
+    errors: Dict[str, int] = {path: 0 for path in paths}
+    start = time.monotonic()
+
+    def client(offset: int):
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = 'gzip'
+        i = offset
+        while time.monotonic() - start < duration:
+            path = paths[i % len(paths)]
+            i += 1
+            request_start = time.monotonic()
+            try:
+                ok = session.get(base_url + path, timeout=30).status_code in (200, 304)
+            except requests.RequestException:
+                ok = False
+            latency = time.monotonic() - request_start
+            with lock:
+                if ok:
+                    latencies[path].append(latency)
+                else:
+                    errors[path] += 1
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+
+    seconds = time.monotonic() - start
+    return [summarise(f'GET {path}', latencies[path], errors[path], seconds) for path in paths]
+
+
+def service_counts(service: FakeTeslaService) -> List[Tuple[str, int, int]]:
+    """ The number of requests and injected errors for each endpoint group of the fake service """
+    return [(group, count, service.error_counts[group]) for group, count in service.request_counts.items()]
@@ -1,22 +1,74 @@
+import atexit
 import datetime
+import gzip
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from typing import Dict, IO, List
+
+# Queued to stop the background writer
+_CLOSE = object()
 
 
 class LocalFileLogger:
 
-    def __init__(self, filepath: str, error_filepath: str = None, include_timestamp: bool = True):
+    def __init__(
+            self,
+            filepath: str,
+            error_filepath: str = None,
+            include_timestamp: bool = True,
+            buffered: bool = False,
+            flush_interval: float = 5.0,
+            flush_size: int = 64 * 1024,
+            fsync: str = 'never',
+            max_bytes: int = None,
+            rotate_daily: bool = False,
+            compress: bool = True,
+            max_queue: int = 10000):
         """
         Logs messages to files
         Args:
             filepath: The default filepath to log messages
             error_filepath: The filepath to log ERROR severity messages
             include_timestamp: boolean to determine if the timestamp should be prepended to each message
+            buffered: If True messages are queued and written by a background thread that keeps the files open,
+                otherwise each message opens, appends to and closes the file
+            flush_interval: The maximum time in seconds a buffered message waits before being written
+            flush_size: The number of buffered bytes for a file that triggers a write
+            fsync: When to fsync the files in buffered mode: 'never', 'flush' after each write or 'close'
+            max_bytes: Rotate a file in buffered mode when it would grow past this size, None to not rotate by size
+            rotate_daily: If True rotate the files in buffered mode when the date changes
+            compress: If True rotated files are gzipped
+            max_queue: The number of buffered messages waiting for the background writer at which further messages
+                are written straight to the file instead, so a stalled writer can't use unbounded memory
         """
+        if fsync not in ('never', 'flush', 'close'):
+            raise ValueError("fsync must be 'never', 'flush' or 'close'")
+
         self.filepath = filepath
         self.include_timestamp = include_timestamp
         if error_filepath is None:
             self.error_filepath = filepath
         else:
             self.error_filepath = error_filepath
+        self.buffered = buffered
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._writer = None
+        self._closed = False
+        if self.buffered:
+            self._writer = threading.Thread(target=self._write_loop, name='local_file_logger', daemon=True)
+            self._writer.start()
+            atexit.register(self.close)  # Write the tail of the log on shutdown
 
     def log(self, message: str, severity: str = 'DEBUG'):
         """
@@ -31,9 +83,169 @@ class LocalFileLogger:
         else:
             filepath = self.filepath
 
-        with open(filepath, "a") as log_file:
-            if self.include_timestamp:
-                line = f"{datetime.datetime.now()}: {message}\n"
-            else:
-                line = message
-            log_file.write(line)
+        if self.include_timestamp:
+            line = f"{datetime.datetime.now()}: {message}\n"
+        else:
+            line = message
+
+        if self.buffered and not self._closed and self._writer.is_alive():
+            try:
+                self._queue.put_nowait((filepath, line))
+                return
+            except queue.Full:
+                pass  # The writer is falling behind, write this message directly
+
+        try:
+            with open(filepath, "a") as log_file:
+                log_file.write(line)
+        except OSError as error:
+            _report_error(f"Failed to write to {filepath}: {error}")
+
+    def flush(self):
+        """ Blocks until all messages logged so far have been written """
+        if self._writer is not None and self._writer.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+
+    def close(self):
+        """ Writes any buffered messages, closes the files and stops the background writer """
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(_CLOSE)
+            self._writer.join()
+
+    def _write_loop(self):
+        """ Collects queued messages per file and writes them when the buffer is large or old enough """
+        buffers: Dict[str, List[str]] = {}
+        buffer_sizes: Dict[str, int] = {}
+        files: Dict[str, IO] = {}
+        file_dates: Dict[str, datetime.date] = {}
+        next_flush = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                item = None  # The flush interval has passed
+
+            if isinstance(item, tuple):
+                filepath, line = item
+                buffers.setdefault(filepath, []).append(line)
+                buffer_sizes[filepath] = buffer_sizes.get(filepath, 0) + len(line)
+                if buffer_sizes[filepath] < self.flush_size and time.monotonic() < next_flush:
+                    continue
+
+            # Flush on size, on the interval or when asked to by flush or close
+            for filepath in list(buffers):
+                text = ''.join(buffers.pop(filepath))
+                try:
+                    self._write_buffer(filepath, text, files, file_dates)
+                except Exception as error:
+                    # The messages are dropped and the file reopened on the next write, the writer must keep running
+                    _report_error(f"Failed to write {len(text)} bytes to {filepath}: {error}")
+                    self._discard_file(files.pop(filepath, None))
+            buffer_sizes.clear()
+            next_flush = time.monotonic() + self.flush_interval
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _CLOSE:
+                for filepath, log_file in files.items():
+                    try:
+                        self._close_file(log_file, sync=self.fsync != 'never')
+                    except OSError as error:
+                        _report_error(f"Failed to close {filepath}: {error}")
+                return
+
+    def _write_buffer(self, filepath: str, text: str, files: Dict[str, IO], file_dates: Dict[str, datetime.date]):
+        """
+        Writes the buffered text for a file, rotating the file first if required
+        Args:
+            filepath: The path of the file
+            text: The text to write
+            files: The open files by path
+            file_dates: The date each open file was opened
+        """
+        today = datetime.date.today()
+        log_file = files.get(filepath)
+        if log_file is not None and self._should_rotate(log_file, len(text), file_dates[filepath], today):
+            self._close_file(log_file, sync=self.fsync != 'never')
+            self._rotate(filepath)
+            log_file = None
+
+        if log_file is None:
+            log_file = open(filepath, 'a')
+            files[filepath] = log_file
+            file_dates[filepath] = today
+            # A file that existed before the logger started may already need rotating
+            if self._should_rotate(log_file, len(text), self._modified_date(filepath), today):
+                log_file.close()
+                self._rotate(filepath)
+                log_file = open(filepath, 'a')
+                files[filepath] = log_file
+
+        log_file.write(text)
+        log_file.flush()
+        if self.fsync == 'flush':
+            os.fsync(log_file.fileno())
+
+    def _should_rotate(self, log_file: IO, pending: int, file_date: datetime.date, today: datetime.date) -> bool:
+        """ Returns True if writing the pending bytes would take the file over the size limit or the date changed """
+        size = log_file.tell()
+        if size == 0:
+            return False
+        if self.max_bytes is not None and size + pending > self.max_bytes:
+            return True
+        return self.rotate_daily and file_date != today
+
+    def _rotate(self, filepath: str):
+        """
+        Renames the file with a timestamp suffix and compresses it if required. A rotation that fails is reported and
+        logging carries on, in the same file if it couldn't be renamed or leaving the rotated file uncompressed.
+        """
+        rotated_path = f"{filepath}.{datetime.datetime.now():%Y%m%d-%H%M%S-%f}"
+        try:
+            os.replace(filepath, rotated_path)
+        except OSError as error:
+            _report_error(f"Failed to rotate {filepath}: {error}")
+            return
+        if self.compress:
+            compressed_path = f"{rotated_path}.gz"
+            try:
+                with open(rotated_path, 'rb') as source, gzip.open(compressed_path, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(rotated_path)
+            except OSError as error:
+                _report_error(f"Failed to compress {rotated_path}: {error}")
+                if os.path.exists(compressed_path) and os.path.exists(rotated_path):
+                    os.remove(compressed_path)
+
+    def _close_file(self, log_file: IO, sync: bool):
+        """ Flushes and closes a file, optionally syncing it to disk first """
+        log_file.flush()
+        if sync:
+            os.fsync(log_file.fileno())
+        log_file.close()
+
+    @staticmethod
+    def _discard_file(log_file: IO):
+        """ Closes a file after a failed write, ignoring any further error """
+        if log_file is None:
+            return
+        try:
+            log_file.close()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _modified_date(filepath: str) -> datetime.date:
+        """ The date a file was last modified """
+        return datetime.date.fromtimestamp(os.path.getmtime(filepath))
+
+
+def _report_error(message: str):
+    """ Reports a failure to write the logs, which can't be logged to the files themselves """
+    print(f"{datetime.datetime.now()}: LocalFileLogger: {message}", file=sys.stderr)
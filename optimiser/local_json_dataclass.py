@@ -1,28 +1,49 @@
 from __future__ import annotations
 from pathlib import Path
-import json
-from typing import ClassVar, TYPE_CHECKING, Any
-if TYPE_CHECKING:  # Avoids circular references for type hints
-    from optimiser.force_charge_command import ForceChargeCommand
-from dataclasses_json import dataclass_json
+from typing import Callable, ClassVar, Dict, Type, TypeVar
 from dataclasses import dataclass
+from optimiser.dataclass_codec import codec_for
+
+T = TypeVar('T', bound='LocalJsonDataclass')
 
 
-@dataclass_json
 @dataclass
 class LocalJsonDataclass:
     """
-    Wraps a dataclass to enable save and load to a json file
+    Wraps a dataclass to enable save and load to a json file. The conversion is compiled once per class by the
+    dataclass codec, see DataclassCodec for the supported types and how the schema is versioned.
 
     Args:
-        file_path: The poth of the file to save the data
+        file_path: The path of the file to save the data
+        schema_version: The version of the saved data, increase it when a field changes in a way that needs a migration
+        migrations: Functions that upgrade the saved data of a version to the next version, keyed by the version
     """
 
     file_path: ClassVar[str] = 'data.json'
+    schema_version: ClassVar[int] = 1
+    migrations: ClassVar[Dict[int, Callable[[Dict], Dict]]] = {}
+
+    def to_dict(self) -> Dict:
+        """ Converts the data to json compatible values """
+        return codec_for(type(self)).encode(self)
+
+    @classmethod
+    def from_dict(cls: Type[T], data: Dict) -> T:
+        """ Creates the data from the json compatible values created by to_dict """
+        return codec_for(cls).decode(data)
+
+    def to_json(self) -> str:
+        return codec_for(type(self)).to_json(self)
+
+    @classmethod
+    def from_json(cls: Type[T], text: str) -> T:
+        return codec_for(cls).from_json(text)
 
     def save(self):
-        Path(self.file_path).write_text(json.dumps(self.to_json()))
+        """ Saves the data to the file, replacing it in one step so a reader never sees it half written """
+        from optimiser.file_comm import write_atomic  # The file comm imports the dataclasses that use this
+        write_atomic(self.file_path, self.to_json())
 
     @classmethod
-    def load(cls) -> Any:
-        return cls.from_json(Path(cls.file_path).read_text())
\ No newline at end of file
+    def load(cls: Type[T]) -> T:
+        return cls.from_json(Path(cls.file_path).read_text())
@@ -0,0 +1,102 @@
+import datetime
+import hashlib
+import threading
+from dataclasses import replace
+from typing import Optional, Tuple
+
+from optimiser.file_comm import FileComm, apply_force_charge_request
+from optimiser.force_charge_command import ForceChargeCommand
+
+
+class MemoryComm:
+
+    def __init__(self):
+        """
+        Shares the state and force charge command between an optimiser and a server running in the same process.
+        The state is handed over as the json string the optimiser publishes, so the server never reads a file or
+        copies the state between processes. The force charge command is still saved to its file when it changes so
+        it survives a restart, and the state file left by the last run is served until the optimiser publishes.
+        """
+        self._file_comm = FileComm()
+        self._lock = threading.Lock()
+        self._state: Optional[Tuple[str, str, datetime.datetime]] = None
+        self._force_charge_command: Optional[ForceChargeCommand] = None
+        self._force_charge: Optional[Tuple[str, str, datetime.datetime]] = None
+
+    def publish_state(self, payload: str):
+        """
+        Makes the optimiser's state available to the server
+        Args:
+            payload: The state as a json string
+        """
+        state = _versioned(payload)
+        with self._lock:
+            self._state = state
+
+    def load_force_charge_command(self) -> ForceChargeCommand:
+        """ Gets the current force charge command for the optimiser """
+        with self._lock:
+            return replace(self._current_force_charge_command())
+
+    def save_force_charge_command(self, force_charge_command: ForceChargeCommand):
+        """
+        Saves changes the optimiser has made to the force charge command
+        Args:
+            force_charge_command: The force charge command to save
+        """
+        with self._lock:
+            self._set_force_charge_command(force_charge_command)
+
+    def read_state(self) -> Tuple[str, str, datetime.datetime]:
+        """
+        Gets the optimiser's latest state for the server
+        Returns:
+            The state as a json string, an etag that changes with the state and the time it was last modified
+        """
+        with self._lock:
+            state = self._state
+        return state if state is not None else self._file_comm.read_state()
+
+    def read_force_charge(self) -> Tuple[str, str, datetime.datetime]:
+        """
+        Gets the force charge command for the server
+        Returns:
+            The command as a json string, an etag that changes with the command and the time it was last modified
+        """
+        with self._lock:
+            self._current_force_charge_command()
+            return self._force_charge
+
+    def request_force_charge(self, force_charge: bool) -> str:
+        """
+        Turns force charging on or off from the server, the optimiser sees it on its next tick
+        Args:
+            force_charge: True to charge the car even if there is not enough solar
+
+        Returns:
+            The updated command as a json string
+        """
+        with self._lock:
+            force_charge_command = replace(self._current_force_charge_command())
+            apply_force_charge_request(force_charge_command, force_charge, datetime.datetime.now())
+            self._set_force_charge_command(force_charge_command)
+            return self._force_charge[0]
+
+    def _current_force_charge_command(self) -> ForceChargeCommand:
+        """ The force charge command, loaded from its file on first use. Called with the lock held. """
+        if self._force_charge_command is None:
+            self._force_charge_command = ForceChargeCommand.load()
+            self._force_charge = _versioned(self._force_charge_command.to_json())
+        return self._force_charge_command
+
+    def _set_force_charge_command(self, force_charge_command: ForceChargeCommand):
+        """ Keeps a copy of a new force charge command and saves it to its file. Called with the lock held. """
+        self._force_charge_command = replace(force_charge_command)
+        self._force_charge = _versioned(force_charge_command.to_json())
+        force_charge_command.save()
+
+
+def _versioned(payload: str) -> Tuple[str, str, datetime.datetime]:
+    """ A payload with an etag that changes with it and the time it was made """
+    etag = hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+    return payload, etag, datetime.datetime.now(tz=datetime.timezone.utc)
@@ -0,0 +1,262 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Latency buckets in seconds, from a fast battery poll to a slow car wake up
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        """
+        A named metric with a value for each combination of label values
+        Args:
+            name: The metric name in the exposition
+            documentation: The help text for the metric
+            label_names: The names of the labels that split the metric
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """ The label values in the order of the label names """
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} has labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+        """ Formats label values as {name="value",...} """
+        pairs = list(zip(self.label_names, key)) + list((extra or {}).items())
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self) -> List[str]:
+        """ The exposition lines for the values of the metric, one per combination of label values """
+        with self._lock:
+            values = sorted(self._values.items())
+        if len(values) == 0 and len(self.label_names) == 0:
+            values = [((), 0.0)]  # A metric without labels is exposed before its first update
+        return [f"{self.name}{self._format_labels(key)} {_format_value(value)}" for key, value in values]
+
+    def render(self) -> str:
+        """ Formats the metric in the Prometheus text format """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str):
+        """
+        Increases the counter
+        Args:
+            amount: The amount to add, must not be negative
+            **labels: The label values
+        """
+        if amount < 0:
+            raise ValueError("A counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """ The current count for the label values """
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(Metric):
+
+    metric_type = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        """
+        Sets the gauge to a value
+        Args:
+            value: The new value
+            **labels: The label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def value(self, **labels: str) -> float:
+        """ The current value for the label values """
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(Metric):
+
+    metric_type = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Counts observations into cumulative buckets, e.g. request latencies
+        Args:
+            name: The metric name in the exposition
+            documentation: The help text for the metric
+            label_names: The names of the labels that split the metric
+            buckets: The upper bounds of the buckets in ascending order, +Inf is added
+        """
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        """
+        Records an observation
+        Args:
+            value: The observed value
+            **labels: The label values
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """ Observes the time in seconds taken by the block, including when it raises """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        """ The number of observations for the label values """
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        if len(values) == 0 and len(self.label_names) == 0:
+            values = [((), ([0] * (len(self.buckets) + 1), 0.0))]
+
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = self._format_labels(key, {'le': _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        """ Holds the metrics of a process so they can be exposed together """
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        """ Gets or creates a counter """
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        """ Gets or creates a gauge """
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """ Gets or creates a histogram """
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def render(self) -> str:
+        """ Formats every metric in the Prometheus text format """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+    def serve(self, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        """
+        Serves the metrics at /metrics from a background thread
+        Args:
+            port: The port to listen on
+            host: The address to listen on
+
+        Returns:
+            The running server, shut it down to stop serving
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would flood the console
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+    def _get_or_create(self, metric_class: type, name: str, documentation: str, label_names: Sequence[str], **kwargs):
+        """ Returns the metric with the name, creating it if it doesn't exist """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, documentation, label_names, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class) or metric.label_names != tuple(label_names):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+
+def _escape(value: str) -> str:
+    """ Escapes a label value """
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    """ Formats a sample value """
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,57 @@
+from typing import Any, List, Optional
+
+from optimiser.console_logger import ConsoleLogger
+from optimiser.local_file_logger import LocalFileLogger
+from optimiser.metrics import MetricsRegistry
+from optimiser.sample_store import SampleStore
+from optimiser.spare_capacity_forecaster import SpareCapacityForecaster
+from optimiser.tesla_api import TeslaAPI
+from optimiser.tesla_solar_optimiser import TeslaSolarOptimiser
+from optimiser.tick_profiler import TickProfiler
+from optimiser.vehicle import Vehicle
+
+
+def build_optimiser(
+        username: str,
+        comm: Any,
+        metrics: MetricsRegistry,
+        vehicles: Optional[List[Vehicle]] = None,
+        forecast: bool = False,
+        profile: Optional[str] = None,
+        profile_dir: str = 'profiles',
+        profile_keep: int = 100) -> TeslaSolarOptimiser:
+    """
+    Creates the optimiser as it runs at home, logging to the console and files in the working directory
+    Args:
+        username: The username used for the Tesla API
+        comm: Shares the state and force charge command with the server
+        metrics: The registry the api and the optimiser record their metrics in
+        vehicles: The cars to charge, the first car if None
+        forecast: If True the charging amps are set from a forecast of the spare capacity rather than its average
+        profile: The profiler mode to profile each tick with, sampling or cprofile, the ticks aren't profiled if None
+        profile_dir: The directory the profiles of the latest ticks are written to
+        profile_keep: The number of ticks to keep the profiles of
+
+    Returns:
+        The optimiser, ready to connect and run
+    """
+    # The data logger logs the state to a csv file
+    data_logger = LocalFileLogger('data.csv', include_timestamp=False, buffered=True)
+    # The sample store keeps the same data in a binary form that is fast to query
+    sample_store = SampleStore('data')
+    # The forecaster learns the shape of the day from the stored samples
+    forecaster = SpareCapacityForecaster(sample_store=sample_store) if forecast else None
+    tso = TeslaSolarOptimiser(
+        tesla_api=TeslaAPI(username=username, metrics=metrics),
+        data_logger=data_logger,
+        sample_store=sample_store,
+        comm=comm,
+        metrics=metrics,
+        vehicles=vehicles,
+        forecaster=forecaster,
+        profiler=TickProfiler(profile_dir, profile, profile_keep) if profile is not None else None)
+
+    # Also log messages to the console and a file output
+    tso.attach_logger(ConsoleLogger())
+    tso.attach_logger(LocalFileLogger('log.txt', 'errors.txt', buffered=True, max_bytes=10 * 1024 * 1024))
+    return tso
@@ -0,0 +1,196 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Sequence
+import numpy as np
+
+from optimiser.replay import Sample
+
+PARAMETER_NAMES = ('min_spare_capacity', 'amps_per_kw', 'history_count', 'max_amps', 'new_command_interval')
+RESULT_NAMES = ('car_energy', 'solar_energy', 'grid_energy', 'commands')
+
+# The samples are shared with the worker processes once rather than with every chunk of parameters
+_worker_samples: Dict[str, np.ndarray] = {}
+
+
+def samples_to_arrays(samples: Iterable[Sample], max_gap: float = 300) -> Dict[str, np.ndarray]:
+    """
+    Converts samples into the arrays used by the sweep
+    Args:
+        samples: The samples in time order
+        max_gap: Gaps between samples longer than this many seconds aren't counted, e.g. when the optimiser was off
+
+    Returns:
+        The time in seconds, the length of time until the next sample, base load, generation and powerwall charge
+    """
+    samples = list(samples)
+    times = np.array([sample.time.timestamp() for sample in samples], dtype=np.float64)
+    durations = np.minimum(np.diff(times, append=times[-1] if len(times) > 0 else 0), max_gap)
+    return {
+        'time': times,
+        'duration': durations,
+        'base_load': np.array([sample.base_load for sample in samples], dtype=np.float64),
+        'generation': np.array([sample.generation for sample in samples], dtype=np.float64),
+        'battery_charge': np.array([sample.battery_charge for sample in samples], dtype=np.float64),
+    }
+
+
+def parameter_grid(**values: Sequence) -> np.ndarray:
+    """
+    Creates every combination of the parameter values
+    Args:
+        **values: The values to try for each of the PARAMETER_NAMES
+
+    Returns:
+        A (combinations, parameters) array in the order of PARAMETER_NAMES
+    """
+    return np.array(list(itertools.product(*(values[name] for name in PARAMETER_NAMES))), dtype=np.float64)
+
+
+def simulate(samples: Dict[str, np.ndarray], parameters: np.ndarray, voltage: int = 240) -> np.ndarray:
+    """
+    Runs the optimiser's charging rule for many parameter combinations at once. Each step in time updates every
+    combination together, mirroring TeslaSolarOptimiser._determine_command without force charging.
+    Args:
+        samples: The arrays from samples_to_arrays
+        parameters: A (combinations, parameters) array in the order of PARAMETER_NAMES
+        voltage: The voltage of the charger, used to convert amps to W
+
+    Returns:
+        A (combinations, results) array in the order of RESULT_NAMES with the energy in kWh
+    """
+    count = len(parameters)
+    min_spare_capacity, amps_per_kw, history_count, max_amps, new_command_interval = parameters.T
+    history_count = history_count.astype(np.int64)
+    history_size = int(history_count.max())
+    rows = np.arange(count)
+
+    charging = np.zeros(count, dtype=bool)
+    amps = np.full(count, 5.0)
+    port_open = np.zeros(count, dtype=bool)
+    # Each type of command is throttled on its own: start, stop, charging amps and charge port door
+    last_start, last_stop, last_amps, last_door = (np.full(count, -np.inf) for _ in range(4))
+    history = np.zeros((count, history_size))
+    history_sum = np.zeros(count)
+    results = np.zeros((count, len(RESULT_NAMES)))
+
+    for step, (time, duration, base_load, generation, battery_charge) in enumerate(zip(
+            samples['time'], samples['duration'], samples['base_load'], samples['generation'],
+            samples['battery_charge'])):
+
+        # The moving average of spare capacity, which includes the car's own charging
+        car_power = np.where(charging, amps * voltage, 0.0)
+        spare_capacity = generation - base_load - car_power
+        leaving = step >= history_count
+        history_sum -= np.where(leaving, history[rows, (step - history_count) % history_size], 0.0)
+        history[:, step % history_size] = spare_capacity
+        history_sum += spare_capacity
+        avg_spare_capacity = history_sum / np.minimum(step + 1, history_count)
+
+        possible_amps = np.minimum(np.trunc(amps + avg_spare_capacity / 1000 * amps_per_kw), max_amps)
+
+        start = (
+                ~charging & (time - last_start > new_command_interval)
+                & (avg_spare_capacity > min_spare_capacity) & (battery_charge > 98))
+        # The charge port is unlocked whenever charging should stop, even if the stop itself is throttled
+        should_stop = charging & (avg_spare_capacity < 0) & (possible_amps < 5)
+        stop = should_stop & (time - last_stop > new_command_interval)
+        door = should_stop & ~port_open & (time - last_door > new_command_interval)
+        change = (
+                charging & ~should_stop & (time - last_amps > new_command_interval)
+                & (possible_amps != amps) & (possible_amps > 0))
+
+        charging = (charging | start) & ~stop
+        port_open |= door
+        amps = np.where(change, possible_amps, amps)
+        last_start = np.where(start, time, last_start)
+        last_stop = np.where(stop, time, last_stop)
+        last_door = np.where(door, time, last_door)
+        last_amps = np.where(change, time, last_amps)
+        results[:, 3] += start.astype(int) + stop + door + change
+
+        # The energy charged until the next sample
+        car_power = np.where(charging, amps * voltage, 0.0)
+        solar_power = np.minimum(car_power, max(0.0, generation - base_load))
+        results[:, 0] += car_power * duration / 3600 / 1000
+        results[:, 1] += solar_power * duration / 3600 / 1000
+        results[:, 2] += (car_power - solar_power) * duration / 3600 / 1000
+
+    return results
+
+
+def sweep(
+        samples: Dict[str, np.ndarray],
+        parameters: np.ndarray,
+        workers: int = None,
+        chunk_size: int = 256,
+        voltage: int = 240) -> List[Dict]:
+    """
+    Simulates every parameter combination, splitting the combinations across processes
+    Args:
+        samples: The arrays from samples_to_arrays
+        parameters: A (combinations, parameters) array in the order of PARAMETER_NAMES
+        workers: The number of processes to use, defaults to the number of cpus
+        chunk_size: The number of combinations simulated together in one process
+        voltage: The voltage of the charger, used to convert amps to W
+
+    Returns:
+        The parameters and results of each combination
+    """
+    chunks = [parameters[start:start + chunk_size] for start in range(0, len(parameters), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(samples,)) as executor:
+        results = list(executor.map(_simulate_chunk, chunks, itertools.repeat(voltage)))
+
+    rows = []
+    for chunk, chunk_results in zip(chunks, results):
+        for combination, combination_results in zip(chunk, chunk_results):
+            row = dict(zip(PARAMETER_NAMES, combination.tolist()))
+            row.update(zip(RESULT_NAMES, combination_results.tolist()))
+            row['self_consumption'] = row['solar_energy'] / row['car_energy'] if row['car_energy'] > 0 else 0
+            rows.append(row)
+    _mark_pareto(rows)
+    return rows
+
+
+def format_table(rows: List[Dict], sort_by: str = 'solar_energy', limit: int = 20) -> str:
+    """
+    Formats the sweep results as a ranked table
+    Args:
+        rows: The results from sweep
+        sort_by: The column to rank by, highest first except for commands and grid energy which are lowest first
+        limit: The number of rows to include
+
+    Returns:
+        The table as text
+    """
+    ascending = sort_by in ('commands', 'grid_energy')
+    ranked = sorted(rows, key=lambda row: (row[sort_by] if ascending else -row[sort_by], row['commands']))
+    header = f"{'Rank'.ljust(6)}| {'Min Spare'.ljust(10)}| {'A/kW'.ljust(6)}| {'History'.ljust(8)}| " \
+             f"{'Max A'.ljust(6)}| {'Interval'.ljust(9)}| {'Solar kWh'.ljust(10)}| {'Grid kWh'.ljust(9)}| " \
+             f"{'Self Cons.'.ljust(11)}| {'Commands'.ljust(9)}| Pareto"
+    lines = [header, '-' * len(header)]
+    for rank, row in enumerate(ranked[:limit], start=1):
+        self_consumption = f"{row['self_consumption'] * 100:.1f}%"
+        lines.append(
+            f"{str(rank).ljust(6)}| {row['min_spare_capacity']:<10.0f}| {row['amps_per_kw']:<6.1f}| "
+            f"{row['history_count']:<8.0f}| {row['max_amps']:<6.0f}| {row['new_command_interval']:<9.0f}| "
+            f"{row['solar_energy']:<10.2f}| {row['grid_energy']:<9.2f}| {self_consumption:<11}| "
+            f"{row['commands']:<9.0f}| {'*' if row['pareto'] else ''}")
+    return '\n'.join(lines)
+
+
+def _init_worker(samples: Dict[str, np.ndarray]):
+    """ Keeps the samples in the worker process """
+    _worker_samples.update(samples)
+
+
+def _simulate_chunk(parameters: np.ndarray, voltage: int) -> np.ndarray:
+    """ Simulates a chunk of parameter combinations in a worker process """
+    return simulate(_worker_samples, parameters, voltage)
+
+
+def _mark_pareto(rows: List[Dict]):
+    """ Marks the rows where no other row charges more from solar with the same or fewer commands """
+    best_solar = -np.inf
+    for row in sorted(rows, key=lambda item: (item['commands'], -item['solar_energy'])):
+        row['pareto'] = row['solar_energy'] > best_solar
+        best_solar = max(best_solar, row['solar_energy'])
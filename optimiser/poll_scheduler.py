@@ -0,0 +1,107 @@
+import datetime
+from typing import Sequence
+from optimiser.solar_charge_state import SolarChargeState
+
+
+class PollScheduler:
+
+    def __init__(
+            self,
+            min_interval: int = 10,
+            stable_interval: int = 60,
+            disconnected_interval: int = 120,
+            night_interval: int = 300,
+            car_interval: int = 800,
+            day_start_hour: int = 6,
+            day_end_hour: int = 18,
+            threshold_margin: int = 500,
+            threshold_span: int = 2000,
+            volatility_scale: int = 500):
+        """
+        Picks how long to wait between polls based on the recent solar generation, the charge state and the time of
+        day. Polls quickly when the spare capacity is close to a charging decision and backs off when nothing is
+        likely to change.
+        Args:
+            min_interval: The shortest time in seconds between polls, used when close to a decision threshold
+            stable_interval: The longest time in seconds between polls during the day
+            disconnected_interval: The time in seconds between polls during the day when the car is disconnected
+            night_interval: The time in seconds between polls outside daylight hours when the car is not charging
+            car_interval: The time in seconds between requests for the car data, to minimise car awake time
+            day_start_hour: The hour of the day that solar generation starts
+            day_end_hour: The hour of the day that solar generation ends
+            threshold_margin: The distance in W from a decision threshold that is polled at the min interval
+            threshold_span: The distance in W beyond the margin over which the interval grows to the stable interval
+            volatility_scale: The standard deviation of spare capacity in W that halves the interval
+        """
+        self.min_interval = min_interval
+        self.stable_interval = stable_interval
+        self.disconnected_interval = disconnected_interval
+        self.night_interval = night_interval
+        self.car_interval = car_interval
+        self.day_start_hour = day_start_hour
+        self.day_end_hour = day_end_hour
+        self.threshold_margin = threshold_margin
+        self.threshold_span = threshold_span
+        self.volatility_scale = volatility_scale
+        self.last_car_update = None
+
+    def is_daylight(self, now: datetime.datetime) -> bool:
+        """ Returns True if the time is within the hours that solar is generated """
+        return self.day_start_hour <= now.hour < self.day_end_hour
+
+    def should_update_car(
+            self,
+            solar_charge_state: SolarChargeState,
+            now: datetime.datetime,
+            charge_states: Sequence[str] = None) -> bool:
+        """
+        Determines if the car data should be requested this tick and records the request time if it should
+        Args:
+            solar_charge_state: The current solar charge state
+            now: The current time
+            charge_states: The charge state of every car, defaults to the charge state of the solar charge state
+
+        Returns:
+            True if the car data should be requested
+        """
+        if charge_states is None:
+            charge_states = [solar_charge_state.charge_state]
+        due = self.last_car_update is None or (now - self.last_car_update).total_seconds() >= self.car_interval
+        if due and (self.is_daylight(now) or any(charge_state != 'Stopped' for charge_state in charge_states)):
+            self.last_car_update = now
+            return True
+        return False
+
+    def poll_interval(
+            self,
+            solar_charge_state: SolarChargeState,
+            threshold: float,
+            now: datetime.datetime,
+            charge_states: Sequence[str] = None) -> float:
+        """
+        Determines the time between polls for the current conditions, polling for the most active car
+        Args:
+            solar_charge_state: The current solar charge state, which has the household values
+            threshold: The spare capacity in W required to start charging
+            now: The current time
+            charge_states: The charge state of every car, defaults to the charge state of the solar charge state
+
+        Returns:
+            The number of seconds between the start of this poll and the next
+        """
+        if charge_states is None:
+            charge_states = [solar_charge_state.charge_state]
+        if 'Charging' not in charge_states and not self.is_daylight(now):
+            return self.night_interval
+        if all(charge_state == 'Disconnected' for charge_state in charge_states):
+            return self.disconnected_interval
+
+        # Charging is started above the threshold and stopped below zero spare capacity
+        avg_spare_capacity = solar_charge_state.avg_spare_capacity
+        distance = min(abs(avg_spare_capacity - threshold), abs(avg_spare_capacity))
+        distance_factor = min(1.0, max(0.0, (distance - self.threshold_margin) / self.threshold_span))
+
+        # Poll faster when the generation is moving around, e.g. with passing clouds
+        volatility_factor = 1 / (1 + solar_charge_state.spare_capacity_stats.std / self.volatility_scale)
+
+        return self.min_interval + (self.stable_interval - self.min_interval) * distance_factor * volatility_factor
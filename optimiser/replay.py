@@ -0,0 +1,177 @@
+import datetime
+import itertools
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from optimiser.force_charge_command import ForceChargeCommand
+from optimiser.simulated_tesla_api import SimulatedClock, SimulatedTeslaAPI
+from optimiser.solar_charge_state import SolarChargeState
+from optimiser.tesla_solar_optimiser import TeslaSolarOptimiser
+
+
+class Sample(NamedTuple):
+    """ A historical reading of the household, the load doesn't include the car """
+    time: datetime.datetime
+    base_load: float
+    generation: float
+    battery_charge: float
+
+
+def load_samples(path: str, voltage: int = 240, battery_charge: float = 100) -> Iterator[Sample]:
+    """
+    Reads historical samples from a data.csv file written by the optimiser's data logger or a log_difference.txt file
+    Args:
+        path: The path of the file
+        voltage: The voltage of the charger, used to remove the car's charging from the data.csv load
+        battery_charge: The powerwall charge to use for files that don't record it
+
+    Returns:
+        The samples in the order of the file
+    """
+    with open(path) as data_file:
+        for line in data_file:
+            columns = line.strip().split(',')
+            if len(columns) == 8:
+                # time, charge state, load, generation, spare capacity, amps, vehicle charge, powerwall charge in W
+                car_power = float(columns[5]) * voltage if columns[1] == 'Charging' else 0
+                yield Sample(
+                    time=datetime.datetime.strptime(columns[0], '%Y-%m-%dT%H:%M:%S'),
+                    base_load=float(columns[2]) - car_power,
+                    generation=float(columns[3]),
+                    battery_charge=float(columns[7]))
+            elif len(columns) == 5:
+                # time, spare capacity, avg spare capacity, generation, load in kW
+                yield Sample(
+                    time=datetime.datetime.fromisoformat(columns[0]),
+                    base_load=float(columns[4]) * 1000,
+                    generation=float(columns[3]) * 1000,
+                    battery_charge=battery_charge)
+
+
+@dataclass
+class ReplayResult:
+    """
+    The outcome of replaying samples through the charging decision logic
+
+    Args:
+        commands: The (time, command, parameters) of each command that would have been sent
+        car_energy: The energy in kWh charged into the car
+        solar_energy: The energy in kWh charged into the car from spare solar
+        grid_energy: The energy in kWh charged into the car that wasn't covered by spare solar
+        hours: The length of time replayed in hours
+    """
+    commands: List[Tuple[datetime.datetime, str, Dict]] = field(default_factory=list)
+    car_energy: float = 0
+    solar_energy: float = 0
+    grid_energy: float = 0
+    hours: float = 0
+
+    @property
+    def commands_per_hour(self) -> float:
+        """ The average number of commands sent per hour """
+        return len(self.commands) / self.hours if self.hours > 0 else 0
+
+    @property
+    def command_counts(self) -> Dict[str, int]:
+        """ The number of commands sent of each type """
+        counts = {}
+        for _, command, _ in self.commands:
+            counts[command] = counts.get(command, 0) + 1
+        return counts
+
+    def __str__(self) -> str:
+        counts = ', '.join(f"{command}: {count}" for command, count in sorted(self.command_counts.items()))
+        return f"Replayed {self.hours:.1f} hours | " \
+               f"Car: {self.car_energy:.2f} kWh | " \
+               f"Solar: {self.solar_energy:.2f} kWh | " \
+               f"Grid: {self.grid_energy:.2f} kWh | " \
+               f"Commands: {len(self.commands)} ({self.commands_per_hour:.2f}/h) {counts}"
+
+
+class ReplayOptimiser(TeslaSolarOptimiser):
+
+    def __init__(self, force_charge_command: ForceChargeCommand, **kwargs: Any):
+        """
+        An optimiser that keeps the force charge configuration in memory rather than reading and writing the file
+        Args:
+            force_charge_command: The force charge configuration to use for the replay
+            **kwargs: The arguments for the TeslaSolarOptimiser
+        """
+        super().__init__(**kwargs)
+        self._replay_force_charge_command = force_charge_command
+
+    def _load_force_charge_command(self) -> ForceChargeCommand:
+        return self._replay_force_charge_command
+
+    def _save_force_charge_command(self, force_charge_command: ForceChargeCommand):
+        self._replay_force_charge_command = force_charge_command
+
+
+def replay(
+        samples: Iterable[Sample],
+        force_charge_command: ForceChargeCommand = None,
+        car_options: Dict = None,
+        state_options: Dict = None,
+        max_gap: float = 300,
+        **optimiser_options: Any) -> ReplayResult:
+    """
+    Runs historical samples through the optimiser's charging decisions using a simulated car and clock
+    Args:
+        samples: The samples to replay in time order
+        force_charge_command: The force charge configuration, defaults to not forcing a charge
+        car_options: The arguments for the SimulatedTeslaAPI e.g. vehicle_charge, voltage
+        state_options: The arguments for the SolarChargeState e.g. history_count, amps_per_kw, max_amps
+        max_gap: Gaps between samples longer than this many seconds aren't counted, e.g. when the optimiser was off
+        **optimiser_options: The arguments for the TeslaSolarOptimiser e.g. new_command_interval
+
+    Returns:
+        The commands that would have been sent and the energy charged into the car
+    """
+    samples = iter(samples)
+    result = ReplayResult()
+    first = next(samples, None)
+    if first is None:
+        return result
+
+    clock = SimulatedClock(first.time)
+    tesla_api = SimulatedTeslaAPI(clock, **(car_options or {}))
+    optimiser = ReplayOptimiser(
+        force_charge_command=replace(force_charge_command or ForceChargeCommand()),
+        tesla_api=tesla_api,
+        clock=clock.now,
+        **optimiser_options)
+    optimiser.solar_charge_state = SolarChargeState(**(state_options or {}))
+
+    previous = None
+    for sample in itertools.chain([first], samples):
+        if previous is not None:
+            seconds = min((sample.time - previous.time).total_seconds(), max_gap)
+            _account(result, tesla_api, previous, seconds)
+            tesla_api.advance(seconds)
+            result.hours += seconds / 3600
+
+        clock.set(sample.time)
+        tesla_api.set_sample(sample.base_load, sample.generation, sample.battery_charge)
+        optimiser.solar_charge_state = tesla_api.update_battery_charge_state(optimiser.solar_charge_state)
+        optimiser.solar_charge_state = tesla_api.update_car_charge_state(optimiser.solar_charge_state)
+        optimiser._determine_command()
+        previous = sample
+
+    result.commands = tesla_api.commands
+    return result
+
+
+def _account(result: ReplayResult, tesla_api: SimulatedTeslaAPI, sample: Sample, seconds: float):
+    """
+    Adds the energy charged into the car over a period to the result
+    Args:
+        result: The result to add to
+        tesla_api: The simulated car
+        sample: The sample at the start of the period
+        seconds: The length of the period
+    """
+    car_power = tesla_api.car_power
+    solar_power = min(car_power, max(0.0, sample.generation - sample.base_load))
+    result.car_energy += car_power * seconds / 3600 / 1000
+    result.solar_energy += solar_power * seconds / 3600 / 1000
+    result.grid_energy += (car_power - solar_power) * seconds / 3600 / 1000
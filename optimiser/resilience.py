@@ -0,0 +1,211 @@
+import random
+import threading
+import time
+from typing import Callable, Optional, Tuple, Type, TypeVar
+
+T = TypeVar('T')
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+
+class Deadline:
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        """
+        A point in time that work has to finish by, so retries and waits can share one time budget
+        Args:
+            seconds: The time in seconds from now until the deadline
+            clock: Returns the current time in seconds
+        """
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        """ The time in seconds left until the deadline, 0 once it has passed """
+        return max(0.0, self.expires_at - self.clock())
+
+    @property
+    def expired(self) -> bool:
+        """ True once the deadline has passed """
+        return self.remaining() <= 0
+
+    def limit(self, seconds: float) -> float:
+        """ Limits a time in seconds to the time left until the deadline """
+        return min(seconds, self.remaining())
+
+    def within(self, seconds: float) -> 'Deadline':
+        """ A deadline that is the earlier of this one and a time in seconds from now """
+        return Deadline(self.limit(seconds), self.clock)
+
+
+class RetryPolicy:
+
+    def __init__(
+            self,
+            attempts: int = 3,
+            base_delay: float = 1,
+            max_delay: float = 10,
+            multiplier: float = 2,
+            sleep: Callable[[float], None] = time.sleep,
+            rng: random.Random = None):
+        """
+        Retries a failed call after an exponentially growing, randomly jittered delay. The jitter spreads out the
+        retries of callers that failed at the same time, so a struggling service isn't hit by all of them at once.
+        Args:
+            attempts: The maximum number of times to make the call, including the first
+            base_delay: The upper limit in seconds of the delay before the first retry
+            max_delay: The upper limit in seconds of the delay before any retry
+            multiplier: The factor the upper limit of the delay grows by after each retry
+            sleep: Waits for a time in seconds, replaced to test without waiting
+            rng: The random number generator for the jitter
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.sleep = sleep
+        self.rng = rng if rng is not None else random.Random()
+
+    def delay(self, attempt: int) -> float:
+        """
+        The time to wait after a failed attempt, between 0 and the exponential backoff for the attempt ("full jitter")
+        Args:
+            attempt: The number of the attempt that failed, starting at 1
+
+        Returns:
+            The delay in seconds
+        """
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1)))
+
+    def call(
+            self,
+            function: Callable[[], T],
+            retry_on: Tuple[Type[Exception], ...],
+            deadline: Optional[Deadline] = None,
+            on_error: Callable[[Exception], None] = None,
+            on_retry: Callable[[], None] = None) -> T:
+        """
+        Calls a function, retrying it when it raises one of the retryable errors
+        Args:
+            function: The function to call
+            retry_on: The errors that are worth retrying
+            deadline: No retry is started that would wait past the deadline
+            on_error: Called with each retryable error, e.g. to record it
+            on_retry: Called before each retry
+
+        Returns:
+            The result of the function
+
+        Raises:
+            The last error once the attempts or the time run out
+        """
+        attempt = 1
+        while True:
+            try:
+                return function()
+            except retry_on as e:
+                if on_error is not None:
+                    on_error(e)
+                delay = self.delay(attempt)
+                if attempt >= self.attempts or (deadline is not None and deadline.remaining() <= delay):
+                    raise
+            if on_retry is not None:
+                on_retry()
+            self.sleep(delay)
+            attempt += 1
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of making a call while its circuit breaker is open """
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 3,
+            reset_timeout: float = 60,
+            clock: Callable[[], float] = time.monotonic,
+            on_state_change: Callable[['CircuitBreaker'], None] = None):
+        """
+        Stops calling an endpoint after it has failed several times in a row, so a degraded service isn't hammered
+        and callers fail fast instead of waiting on it. After the reset timeout one trial call is let through, the
+        breaker closes again if it succeeds and stays open for another reset timeout if it fails.
+        Args:
+            name: The name of the endpoint, used in errors and metrics
+            failure_threshold: The number of failures in a row that opens the breaker
+            reset_timeout: The time in seconds the breaker stays open before a trial call
+            clock: Returns the current time in seconds
+            on_state_change: Called with the breaker when its state changes
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Checks a call can be made, call record_success or record_failure with its outcome
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half open with a trial call already running
+        """
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._trial_running):
+                retry_in = max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+                raise CircuitOpenError(f"{self.name} is unavailable, the next attempt is in {retry_in:.0f} seconds")
+            if self.state == HALF_OPEN:
+                self._trial_running = True
+
+    def record_success(self):
+        """ Records a successful call, closing the breaker """
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        """ Records a failed call, opening the breaker if the trial call or too many calls in a row failed """
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self._set_state(OPEN)
+
+    def call(self, function: Callable[[], T]) -> T:
+        """
+        Calls a function through the breaker, any error it raises counts as a failure
+        Args:
+            function: The function to call
+
+        Returns:
+            The result of the function
+        """
+        self.before_call()
+        try:
+            result = function()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def _set_state(self, state: str):
+        """ Changes the state and notifies the listener """
+        self.state = state
+        if self.on_state_change is not None:
+            self.on_state_change(self)
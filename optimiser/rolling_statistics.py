@@ -0,0 +1,158 @@
+import math
+from array import array
+from collections import deque
+from typing import Iterator, Optional, Tuple
+
+
+class RollingStatistics:
+    """
+    A fixed size ring buffer of timestamped values that keeps the sum, variance, min, max and an exponentially
+    weighted moving average up to date as values are added, so reading any of them doesn't depend on the window size.
+    """
+
+    __slots__ = (
+        'max_samples', 'max_age', 'ewma_seconds', '_timestamps', '_values', '_start', '_count', '_added',
+        '_sum', '_sum_squares', '_evictions', '_ewma', '_min_candidates', '_max_candidates')
+
+    def __init__(self, max_samples: int, max_age: Optional[float] = None, ewma_seconds: float = 300):
+        """
+        Args:
+            max_samples: The maximum number of values to retain
+            max_age: The maximum age in seconds of a retained value relative to the newest value, None for no limit
+            ewma_seconds: The time constant in seconds of the exponentially weighted moving average
+        """
+        if max_samples < 1:
+            raise ValueError('max_samples must be at least 1')
+
+        self.max_samples = max_samples
+        self.max_age = max_age
+        self.ewma_seconds = ewma_seconds
+        self._timestamps = array('d', [0.0]) * max_samples
+        self._values = array('d', [0.0]) * max_samples
+        self.clear()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def clear(self):
+        """ Removes all values """
+        self._start = 0
+        self._count = 0
+        self._added = 0
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._evictions = 0
+        self._ewma = None
+        # Monotonic queues of (sequence number, value) so the window min and max are available in O(1)
+        self._min_candidates = deque()
+        self._max_candidates = deque()
+
+    def add(self, timestamp: float, value: float):
+        """
+        Adds a value, removing the oldest values that no longer fit in the window
+        Args:
+            timestamp: The timestamp of when the value occurred
+            value: The value to add to the series
+        """
+        if self._count > 0:
+            newest = (self._start + self._count - 1) % self.max_samples
+            elapsed = max(0.0, timestamp - self._timestamps[newest])
+            alpha = 1 - math.exp(-elapsed / self.ewma_seconds) if self.ewma_seconds > 0 else 1.0
+            self._ewma += alpha * (value - self._ewma)
+        else:
+            self._ewma = float(value)
+
+        if self._count == self.max_samples:
+            self._evict()
+        if self.max_age is not None:
+            while self._count > 0 and timestamp - self._timestamps[self._start] > self.max_age:
+                self._evict()
+
+        index = (self._start + self._count) % self.max_samples
+        self._timestamps[index] = timestamp
+        self._values[index] = value
+        self._count += 1
+        self._sum += value
+        self._sum_squares += value * value
+
+        sequence = self._added
+        self._added += 1
+        while self._min_candidates and self._min_candidates[-1][1] >= value:
+            self._min_candidates.pop()
+        self._min_candidates.append((sequence, value))
+        while self._max_candidates and self._max_candidates[-1][1] <= value:
+            self._max_candidates.pop()
+        self._max_candidates.append((sequence, value))
+
+    def _evict(self):
+        """ Removes the oldest value """
+        value = self._values[self._start]
+        self._start = (self._start + 1) % self.max_samples
+        self._count -= 1
+        self._sum -= value
+        self._sum_squares -= value * value
+
+        oldest_sequence = self._added - self._count
+        if self._min_candidates and self._min_candidates[0][0] < oldest_sequence:
+            self._min_candidates.popleft()
+        if self._max_candidates and self._max_candidates[0][0] < oldest_sequence:
+            self._max_candidates.popleft()
+
+        # Recalculate the sums once per lap of the buffer so floating point error can't build up
+        self._evictions += 1
+        if self._evictions >= self.max_samples:
+            self._evictions = 0
+            self._sum = math.fsum(value for _, value in self.items())
+            self._sum_squares = math.fsum(value * value for _, value in self.items())
+
+    def items(self) -> Iterator[Tuple[float, float]]:
+        """ Iterates over the (timestamp, value) pairs from oldest to newest """
+        for offset in range(self._count):
+            index = (self._start + offset) % self.max_samples
+            yield self._timestamps[index], self._values[index]
+
+    @property
+    def sum(self) -> float:
+        """ The sum of the values in the window """
+        return self._sum if self._count > 0 else 0.0
+
+    @property
+    def mean(self) -> float:
+        """ The mean of the values in the window, 0 if there are no values """
+        return self._sum / self._count if self._count > 0 else 0.0
+
+    @property
+    def variance(self) -> float:
+        """ The population variance of the values in the window """
+        if self._count < 2:
+            return 0.0
+        mean = self._sum / self._count
+        return max(0.0, self._sum_squares / self._count - mean * mean)
+
+    @property
+    def std(self) -> float:
+        """ The population standard deviation of the values in the window """
+        return math.sqrt(self.variance)
+
+    @property
+    def ewma(self) -> float:
+        """ The exponentially weighted moving average of all values added, 0 if there are no values """
+        return self._ewma if self._ewma is not None else 0.0
+
+    @property
+    def min(self) -> float:
+        """ The smallest value in the window, 0 if there are no values """
+        return self._min_candidates[0][1] if self._count > 0 else 0.0
+
+    @property
+    def max(self) -> float:
+        """ The largest value in the window, 0 if there are no values """
+        return self._max_candidates[0][1] if self._count > 0 else 0.0
+
+    @property
+    def latest(self) -> Optional[Tuple[float, float]]:
+        """ The newest (timestamp, value) pair or None if there are no values """
+        if self._count == 0:
+            return None
+        index = (self._start + self._count - 1) % self.max_samples
+        return self._timestamps[index], self._values[index]
@@ -0,0 +1,210 @@
+import datetime
+from collections import OrderedDict
+from pathlib import Path
+from typing import IO, List, Optional, Tuple
+import numpy as np
+
+from optimiser.solar_charge_state import SolarChargeState
+
+# One fixed width record per sample, the powers are in W and the charges in %
+SAMPLE_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('load', '<f4'),
+    ('generation', '<f4'),
+    ('spare_capacity', '<f4'),
+    ('amps', '<f4'),
+    ('vehicle_charge', '<f4'),
+    ('battery_charge', '<f4'),
+])
+
+
+class SampleStore:
+
+    def __init__(self, directory: str = 'data', max_open_partitions: int = 16):
+        """
+        An append only binary store of samples, partitioned into one file per day. The files are memory mapped for
+        reading and each one is sorted by timestamp, so a time range is found with a binary search rather than by
+        parsing the whole history.
+        Args:
+            directory: The directory to store the partition files
+            max_open_partitions: The number of most recently read partitions kept memory mapped, enough for the
+                forecaster's profile days so the maps are reused every tick
+        """
+        self.directory = Path(directory)
+        self.max_open_partitions = max_open_partitions
+        self._append_file: Optional[IO] = None
+        self._append_day: Optional[datetime.date] = None
+        self._last_timestamp: Optional[float] = None
+        self._partitions: OrderedDict[Path, Tuple[int, np.memmap]] = OrderedDict()
+        # Samples older than the last one appended, e.g. after the clock was set back, are skipped
+        self.out_of_order_count = 0
+
+    def append(self, solar_charge_state: SolarChargeState, timestamp: float = None) -> bool:
+        """
+        Appends the current values of a solar charge state
+        Args:
+            solar_charge_state: The state to store
+            timestamp: The timestamp of the sample, defaults to now
+
+        Returns:
+            False if the sample was skipped because it is older than the last one
+        """
+        return self.append_record(
+            timestamp=datetime.datetime.now().timestamp() if timestamp is None else timestamp,
+            load=solar_charge_state.current_load,
+            generation=solar_charge_state.current_generation,
+            spare_capacity=solar_charge_state.spare_capacity,
+            amps=solar_charge_state.charge_current_request,
+            vehicle_charge=solar_charge_state.vehicle_charge,
+            battery_charge=solar_charge_state.battery_charge)
+
+    def append_record(
+            self,
+            timestamp: float,
+            load: float,
+            generation: float,
+            spare_capacity: float,
+            amps: float,
+            vehicle_charge: float,
+            battery_charge: float) -> bool:
+        """
+        Appends a sample to the partition for its day. The partitions are kept in time order, so a sample older than
+        the last one appended, e.g. after the clock was corrected, is skipped rather than stored.
+        Args:
+            timestamp: The unix timestamp of the sample
+            load: The household load in W
+            generation: The solar generation in W
+            spare_capacity: The generation - load in W
+            amps: The charge current requested by the car
+            vehicle_charge: The percentage of battery that is charged in the vehicle
+            battery_charge: The percentage of battery that is charged for the powerwall
+
+        Returns:
+            False if the sample was skipped because it is older than the last one
+        """
+        if self._last_timestamp is not None and timestamp < self._last_timestamp:
+            self.out_of_order_count += 1
+            return False
+
+        day = datetime.date.fromtimestamp(timestamp)
+        if day != self._append_day:
+            self.close()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._append_file = open(self._partition_path(day), 'ab')
+            self._append_day = day
+
+        record = np.array(
+            [(timestamp, load, generation, spare_capacity, amps, vehicle_charge, battery_charge)],
+            dtype=SAMPLE_DTYPE)
+        self._append_file.write(record.tobytes())
+        self._append_file.flush()  # Make the sample visible to readers in other processes
+        self._last_timestamp = timestamp
+        return True
+
+    @property
+    def last_timestamp(self) -> Optional[float]:
+        """ The timestamp of the last sample appended, None if none has been """
+        return self._last_timestamp
+
+    def read(self, start: float, end: float) -> np.ndarray:
+        """
+        Reads the samples in a time range
+        Args:
+            start: The unix timestamp of the start of the range, inclusive
+            end: The unix timestamp of the end of the range, exclusive
+
+        Returns:
+            A structured array of SAMPLE_DTYPE records in time order
+        """
+        if end <= start:
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+
+        day = datetime.date.fromtimestamp(start)
+        last_day = datetime.date.fromtimestamp(end)
+        slices = []
+        while day <= last_day:
+            samples = self._open_partition(self._partition_path(day))
+            if samples is not None and len(samples) > 0:
+                timestamps = samples['timestamp']
+                first = np.searchsorted(timestamps, start, side='left')
+                last = np.searchsorted(timestamps, end, side='left')
+                if last > first:
+                    slices.append(samples[first:last])
+            day += datetime.timedelta(days=1)
+
+        if len(slices) == 0:
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+        return np.concatenate(slices)
+
+    def days(self) -> List[datetime.date]:
+        """ The days that have samples stored, oldest first """
+        if not self.directory.exists():
+            return []
+        return sorted(
+            datetime.datetime.strptime(path.stem, 'samples-%Y-%m-%d').date()
+            for path in self.directory.glob('samples-*.bin'))
+
+    def close(self):
+        """ Closes the file used for appending """
+        if self._append_file is not None:
+            self._append_file.close()
+            self._append_file = None
+            self._append_day = None
+
+    def import_csv(self, csv_path: str, time_format: str = '%Y-%m-%dT%H:%M:%S'):
+        """
+        Appends the samples from a data.csv file written by the optimiser's data logger
+        Args:
+            csv_path: The path of the csv file
+            time_format: The format of the time in the first column
+        """
+        with open(csv_path) as csv_file:
+            for line in csv_file:
+                columns = line.strip().split(',')
+                if len(columns) != 8:
+                    continue
+                timestamp = datetime.datetime.strptime(columns[0], time_format).timestamp()
+                self.append_record(
+                    timestamp=timestamp,
+                    load=float(columns[2]),
+                    generation=float(columns[3]),
+                    spare_capacity=float(columns[4]),
+                    amps=float(columns[5]),
+                    vehicle_charge=float(columns[6]),
+                    battery_charge=float(columns[7]))
+
+    def _partition_path(self, day: datetime.date) -> Path:
+        """ The path of the file holding the samples for a day """
+        return self.directory / f"samples-{day:%Y-%m-%d}.bin"
+
+    def _open_partition(self, path: Path) -> Optional[np.memmap]:
+        """
+        Memory maps a partition file, reusing the existing map if the file hasn't grown since it was opened
+        Args:
+            path: The path of the partition file
+
+        Returns:
+            The samples in the partition or None if there are none
+        """
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return None
+
+        # Ignore a partially written record at the end of the file
+        count = size // SAMPLE_DTYPE.itemsize
+        if count == 0:
+            return None
+
+        cached = self._partitions.get(path)
+        if cached is not None and cached[0] == count:
+            self._partitions.move_to_end(path)
+            return cached[1]
+
+        samples = np.memmap(path, dtype=SAMPLE_DTYPE, mode='r', shape=(count,))
+        self._partitions[path] = (count, samples)
+        self._partitions.move_to_end(path)
+        while len(self._partitions) > self.max_open_partitions:
+            # The map's file is closed once the arrays read from it are no longer used
+            self._partitions.popitem(last=False)
+        return samples
@@ -0,0 +1,112 @@
+import struct
+import time
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Tuple
+
+# sequence number, write time, payload length and payload crc32 at the start of the shared memory
+_HEADER = struct.Struct('<QdII')
+_SEQUENCE = struct.Struct('<Q')
+
+
+class SharedMemoryChannel:
+
+    def __init__(self, name: str, capacity: int = 1024 * 1024):
+        """
+        Passes the latest version of a payload from one writer process to any number of reader processes through
+        shared memory. Writes are versioned with a seqlock: the sequence number is odd while a write is in progress
+        and readers retry until they copy the payload between two reads of the same even sequence number, so a
+        reader never sees a half written payload.
+
+        The stores are plain writes to the shared memory with no memory barriers. They become visible to other
+        processes in program order on x86, but ARM, e.g. a Raspberry Pi, may reorder them, and the GIL doesn't order
+        anything between processes. The header therefore carries a crc32 of the payload and a copy that doesn't match
+        it is read again, so a reordered write is retried rather than returned.
+        Args:
+            name: The name of the shared memory segment, the same name is used in each process
+            capacity: The maximum size of the payload in bytes
+        """
+        self.name = name
+        self.capacity = capacity
+        self._shared_memory: Optional[shared_memory.SharedMemory] = None
+
+    def open(self):
+        """ Attaches to the shared memory segment, creating it if no other process has """
+        if self._shared_memory is not None:
+            return
+        try:
+            self._shared_memory = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            try:
+                self._shared_memory = shared_memory.SharedMemory(
+                    name=self.name, create=True, size=_HEADER.size + self.capacity)
+            except FileExistsError:  # Another process created it first
+                self._shared_memory = shared_memory.SharedMemory(name=self.name)
+
+        # The segment outlives any one process, it is removed by unlink rather than when this process exits
+        resource_tracker.unregister(self._shared_memory._name, 'shared_memory')
+        self.capacity = self._shared_memory.size - _HEADER.size
+
+    def close(self):
+        """ Detaches from the shared memory segment """
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+            self._shared_memory = None
+
+    def unlink(self):
+        """ Removes the shared memory segment once every process has closed it """
+        self.open()
+        self._shared_memory.unlink()
+        self.close()
+
+    @property
+    def sequence(self) -> int:
+        """ The version of the payload, 0 if nothing has been written. Cheap to check for a new version. """
+        self.open()
+        return _SEQUENCE.unpack_from(self._shared_memory.buf, 0)[0]
+
+    def write(self, payload: bytes):
+        """
+        Replaces the payload, only one process may write to a channel
+        Args:
+            payload: The new payload
+        """
+        if len(payload) > self.capacity:
+            raise ValueError(f"Payload of {len(payload)} bytes is larger than the {self.capacity} byte channel")
+
+        self.open()
+        buffer = self._shared_memory.buf
+        sequence = _SEQUENCE.unpack_from(buffer, 0)[0]
+        if sequence % 2 == 1:  # A previous writer died part way through a write
+            sequence += 1
+        _SEQUENCE.pack_into(buffer, 0, sequence + 1)
+        buffer[_HEADER.size:_HEADER.size + len(payload)] = payload
+        _HEADER.pack_into(buffer, 0, sequence + 1, time.time(), len(payload), zlib.crc32(payload))
+        _SEQUENCE.pack_into(buffer, 0, sequence + 2)
+
+    def read(self, timeout: float = 1.0) -> Tuple[int, float, Optional[bytes]]:
+        """
+        Copies the latest payload
+        Args:
+            timeout: The maximum time in seconds to wait for a write in progress to finish
+
+        Returns:
+            The sequence number, the time it was written and the payload, or (0, 0, None) if nothing has been written
+
+        Raises:
+            TimeoutError: If a consistent copy couldn't be read within the timeout
+        """
+        self.open()
+        buffer = self._shared_memory.buf
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence, write_time, length, checksum = _HEADER.unpack_from(buffer, 0)
+            if sequence == 0:
+                return 0, 0.0, None
+            if sequence % 2 == 0 and length <= self.capacity:
+                payload = bytes(buffer[_HEADER.size:_HEADER.size + length])
+                if _SEQUENCE.unpack_from(buffer, 0)[0] == sequence and zlib.crc32(payload) == checksum:
+                    return sequence, write_time, payload
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Could not read a consistent payload from {self.name}")
+            time.sleep(0.0001)
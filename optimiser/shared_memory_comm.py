@@ -0,0 +1,153 @@
+import datetime
+import hashlib
+import json
+from dataclasses import replace
+from typing import Dict, Optional, Tuple
+
+from optimiser.file_comm import FileComm, apply_force_charge_request
+from optimiser.force_charge_command import ForceChargeCommand
+from optimiser.shared_memory_channel import SharedMemoryChannel
+
+
+class SharedMemoryComm:
+
+    def __init__(self, prefix: str = 'tso'):
+        """
+        Shares the state and force charge command between the optimiser and the server through shared memory, so
+        no files are read or written each tick. Each channel has a single writer:
+            state: the optimiser's state, written by the optimiser
+            force_charge: the current force charge command, written by the optimiser
+            force_charge_request: requests to turn force charging on or off, written by the server and applied by the
+                optimiser on its next tick
+        The force charge command is still saved to its file when it changes, by the optimiser and by the server for
+        each request, so it survives a restart, and the files are used until the optimiser has written to the
+        channels.
+        Args:
+            prefix: The prefix of the shared memory segment names
+        """
+        self.state_channel = SharedMemoryChannel(f'{prefix}_state', capacity=1024 * 1024)
+        self.force_charge_channel = SharedMemoryChannel(f'{prefix}_force_charge', capacity=4096)
+        self.force_charge_request_channel = SharedMemoryChannel(f'{prefix}_force_charge_request', capacity=4096)
+        self._file_comm = FileComm()
+        self._force_charge_command: Optional[ForceChargeCommand] = None
+        self._request_sequence: Optional[int] = None
+        self._etags: Dict[str, Tuple[int, str]] = {}
+
+    @property
+    def channels(self) -> Tuple[SharedMemoryChannel, ...]:
+        """ All of the channels """
+        return self.state_channel, self.force_charge_channel, self.force_charge_request_channel
+
+    def open(self):
+        """ Attaches to the shared memory of every channel, creating it if required """
+        for channel in self.channels:
+            channel.open()
+
+    def close(self):
+        """ Detaches from the shared memory of every channel """
+        for channel in self.channels:
+            channel.close()
+
+    def unlink(self):
+        """ Removes the shared memory of every channel, called by the process that owns the channels on exit """
+        for channel in self.channels:
+            channel.unlink()
+
+    def publish_state(self, payload: str):
+        """
+        Makes the optimiser's state available to the server
+        Args:
+            payload: The state as a json string
+        """
+        self.state_channel.write(payload.encode())
+
+    def load_force_charge_command(self) -> ForceChargeCommand:
+        """ Gets the current force charge command for the optimiser, applying any new request from the server """
+        if self._force_charge_command is None:
+            self._force_charge_command = ForceChargeCommand.load()
+            # Requests made before the optimiser started have already been saved to the file by the server
+            self._request_sequence = self.force_charge_request_channel.sequence
+            self.force_charge_channel.write(self._force_charge_command.to_json().encode())
+
+        if self.force_charge_request_channel.sequence != self._request_sequence:
+            self._request_sequence, _, payload = self.force_charge_request_channel.read()
+            request = json.loads(payload)
+            force_charge_command = replace(self._force_charge_command)
+            apply_force_charge_request(
+                force_charge_command,
+                request['force_charge'],
+                datetime.datetime.fromtimestamp(request['request_time']))
+            self.save_force_charge_command(force_charge_command)
+
+        return replace(self._force_charge_command)
+
+    def save_force_charge_command(self, force_charge_command: ForceChargeCommand):
+        """
+        Saves changes the optimiser has made to the force charge command
+        Args:
+            force_charge_command: The force charge command to save
+        """
+        self._force_charge_command = replace(force_charge_command)
+        force_charge_command.save()
+        self.force_charge_channel.write(force_charge_command.to_json().encode())
+
+    def read_state(self) -> Tuple[str, str, datetime.datetime]:
+        """
+        Gets the optimiser's latest state for the server
+        Returns:
+            The state as a json string, an etag that changes with the state and the time it was last modified
+        """
+        return self._read(self.state_channel, self._file_comm.read_state)
+
+    def read_force_charge(self) -> Tuple[str, str, datetime.datetime]:
+        """
+        Gets the force charge command for the server
+        Returns:
+            The command as a json string, an etag that changes with the command and the time it was last modified
+        """
+        return self._read(self.force_charge_channel, self._file_comm.read_force_charge)
+
+    def request_force_charge(self, force_charge: bool) -> str:
+        """
+        Asks the optimiser to turn force charging on or off
+        Args:
+            force_charge: True to charge the car even if there is not enough solar
+
+        Returns:
+            The command as a json string as it will be once the optimiser applies the request
+        """
+        request_time = datetime.datetime.now()
+        self.force_charge_request_channel.write(json.dumps({
+            'force_charge': force_charge,
+            'request_time': request_time.timestamp()
+        }).encode())
+
+        # Also save the request, so it isn't lost if the optimiser isn't running or is restarting. An optimiser that
+        # starts after this loads the file and skips the requests already in the channel.
+        force_charge_command = ForceChargeCommand.from_json(self.read_force_charge()[0])
+        apply_force_charge_request(force_charge_command, force_charge, request_time)
+        force_charge_command.save()
+        return force_charge_command.to_json()
+
+    def _read(self, channel: SharedMemoryChannel, read_file) -> Tuple[str, str, datetime.datetime]:
+        """
+        Reads a channel, falling back to the file if nothing has been written to the channel yet
+        Args:
+            channel: The channel to read
+            read_file: Reads the file used before the channel is written
+
+        Returns:
+            The payload as a string, an etag that changes with the payload and the time it was written
+        """
+        sequence, write_time, payload = channel.read()
+        if payload is None:
+            return read_file()
+
+        # Only hash the payload once per version
+        cached = self._etags.get(channel.name)
+        if cached is None or cached[0] != sequence:
+            cached = (sequence, hashlib.blake2b(payload, digest_size=8).hexdigest())
+            self._etags[channel.name] = cached
+
+        content = payload.decode()
+        return content, cached[1], datetime.datetime.fromtimestamp(write_time, tz=datetime.timezone.utc)
@@ -0,0 +1,173 @@
+import datetime
+import time
+from typing import Dict, List, Tuple
+
+from optimiser.resilience import Deadline
+from optimiser.solar_charge_state import SolarChargeState
+
+
+class SimulatedClock:
+
+    def __init__(self, start: datetime.datetime):
+        """
+        A clock that only moves when told to, so historical data can be replayed faster than real time
+        Args:
+            start: The initial time
+        """
+        self.time = start
+
+    def now(self) -> datetime.datetime:
+        """ Returns the simulated current time """
+        return self.time
+
+    def set(self, new_time: datetime.datetime):
+        """ Moves the clock to a new time """
+        self.time = new_time
+
+
+class SimulatedTeslaAPI:
+
+    def __init__(
+            self,
+            clock: SimulatedClock,
+            charge_state: str = 'Stopped',
+            charge_current_request: int = 5,
+            vehicle_charge: float = 60,
+            charge_limit: float = 90,
+            port_open: bool = False,
+            voltage: int = 240,
+            pack_capacity: int = 75000,
+            latency: float = 0):
+        """
+        A stand in for TeslaAPI that models the car and the powerwall from replayed samples rather than the Tesla
+        servers. It satisfies the same interface so it can be given to the optimiser.
+        Args:
+            clock: The clock used to timestamp samples and commands
+            charge_state: The initial charging state of the car e.g. Stopped, Charging, Disconnected
+            charge_current_request: The initial number of amps set for charging power
+            vehicle_charge: The initial percentage of battery that is charged in the vehicle
+            charge_limit: The vehicle charge percentage where charging completes
+            port_open: The initial state of the charge port door
+            voltage: The voltage of the charger, used to convert amps to W
+            pack_capacity: The capacity of the vehicle battery in Wh
+            latency: The time in seconds each request takes, to simulate the network
+        """
+        self.clock = clock
+        self.charge_state = charge_state
+        self.charge_current_request = charge_current_request
+        self.vehicle_charge = vehicle_charge
+        self.charge_limit = charge_limit
+        self.port_open = port_open
+        self.voltage = voltage
+        self.pack_capacity = pack_capacity
+        self.latency = latency
+        self.base_load = 0
+        self.generation = 0
+        self.battery_charge = 100
+        self.commands: List[Tuple[datetime.datetime, str, Dict]] = []
+
+    @property
+    def car_power(self) -> float:
+        """ The power in W currently drawn by the car """
+        return self.charge_current_request * self.voltage if self.charge_state == 'Charging' else 0
+
+    def set_sample(self, base_load: float, generation: float, battery_charge: float):
+        """
+        Sets the household conditions reported by the simulated powerwall
+        Args:
+            base_load: The household load in W, not including the car
+            generation: The solar generation in W
+            battery_charge: The percentage of battery that is charged for the powerwall
+        """
+        self.base_load = base_load
+        self.generation = generation
+        self.battery_charge = battery_charge
+
+    def advance(self, seconds: float):
+        """
+        Charges the car for a period at the current charge rate
+        Args:
+            seconds: The length of the period
+        """
+        if self.charge_state != 'Charging':
+            return
+        self.vehicle_charge += self.car_power * seconds / 3600 / self.pack_capacity * 100
+        if self.vehicle_charge >= self.charge_limit:
+            self.vehicle_charge = self.charge_limit
+            self.charge_state = 'Complete'
+
+    def connect(self):
+        """ There is nothing to connect to """
+        pass
+
+    def send_command(self, command: str, deadline: Deadline = None, **kwargs):
+        """
+        Records a command and applies it to the simulated car
+        Args:
+            command: The command to send
+            deadline: Not used, the simulated car is always awake
+            **kwargs: Any additional parameters required with the command
+        """
+        self._wait()
+        self.commands.append((self.clock.now(), command, kwargs))
+
+        if command == 'START_CHARGE':
+            if self.charge_state in ('Disconnected', 'Complete'):
+                return f"Car can't start charging while {self.charge_state}", False
+            self.charge_state = 'Charging'
+        elif command == 'STOP_CHARGE':
+            if self.charge_state == 'Charging':
+                self.charge_state = 'Stopped'
+        elif command == 'CHARGING_AMPS':
+            self.charge_current_request = kwargs['charging_amps']
+        elif command == 'CHARGE_PORT_DOOR_OPEN':
+            self.port_open = True
+
+        return "Command Success", True
+
+    def update_car_charge_state(
+            self,
+            solar_charge_state: SolarChargeState,
+            deadline: Deadline = None) -> SolarChargeState:
+        """
+        Takes an existing SolarChargeState and updates it with the simulated car
+        Args:
+            solar_charge_state: The existing solar charge state to update
+            deadline: Not used, the simulated requests don't fail
+
+        Returns:
+            The updated SolarChargeState
+        """
+        self._wait()
+        solar_charge_state.charge_state = self.charge_state
+        solar_charge_state.charge_current_request = self.charge_current_request
+        solar_charge_state.vehicle_charge = self.vehicle_charge
+        solar_charge_state.port_open = self.port_open
+        return solar_charge_state
+
+    def update_battery_charge_state(
+            self,
+            solar_charge_state: SolarChargeState,
+            deadline: Deadline = None) -> SolarChargeState:
+        """
+        Takes an existing SolarChargeState and updates it with the simulated powerwall, the load includes the car
+        Args:
+            solar_charge_state: The existing solar charge state to update
+            deadline: Not used, the simulated requests don't fail
+
+        Returns:
+            The updated SolarChargeState
+        """
+        self._wait()
+        solar_charge_state.current_load = self.base_load + self.car_power
+        solar_charge_state.current_generation = self.generation
+        solar_charge_state.update_spare_capacity(
+            timestamp=self.clock.now().timestamp(),
+            value=solar_charge_state.spare_capacity)
+        solar_charge_state.battery_charge = self.battery_charge
+        return solar_charge_state
+
+    def _wait(self):
+        """ Simulates the network latency of a request """
+        if self.latency > 0:
+            time.sleep(self.latency)
@@ -0,0 +1,72 @@
+from typing import List
+
+from optimiser.vehicle import VehicleState
+
+
+def allocation_order(vehicle_states: List[VehicleState]) -> List[VehicleState]:
+    """
+    Orders the cars that can charge by who gets the spare capacity first: cars below their charge target, then the
+    highest priority, then the car furthest below its target
+    Args:
+        vehicle_states: The state of every car
+
+    Returns:
+        The cars that are plugged in, first to be given spare capacity first
+    """
+    return sorted(
+        (vehicle_state for vehicle_state in vehicle_states if vehicle_state.is_plugged_in),
+        key=lambda vehicle_state: (
+            not vehicle_state.is_below_target,
+            -vehicle_state.vehicle.priority,
+            vehicle_state.solar_charge_state.vehicle_charge - vehicle_state.vehicle.charge_target))
+
+
+def allocate_spare_capacity(
+        vehicle_states: List[VehicleState], spare_capacity: float, start_threshold: float = 0) -> List[float]:
+    """
+    Splits the household's spare capacity between the cars. The spare capacity already has the cars' current
+    charging taken out of it, so each car's share is the change in power it should make. A surplus goes to the first
+    cars in the allocation order until they reach their max amps, a deficit is taken from the last cars that are
+    charging first so the most important car keeps charging the longest. A stopped car is only given the surplus if
+    it would start with it, otherwise it is passed over so the cars after it still get their share.
+    Args:
+        vehicle_states: The state of every car
+        spare_capacity: The moving average of generation - load in W
+        start_threshold: The spare capacity in W a stopped car needs to start charging
+
+    Returns:
+        The spare capacity in W allocated to each car, in the same order as vehicle_states
+    """
+    order = allocation_order(vehicle_states)
+    shares = {id(vehicle_state): 0.0 for vehicle_state in vehicle_states}
+    charging = [vehicle_state for vehicle_state in order if vehicle_state.solar_charge_state.charge_state == 'Charging']
+
+    if spare_capacity >= 0:
+        remaining = spare_capacity
+        for vehicle_state in order:
+            state = vehicle_state.solar_charge_state
+            if state.charge_state != 'Charging':
+                if vehicle_state.can_start_on_solar and remaining > start_threshold:
+                    # A car that can start is given everything that is left so it can be compared with the threshold
+                    shares[id(vehicle_state)] += remaining
+                    remaining = 0
+                    break
+                continue
+            headroom = max(0.0, (state.max_amps - state.charge_current_request) / state.amps_per_kw * 1000)
+            share = min(headroom, remaining)
+            shares[id(vehicle_state)] += share
+            remaining -= share
+        if remaining > 0 and len(order) > 0:
+            # Nobody can use the rest, it goes to the first car that is charging so it isn't shown on a stopped car
+            shares[id((charging or order)[0])] += remaining
+    elif len(charging) > 0:
+        deficit = -spare_capacity
+        for vehicle_state in reversed(charging):
+            state = vehicle_state.solar_charge_state
+            share = min(state.charge_current_request / state.amps_per_kw * 1000, deficit)
+            shares[id(vehicle_state)] -= share
+            deficit -= share
+        if deficit > 0:
+            shares[id(charging[-1])] -= deficit
+
+    return [shares[id(vehicle_state)] for vehicle_state in vehicle_states]
@@ -1,48 +1,68 @@
-from collections import deque
 import datetime
-from typing import Dict
-
-
-class SolarChargeState:
-
-    def __init__(
-            self,
-            current_load: int = 0,
-            current_generation: int = 0,
-            charge_state: str = 'Disconnected',
-            charge_current_request: int = 0,
-            vehicle_charge: float = 0,
-            battery_charge: float = 0,
-            history_count: int = 30,
-            amps_per_kw: int = 5,
-            max_amps: int = 10,
-            time_format: str = '%Y-%m-%dT%H:%M:%S'):
-        """
-        The model for solar charge state that combines info from the vehicle and the powerwall
-        Args:
-            current_load: The current usage of power from the household in W
-            current_generation: The amount of power generated from solar in W
-            charge_state: The current charging state of the vehicle e.g. Disconnected, Charging ect.
-            charge_current_request: The number of amps set for charging power.
-            vehicle_charge: The percentage of battery that is charged in the vehicle
-            battery_charge: The percentage of battery that is charged for the powerwall
-            history_count: The number of time periods to retain for calculating the moving average
-            amps_per_kw: The factor to use to determine the current request for charging the vehicle
-            max_amps: The max amps the current charger can output
-            time_format: The format of the time for output
-        """
-        self.current_load = current_load
-        self.current_generation = current_generation
-        self.charge_state = charge_state
-        self.charge_current_request = charge_current_request
-        self.spare_capacity_history = deque()
-        self.port_open = False
-        self.vehicle_charge = vehicle_charge
-        self.battery_charge = battery_charge
-        self.history_count = history_count
-        self.amps_per_kw = amps_per_kw
-        self.max_amps = max_amps
-        self.time_format = time_format
+from dataclasses import dataclass, field
+from typing import ClassVar, Dict, List, Optional
+from optimiser.dataclass_codec import codec_field
+from optimiser.local_json_dataclass import LocalJsonDataclass
+from optimiser.rolling_statistics import RollingStatistics
+
+
+def _encode_spare_capacity_stats(spare_capacity_stats: RollingStatistics) -> List[List[float]]:
+    """ Saves the spare capacity history as [timestamp, value] pairs from oldest to newest """
+    return [[timestamp, value] for timestamp, value in spare_capacity_stats.items()]
+
+
+@dataclass(eq=False)
+class SolarChargeState(LocalJsonDataclass):
+    """
+    The model for solar charge state that combines info from the vehicle and the powerwall. Saving it keeps the spare
+    capacity history, which is replayed into the statistics when it is loaded.
+    Args:
+        current_load: The current usage of power from the household in W
+        current_generation: The amount of power generated from solar in W
+        charge_state: The current charging state of the vehicle e.g. Disconnected, Charging ect.
+        charge_current_request: The number of amps set for charging power.
+        vehicle_charge: The percentage of battery that is charged in the vehicle
+        battery_charge: The percentage of battery that is charged for the powerwall
+        history_count: The maximum number of time periods to retain for calculating the moving average
+        amps_per_kw: The factor to use to determine the current request for charging the vehicle
+        max_amps: The max amps the current charger can output
+        time_format: The format of the time for output
+        history_seconds: The maximum age in seconds of the time periods retained for the moving average, None to
+            only limit the history by history_count
+        ewma_seconds: The time constant in seconds of the exponentially weighted moving average of spare capacity
+        port_open: Whether the charge port of the vehicle is open
+        battery_stale: Set when the latest powerwall request failed and the values are the last ones that arrived
+        car_stale: Set when the latest vehicle request failed and the values are the last ones that arrived
+        spare_capacity_stats: The statistics of the spare capacity history, or the (timestamp, value) pairs to start
+            them with
+        file_path: The path to save the json datafile
+    """
+    current_load: int = 0
+    current_generation: int = 0
+    charge_state: str = 'Disconnected'
+    charge_current_request: int = 0
+    vehicle_charge: float = 0
+    battery_charge: float = 0
+    history_count: int = 30
+    amps_per_kw: int = 5
+    max_amps: int = 10
+    time_format: str = '%Y-%m-%dT%H:%M:%S'
+    history_seconds: Optional[int] = None
+    ewma_seconds: int = 300
+    port_open: bool = False
+    battery_stale: bool = False
+    car_stale: bool = False
+    spare_capacity_stats: RollingStatistics = field(
+        default=None, repr=False, metadata=codec_field(encoder=_encode_spare_capacity_stats))
+    file_path: ClassVar[str] = 'solar_charge_state.json'
+
+    def __post_init__(self):
+        if not isinstance(self.spare_capacity_stats, RollingStatistics):
+            history = self.spare_capacity_stats or ()
+            self.spare_capacity_stats = RollingStatistics(
+                max_samples=self.history_count, max_age=self.history_seconds, ewma_seconds=self.ewma_seconds)
+            for timestamp, value in history:
+                self.spare_capacity_stats.add(timestamp, value)
 
     def __str__(self) -> str:
         return f"{f'{self._now}'.ljust(15)} | " \
@@ -67,7 +87,9 @@ class SolarChargeState:
             'charge_current_request': self.charge_current_request,
             'vehicle_charge': self.vehicle_charge,
             'battery_charge': self.battery_charge,
-            'spare_capacity_history': list(self.spare_capacity_history)
+            'spare_capacity_history': self.spare_capacity_history,
+            'battery_stale': self.battery_stale,
+            'car_stale': self.car_stale
         }
 
     @property
@@ -82,24 +104,49 @@ class SolarChargeState:
                f"{self.vehicle_charge}," \
                f"{self.battery_charge}\n"
 
+    @property
+    def spare_capacity_history(self) -> List[Dict]:
+        """ The retained spare capacity values from oldest to newest """
+        return [{'timestamp': timestamp, 'value': value} for timestamp, value in self.spare_capacity_stats.items()]
+
     @property
     def avg_spare_capacity(self) -> float:
         """ The moving average of spare capacity i.e. generation - load """
-        if len(self.spare_capacity_history) > 0:
-            return sum(item['value'] for item in self.spare_capacity_history) / len(self.spare_capacity_history)
-        else:
-            return 0
+        return self.spare_capacity_stats.mean
+
+    @property
+    def ewma_spare_capacity(self) -> float:
+        """ The exponentially weighted moving average of spare capacity, weighted towards recent values """
+        return self.spare_capacity_stats.ewma
 
     @property
     def spare_capacity(self) -> int:
         """ The current spare capacity i.e. generation - load """
         return self.current_generation - self.current_load
 
+    @property
+    def charge_power(self) -> float:
+        """ The power in W the car is drawing, estimated from the charge current """
+        if self.charge_state != 'Charging':
+            return 0.0
+        return self.charge_current_request / self.amps_per_kw * 1000
+
     @property
     def possible_charge_current(self) -> int:
         """ Amount of current that can be used with the excess solar generation without consuming grid energy """
+        return self.charge_current_for(self.avg_spare_capacity)
+
+    def charge_current_for(self, spare_capacity: float) -> int:
+        """
+        The charge current that would use a spare capacity on top of the current charging
+        Args:
+            spare_capacity: The spare capacity in W, negative if the car should use less power
+
+        Returns:
+            The charge current in amps, limited to the max amps
+        """
         return min(
-            int(self.charge_current_request + (self.avg_spare_capacity / 1000 * self.amps_per_kw)),
+            int(self.charge_current_request + (spare_capacity / 1000 * self.amps_per_kw)),
             self.max_amps)
 
     @property
@@ -119,7 +166,5 @@ class SolarChargeState:
             timestamp: The timestamp of when the value occurred
             value: The value to add to the series
         """
-        self.spare_capacity_history.append({'timestamp': timestamp, 'value': value})
-        if len(self.spare_capacity_history) > self.history_count:
-            self.spare_capacity_history.popleft()
+        self.spare_capacity_stats.add(timestamp, value)
 
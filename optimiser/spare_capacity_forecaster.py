@@ -0,0 +1,199 @@
+import datetime
+from collections import deque
+from typing import Any, Deque, Optional, Tuple
+import numpy as np
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class SpareCapacityForecaster:
+
+    def __init__(
+            self,
+            sample_store: Any = None,
+            horizon: float = 60,
+            level_seconds: float = 60,
+            trend_seconds: float = 1200,
+            trend_damping: float = 0.25,
+            profile_days: int = 14,
+            profile_bucket_seconds: int = 900,
+            profile_weight: float = 0.5,
+            profile_refresh_seconds: float = 3600,
+            noise_factor: float = 1.5):
+        """
+        Predicts the spare capacity a few minutes ahead so the charge current can be set before the solar
+        generation gets there rather than after a trailing average catches up. The forecast is made for the power
+        available to the car, i.e. generation - load with the car's own charging added back, so the steps caused by
+        changing the charge current don't look like changes in the weather. It combines:
+            level: the mean of the last level_seconds
+            trend: the damped slope of a line fitted to the last trend_seconds
+            profile: the change the stored history shows at this time of day over the horizon
+        Args:
+            sample_store: Any store with a read(start, end) method returning samples with timestamp and generation
+                columns, None to forecast from the recent trend only
+            horizon: The time in seconds ahead to forecast
+            level_seconds: The time in seconds averaged for the current level
+            trend_seconds: The time in seconds the trend is fitted over
+            trend_damping: The fraction of the trend that is expected to continue over the horizon
+            profile_days: The number of days of history used for the time of day profile
+            profile_bucket_seconds: The length in seconds of each time of day bucket in the profile
+            profile_weight: The weight of the profile change against the trend change, 0 to 1
+            profile_refresh_seconds: The time in seconds between rebuilding the profile from the history
+            noise_factor: The number of standard deviations of recent noise the forecast must clear before the charge
+                current is increased
+        """
+        self.sample_store = sample_store
+        self.horizon = horizon
+        self.level_seconds = level_seconds
+        self.trend_seconds = trend_seconds
+        self.trend_damping = trend_damping
+        self.profile_days = profile_days
+        self.profile_bucket_seconds = profile_bucket_seconds
+        self.profile_weight = profile_weight
+        self.profile_refresh_seconds = profile_refresh_seconds
+        self.noise_factor = noise_factor
+        self._recent: Deque[Tuple[float, float]] = deque()
+        self._profile: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._profile_time: Optional[float] = None
+
+    def observe(self, timestamp: float, spare_capacity: float, charge_power: float):
+        """
+        Adds the latest sample to the recent history
+        Args:
+            timestamp: The unix timestamp of the sample
+            spare_capacity: The spare capacity in W i.e. generation - load
+            charge_power: The power in W the cars are drawing, it is included in the load
+        """
+        self._recent.append((timestamp, spare_capacity + charge_power))
+        while self._recent[0][0] < timestamp - max(self.level_seconds, self.trend_seconds):
+            self._recent.popleft()
+
+    def forecast_spare_capacity(self, timestamp: float, charge_power: float) -> Optional[float]:
+        """
+        Forecasts the spare capacity at the horizon if the charging is left as it is
+        Args:
+            timestamp: The unix timestamp to forecast from
+            charge_power: The power in W the cars are drawing
+
+        Returns:
+            The forecast spare capacity in W, None if there isn't enough recent history
+        """
+        forecast = self._forecast(timestamp)
+        if forecast is None:
+            return None
+        available, _ = forecast
+        return available - charge_power
+
+    def planned_spare_capacity(self, timestamp: float, charge_power: float) -> Optional[float]:
+        """
+        The spare capacity to set the charge current from. The charging is only increased when the forecast less
+        the recent noise still has room for it and only decreased when the forecast is short, in between the charge
+        current is held so noise around a threshold doesn't change it back and forth.
+        Args:
+            timestamp: The unix timestamp to forecast from
+            charge_power: The power in W the cars are drawing
+
+        Returns:
+            The spare capacity in W, 0 to hold the charge current, None if there isn't enough recent history
+        """
+        forecast = self._forecast(timestamp)
+        if forecast is None:
+            return None
+        available, noise = forecast
+        spare_capacity = available - charge_power
+        if spare_capacity - self.noise_factor * noise > 0:
+            return spare_capacity - self.noise_factor * noise
+        if spare_capacity < 0:
+            return spare_capacity
+        return 0.0
+
+    def _forecast(self, timestamp: float) -> Optional[Tuple[float, float]]:
+        """
+        Forecasts the power available to the cars at the horizon
+        Args:
+            timestamp: The unix timestamp to forecast from
+
+        Returns:
+            The forecast power in W and the standard deviation in W of the recent samples around their trend, None if
+            there isn't enough recent history
+        """
+        if len(self._recent) < 3:
+            return None
+
+        times, values = np.array(self._recent).T
+        is_level = times >= timestamp - self.level_seconds
+        level = values[is_level].mean()
+        level_time = times[is_level].mean()
+
+        # The level is the average over a window so it is centred before now, the trend covers the gap too
+        is_trend = times >= timestamp - self.trend_seconds
+        slope = 0.0
+        noise = values[is_trend].std()
+        if np.ptp(times[is_trend]) > 0:
+            slope, intercept = np.polyfit(times[is_trend] - timestamp, values[is_trend], 1)
+            noise = (values[is_trend] - (slope * (times[is_trend] - timestamp) + intercept)).std()
+        trend_change = slope * (timestamp - level_time + self.horizon * self.trend_damping)
+
+        profile_change = self._profile_change(timestamp)
+        if profile_change is None:
+            return level + trend_change, noise
+        return level + (1 - self.profile_weight) * trend_change + self.profile_weight * profile_change, noise
+
+    def _profile_change(self, timestamp: float) -> Optional[float]:
+        """
+        The change in available power over the horizon shown by the time of day profile
+        Args:
+            timestamp: The unix timestamp to forecast from
+
+        Returns:
+            The change in W, None if there is no profile
+        """
+        if self.sample_store is None:
+            return None
+        if self._profile_time is None or timestamp - self._profile_time > self.profile_refresh_seconds:
+            self._profile = self._build_profile(timestamp)
+            self._profile_time = timestamp
+        if self._profile is None:
+            return None
+        return self._profile_value(timestamp + self.horizon) - self._profile_value(timestamp)
+
+    def _build_profile(self, timestamp: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Averages the stored generation for each time of day bucket
+        Args:
+            timestamp: The unix timestamp of now, the profile is built from the days before it
+
+        Returns:
+            The centres in seconds since midnight of the buckets with samples and their mean generation in W, None if
+            there are too few samples to profile
+        """
+        samples = self.sample_store.read(timestamp - self.profile_days * SECONDS_PER_DAY, timestamp)
+        bucket_count = SECONDS_PER_DAY // self.profile_bucket_seconds
+        buckets = (self._seconds_of_day(samples['timestamp']) // self.profile_bucket_seconds).astype(np.int64)
+        counts = np.bincount(buckets, minlength=bucket_count)
+        has_samples = counts > 0
+        if np.count_nonzero(has_samples) < 2:
+            return None
+
+        # The profile only needs the shape of the day so the generation is used, the load is too random to profile
+        means = np.bincount(buckets, weights=samples['generation'], minlength=bucket_count)[has_samples]
+        centres = (np.flatnonzero(has_samples) + 0.5) * self.profile_bucket_seconds
+        return centres, means / counts[has_samples]
+
+    def _profile_value(self, timestamp: float) -> float:
+        """ The profile at a time of day, interpolated between the buckets with samples """
+        centres, means = self._profile
+        return float(np.interp(self._seconds_of_day(np.array([timestamp]))[0], centres, means, period=SECONDS_PER_DAY))
+
+    @staticmethod
+    def _seconds_of_day(timestamps: np.ndarray) -> np.ndarray:
+        """
+        The seconds since local midnight of unix timestamps, with the UTC offset in force at each timestamp so the days
+        before a daylight saving change line up with the days after it. Clocks change on a quarter hour, so the offset
+        is looked up once for each quarter hour the timestamps are in.
+        """
+        quarters, inverse = np.unique(np.floor_divide(timestamps, 900), return_inverse=True)
+        offsets = np.array([
+            datetime.datetime.fromtimestamp(quarter * 900).astimezone().utcoffset().total_seconds()
+            for quarter in quarters])
+        return (timestamps + offsets[inverse]) % SECONDS_PER_DAY
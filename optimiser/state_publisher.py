@@ -0,0 +1,100 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, Optional, Sequence
+
+
+class StatePublisher:
+
+    def __init__(
+            self,
+            comm: Any,
+            min_interval: float = 30,
+            heartbeat_interval: float = 300,
+            ignored_keys: Sequence[str] = ('last_updated', 'spare_capacity_history')):
+        """
+        Publishes the optimiser's state only when it changes, so an idle system doesn't rewrite the same state every
+        tick. Changes are coalesced so the state is published at most once every min_interval, and an unchanged state
+        is published again every heartbeat_interval so readers can tell the optimiser is still running. The ignored keys
+        are still published, they just don't count as a change. The spare capacity history gains a sample every tick
+        and its latest value is the spare capacity, so it is ignored by default.
+        Args:
+            comm: Any comm object with a publish_state(payload) method
+            min_interval: The minimum time in seconds between publishing changes, longer than the shortest poll
+                interval so changes on consecutive ticks are coalesced
+            heartbeat_interval: The time in seconds after which an unchanged state is published again
+            ignored_keys: Keys that change every tick without the state changing, e.g. the time it was updated
+        """
+        self.comm = comm
+        self.min_interval = min_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.ignored_keys = ignored_keys
+        self._published_digest: Optional[bytes] = None
+        self._last_publish: Optional[float] = None
+        self._pending: Optional[Dict] = None
+        self.publish_count = 0
+        self.skip_count = 0
+
+    def publish(self, state: Dict) -> bool:
+        """
+        Publishes a state if it has changed since the last one published and the write rate allows it
+        Args:
+            state: The state as a json serialisable dict
+
+        Returns:
+            True if the state was published
+        """
+        body = json.dumps({key: value for key, value in state.items() if key not in self.ignored_keys})
+        digest = hashlib.blake2b(body.encode(), digest_size=16).digest()
+
+        now = time.monotonic()
+        since_publish = None if self._last_publish is None else now - self._last_publish
+        changed = digest != self._published_digest
+        if since_publish is not None and (
+                (changed and since_publish < self.min_interval)
+                or (not changed and since_publish < self.heartbeat_interval)):
+            # Keep the latest change so it is published on the next call after the interval
+            self._pending = state if changed else None
+            self.skip_count += 1
+            return False
+
+        self.comm.publish_state(self._payload(state, body))
+        self._published_digest = digest
+        self._last_publish = now
+        self._pending = None
+        self.publish_count += 1
+        return True
+
+    @property
+    def flush_delay(self) -> Optional[float]:
+        """ The time in seconds until a change held back by the minimum interval can be published, None if none is """
+        if self._pending is None:
+            return None
+        return max(0.0, self._last_publish + self.min_interval - time.monotonic())
+
+    def flush(self) -> bool:
+        """
+        Publishes a change that is being held back by the minimum interval, once the interval has passed
+        Returns:
+            True if the change was published
+        """
+        if self._pending is None or self.flush_delay > 0:
+            return False
+        return self.publish(self._pending)
+
+    def _payload(self, state: Dict, body: str) -> str:
+        """
+        Adds the ignored keys back to the serialised state, so the bulk of the state is only serialised once
+        Args:
+            state: The state
+            body: The state without the ignored keys serialised as a json object
+
+        Returns:
+            The whole state as a json string
+        """
+        ignored = json.dumps({key: state[key] for key in self.ignored_keys if key in state})
+        if ignored == '{}':
+            return body
+        if body == '{}':
+            return ignored
+        return f"{ignored[:-1]}, {body[1:]}"
@@ -0,0 +1,89 @@
+import datetime
+import json
+import threading
+import time
+from typing import Callable, Iterator, Optional, Tuple
+
+
+class StateStream:
+
+    def __init__(
+            self,
+            read_state: Callable[[], Tuple[str, str, datetime.datetime]],
+            history_key: str = 'spare_capacity_history'):
+        """
+        Turns changes to a json state into server sent events. The first event sent to a client has the whole
+        state, after that each event only has the history entries added since the previous version. The events for
+        each version are built once and shared by every client.
+        Args:
+            read_state: Returns the state as a json string, an etag that changes with the state and the time it was
+                last modified, e.g. CachedFile.read
+            history_key: The key of the list of {timestamp, value} entries that is sent as a delta
+        """
+        self.read_state = read_state
+        self.history_key = history_key
+        self._lock = threading.Lock()
+        self._etag: Optional[str] = None
+        self._previous_etag: Optional[str] = None
+        self._state_event: Optional[str] = None
+        self._update_event: Optional[str] = None
+        self._last_history_timestamp: Optional[float] = None
+
+    def events(self, poll_interval: float = 0.5, keep_alive_interval: float = 15) -> Iterator[str]:
+        """
+        Yields server sent events for a client until it disconnects
+        Args:
+            poll_interval: The time in seconds between checks for a new state
+            keep_alive_interval: The time in seconds without a state change before a comment is sent to keep the
+                connection open
+
+        Returns:
+            The text of each event
+        """
+        sent_etag = None
+        last_sent = time.monotonic()
+        while True:
+            etag, previous_etag, state_event, update_event = self._current()
+            if etag != sent_etag:
+                # Send only the changes if the client has the previous version, otherwise send the whole state
+                yield update_event if previous_etag == sent_etag and sent_etag is not None else state_event
+                sent_etag = etag
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > keep_alive_interval:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(poll_interval)
+
+    def _current(self) -> Tuple[str, Optional[str], str, str]:
+        """
+        Builds the events for the current version of the state if it has changed
+        Returns:
+            The etag of the current version, the etag of the version before it, the whole state event and the update
+            event
+        """
+        content, etag, _ = self.read_state()
+        with self._lock:
+            if etag != self._etag:
+                state = json.loads(content)
+                history = state.get(self.history_key) or []
+                added = [
+                    item for item in history
+                    if self._last_history_timestamp is None or item['timestamp'] > self._last_history_timestamp]
+
+                update = dict(state)
+                update[self.history_key] = added
+                # Lets the client drop the entries that have left the history window
+                update['history_start'] = history[0]['timestamp'] if len(history) > 0 else None
+
+                self._previous_etag = self._etag
+                self._etag = etag
+                self._state_event = self._format_event('state', state)
+                self._update_event = self._format_event('update', update)
+                if len(history) > 0:
+                    self._last_history_timestamp = history[-1]['timestamp']
+            return self._etag, self._previous_etag, self._state_event, self._update_event
+
+    @staticmethod
+    def _format_event(name: str, data: dict) -> str:
+        """ Formats a server sent event with compact json data """
+        return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
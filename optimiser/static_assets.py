@@ -0,0 +1,122 @@
+import gzip
+import mimetypes
+import re
+from pathlib import Path
+from typing import Optional, Tuple
+from flask import Request, Response, send_file
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is used if it isn't installed
+    brotli = None
+
+# The file types worth compressing, images and fonts are already compressed
+COMPRESSIBLE_SUFFIXES = ('.html', '.js', '.css', '.json', '.map', '.svg', '.txt', '.ico')
+# Bundles built by the web app have a content hash in their name, e.g. main.3f2a9c1e.js
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+
+
+class StaticAssets:
+
+    def __init__(self, build_directory: str, index: str = 'index.html', min_size: int = 512):
+        """
+        Serves the built web app, using a precompressed brotli or gzip copy of each file when the client accepts it.
+        Bundles with a content hash in their name never change so they are cached by clients for a year, every other
+        file must be revalidated with the server before it is used.
+        Args:
+            build_directory: The directory of the built web app
+            index: The page served for any path that isn't a file, so the web app can handle its own routes
+            min_size: Files smaller than this in bytes are not compressed
+        """
+        self.build_directory = Path(build_directory).resolve()
+        self.index = index
+        self.min_size = min_size
+
+    def precompress(self) -> int:
+        """
+        Writes a .gz copy, and a .br copy if brotli is installed, of every compressible file that doesn't have an up
+        to date copy
+        Returns:
+            The number of copies written
+        """
+        written = 0
+        if not self.build_directory.exists():
+            return written
+
+        encoders = [('.gz', lambda data: gzip.compress(data, compresslevel=9))]
+        if brotli is not None:
+            encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+
+        for path in self.build_directory.rglob('*'):
+            if not path.is_file() or path.suffix not in COMPRESSIBLE_SUFFIXES:
+                continue
+            stat = path.stat()
+            if stat.st_size < self.min_size:
+                continue
+            for suffix, compress in encoders:
+                compressed_path = path.with_name(path.name + suffix)
+                if compressed_path.exists() and compressed_path.stat().st_mtime >= stat.st_mtime:
+                    continue
+                compressed_path.write_bytes(compress(path.read_bytes()))
+                written += 1
+        return written
+
+    def response(self, path: str, request: Request) -> Response:
+        """
+        Creates the response for a path in the web app
+        Args:
+            path: The requested path relative to the build directory
+            request: The request, used for the accepted encodings and conditional headers
+
+        Returns:
+            The response
+        """
+        file_path = self._resolve(path)
+        if file_path is None:
+            file_path = self._resolve(self.index)
+            if file_path is None:
+                raise NotFound()
+
+        # Hashed bundles never change, every other file must be revalidated before it is used
+        relative_path = file_path.relative_to(self.build_directory).as_posix()
+        immutable = relative_path.startswith('static/') and HASHED_NAME.search(file_path.name) is not None
+
+        served_path, encoding = self._choose_encoding(file_path, request)
+        mimetype = mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
+        response = send_file(
+            served_path, mimetype=mimetype, conditional=True, etag=True,
+            max_age=365 * 24 * 60 * 60 if immutable else None)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        if immutable:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    def _resolve(self, path: str) -> Optional[Path]:
+        """ The file for a requested path, or None if it isn't a file inside the build directory """
+        file_path = (self.build_directory / path).resolve()
+        if self.build_directory not in file_path.parents or not file_path.is_file():
+            return None
+        return file_path
+
+    @staticmethod
+    def _choose_encoding(file_path: Path, request: Request) -> Tuple[Path, Optional[str]]:
+        """
+        Chooses the smallest copy of a file that the client accepts
+        Args:
+            file_path: The uncompressed file
+            request: The request with the accepted encodings
+
+        Returns:
+            The path of the copy to send and its content encoding, None if it isn't compressed
+        """
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in request.accept_encodings:
+                compressed_path = file_path.with_name(file_path.name + suffix)
+                if compressed_path.is_file():
+                    return compressed_path, encoding
+        return file_path, None
@@ -1,34 +1,108 @@
 import atexit
 import datetime
-from requests.exceptions import ReadTimeout, ConnectionError
+import threading
+import time
+from typing import Callable, Dict, Optional
+from requests.exceptions import ReadTimeout, ConnectionError, RequestException
 import teslapy
 
+from optimiser.metrics import MetricsRegistry
+from optimiser.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, Deadline, RetryPolicy
 from optimiser.solar_charge_state import SolarChargeState
 
 
 class TeslaAPI:
 
-    def __init__(self, username: str, car_index: int = 0, battery_index: int = 0):
+    def __init__(
+            self,
+            username: str,
+            car_index: int = 0,
+            battery_index: int = 0,
+            persistent_session: bool = True,
+            handle_ttl: int = 3600,
+            metrics: MetricsRegistry = None,
+            retry_policy: RetryPolicy = None,
+            breaker_failures: int = 3,
+            breaker_reset_seconds: float = 60,
+            wake_up_timeout: float = 60):
         """
         A wrapper for the Tesla API
         Args:
             username: The username to use to log in to Tesla
             car_index: The index in the list of vehicles output from the tesla api watched by this object
             battery_index: The index in the list of batteries output from the tesla api watched by this object
+            persistent_session: If True keeps one authenticated session alive and caches the vehicle and battery
+                handles, otherwise a new session is created and the handles are fetched on every request
+            handle_ttl: The time in seconds a cached vehicle or battery handle is reused before being fetched again
+            metrics: The registry to record request latencies, retries, errors and wake ups in
+            retry_policy: Decides how often and how long after a failed request it is retried, 3 attempts with jittered
+                exponential backoff if None
+            breaker_failures: The number of failed requests in a row to an endpoint that stops it being called
+            breaker_reset_seconds: The time in seconds an endpoint isn't called for once its breaker has opened
+            wake_up_timeout: The longest time in seconds to wait for the car to wake up
         """
-        self.request_attempts = 2
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self.wake_up_timeout = wake_up_timeout
         self.username = username
         self.car_index = car_index
         self.battery_index = battery_index
+        self.persistent_session = persistent_session
+        self.handle_ttl = handle_ttl
         self.tesla = None
+        self._session_expired = False
+        self._vehicles = None
+        self._vehicles_fetch_time = None
+        self._battery = None
+        self._battery_fetch_time = None
+        self._connect_lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._request_seconds = self.metrics.histogram(
+            'tesla_api_request_seconds', 'Time taken by each API operation including retries and wake ups',
+            ['operation'])
+        self._retries = self.metrics.counter(
+            'tesla_api_retries_total', 'API requests retried after an error', ['operation'])
+        self._errors = self.metrics.counter(
+            'tesla_api_errors_total', 'API errors by status code or exception', ['operation', 'error'])
+        self._sessions = self.metrics.counter('tesla_api_sessions_total', 'API sessions created')
+        self._wake_ups = self.metrics.counter('tesla_vehicle_wake_ups_total', 'Times the car was woken up')
+        self._wake_up_seconds = self.metrics.histogram(
+            'tesla_vehicle_wake_up_seconds', 'Time taken for the car to wake up')
+        self._circuit_state = self.metrics.gauge(
+            'tesla_api_circuit_state', 'The circuit breaker of each endpoint, 0 closed, 1 half open, 2 open',
+            ['endpoint'])
+        self._circuit_opens = self.metrics.counter(
+            'tesla_api_circuit_opens_total', 'Times an endpoint stopped being called after failing', ['endpoint'])
+        self._circuit_rejections = self.metrics.counter(
+            'tesla_api_circuit_rejections_total', 'Requests not made because the endpoint\'s breaker was open',
+            ['endpoint'])
 
     def connect(self):
         """ Connects to the API """
 
+        # The car and battery can be polled from different threads so only one of them should create the session
+        with self._connect_lock:
+            self._connect()
+
+    def _connect(self):
+        """ Creates the session and authenticates it if required """
+
+        if self.persistent_session and self.tesla is not None and not self._session_expired:
+            return
+
         register = True if self.tesla is None else False
+        if self.tesla is not None:
+            self.tesla.close()  # Release the expired session's pooled connections
         self.tesla = teslapy.Tesla(self.username)
+        self._sessions.inc()
+        self._session_expired = False
+        self._clear_handles()
         if register:  # Make sure to close the connection on exit
-            atexit.register(self.tesla.close)
+            atexit.register(self.close)
 
         # This will open the url to authenticate. The url from the page not found wilkl need to be copied
         # into this input to be able to extract the token
@@ -37,43 +111,78 @@ class TeslaAPI:
             print('Open this URL: ' + self.tesla.authorization_url())
             self.tesla.fetch_token(authorization_response=input('Enter URL after authentication: '))
 
-    def send_command(self, command: str, **kwargs):
+    def close(self):
+        """ Closes the current session """
+        if self.tesla is not None:
+            self.tesla.close()
+
+    def send_command(self, command: str, car_index: int = None, deadline: Deadline = None, **kwargs):
         """
-        Sends a command to the tesla api
+        Sends a command to the tesla api, commands are not retried as the car may have acted on a failed one
         Args:
             command: The command to send
+            car_index: The index of the car to send the command to, defaults to the car_index of this object
+            deadline: The time any wake up has to finish by
             **kwargs: Any additional parameters required with the command
         """
-
-        try:
-            self.connect()
-            self.tesla.vehicle_list()[self.car_index].sync_wake_up()
-            self.tesla.vehicle_list()[self.car_index].command(command, **kwargs)
+        breaker = self._breaker('send_command', car_index)
+        with self._request_seconds.time(operation='send_command'):
+            try:
+                self._before_call(breaker)
+            except CircuitOpenError as e:
+                return f"{e}", False
+            try:
+                self.connect()
+                vehicle = self._get_vehicle(car_index)
+                self._wake_up(vehicle, deadline)
+                vehicle.command(command, **kwargs)
+            except (RequestException, teslapy.VehicleError) as e:
+                # Includes HTTP errors, timeouts and lost connections, the tick carries on without the command
+                breaker.record_failure()
+                self._record_error('send_command', e)
+                self._handle_vehicle_error(e, car_index)
+                return f"{e}", False
+            except BaseException:
+                # Still counted so a half open breaker's trial call ends and the breaker can't get stuck
+                breaker.record_failure()
+                raise
+            breaker.record_success()
             return "Command Success", True
-        except (teslapy.HTTPError, teslapy.VehicleError) as e:
-            return f"{e}", False
 
-    def update_car_charge_state(self, solar_charge_state: SolarChargeState) -> SolarChargeState:
+    def update_car_charge_state(
+            self,
+            solar_charge_state: SolarChargeState,
+            car_index: int = None,
+            deadline: Deadline = None) -> SolarChargeState:
         """
         Takes an existing SolarChargeState and updates it with new information from the car
         Args:
             solar_charge_state: The existing solar charge state to update
+            car_index: The index of the car to read, defaults to the car_index of this object
+            deadline: The time the request, its retries and any wake up have to finish by
 
         Returns:
             The updated SolarChargeState
+
+        Raises:
+            CircuitOpenError: If the car has failed too often recently to be asked again yet
+            ConnectionError: If every attempt failed
         """
-        request_attempts = self.request_attempts
-        car_data = None
+        def request():
+            self.connect()
+            vehicle = self._get_vehicle(car_index)
+            self._wake_up(vehicle, deadline)
+            return vehicle.get_vehicle_data()
 
-        while car_data is None:
-            try:
-                self.connect()
-                self.tesla.vehicle_list()[self.car_index].sync_wake_up()
-                car_data = self.tesla.vehicle_list()[self.car_index].get_vehicle_data()
-            except (teslapy.HTTPError, ReadTimeout, ConnectionError, teslapy.VehicleError) as e:
-                request_attempts -= 1
-                if request_attempts == 0:
-                    raise ConnectionError(f"Could not connect to car: {e}")
+        with self._request_seconds.time(operation='update_car'):
+            car_data = self._call(
+                operation='update_car',
+                request=request,
+                retry_on=(teslapy.HTTPError, ReadTimeout, ConnectionError, teslapy.VehicleError),
+                handle_error=lambda e: self._handle_vehicle_error(e, car_index),
+                deadline=deadline,
+                car_index=car_index,
+                failure_message="Could not connect to car")
 
         solar_charge_state.charge_state = car_data['charge_state']['charging_state']
         solar_charge_state.charge_current_request = car_data['charge_state']['charge_current_request']
@@ -82,25 +191,35 @@ class TeslaAPI:
 
         return solar_charge_state
 
-    def update_battery_charge_state(self, solar_charge_state: SolarChargeState) -> SolarChargeState:
+    def update_battery_charge_state(
+            self,
+            solar_charge_state: SolarChargeState,
+            deadline: Deadline = None) -> SolarChargeState:
         """
         Takes an existing SolarChargeState and updates it with new information from the battery
         Args:
             solar_charge_state: The existing solar charge state to update
+            deadline: The time the request and its retries have to finish by
 
         Returns:
             The updated SolarChargeState
+
+        Raises:
+            CircuitOpenError: If the battery has failed too often recently to be asked again yet
+            ConnectionError: If every attempt failed
         """
-        request_attempts = self.request_attempts
-        battery_data = None
+        def request():
+            self.connect()
+            return self._get_battery().get_battery_data()
 
-        while battery_data is None:
-            try:
-                battery_data = self.tesla.battery_list()[self.battery_index].get_battery_data()
-            except (teslapy.HTTPError, ReadTimeout, ConnectionError) as e:
-                request_attempts -= 1
-                if request_attempts == 0:
-                    raise ConnectionError(f"Could not connect to battery: {e}")
+        with self._request_seconds.time(operation='update_battery'):
+            battery_data = self._call(
+                operation='update_battery',
+                request=request,
+                retry_on=(teslapy.HTTPError, ReadTimeout, ConnectionError),
+                handle_error=self._handle_http_error,
+                deadline=deadline,
+                failure_message="Could not connect to battery")
 
         power_data = battery_data.get('power_reading')[0]
 
@@ -113,3 +232,181 @@ class TeslaAPI:
         solar_charge_state.battery_charge = battery_perc
 
         return solar_charge_state
+
+    def _call(
+            self,
+            operation: str,
+            request: Callable,
+            retry_on: tuple,
+            handle_error: Callable[[Exception], None],
+            deadline: Optional[Deadline],
+            failure_message: str,
+            car_index: int = None):
+        """
+        Makes a request through its endpoint's circuit breaker, retrying it with backoff until it succeeds or the
+        attempts or the deadline run out. The whole call counts as one success or failure for the breaker.
+        Args:
+            operation: The name of the operation, used for the breaker and metrics
+            request: Makes the request and returns its data
+            retry_on: The errors that are worth retrying
+            handle_error: Resets any cached state the error shows is wrong
+            deadline: No retry is started that would wait past the deadline
+            failure_message: The start of the message of the error raised when every attempt fails
+            car_index: The index of the car the request is for
+
+        Returns:
+            The data returned by the request
+
+        Raises:
+            CircuitOpenError: If the endpoint's breaker is open
+            ConnectionError: If every attempt failed
+        """
+        def on_error(error: Exception):
+            self._record_error(operation, error)
+            handle_error(error)
+
+        breaker = self._breaker(operation, car_index)
+        self._before_call(breaker)
+        try:
+            data = self.retry_policy.call(
+                request,
+                retry_on=retry_on,
+                deadline=deadline,
+                on_error=on_error,
+                on_retry=lambda: self._retries.inc(operation=operation))
+        except retry_on as e:
+            breaker.record_failure()
+            raise ConnectionError(f"{failure_message}: {e}")
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return data
+
+    def _breaker(self, operation: str, car_index: int = None) -> CircuitBreaker:
+        """
+        Returns the circuit breaker of an endpoint, creating it on first use
+        Args:
+            operation: The name of the operation
+            car_index: The index of the car for car operations, each car has its own breakers
+        """
+        if operation != 'update_battery' and car_index is not None and car_index != self.car_index:
+            endpoint = f"{operation}[{car_index}]"
+        else:
+            endpoint = operation
+        with self._breakers_lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(
+                    endpoint,
+                    failure_threshold=self.breaker_failures,
+                    reset_timeout=self.breaker_reset_seconds,
+                    on_state_change=self._record_circuit_state)
+                self._circuit_state.set(0, endpoint=endpoint)
+            return self._breakers[endpoint]
+
+    def _before_call(self, breaker: CircuitBreaker):
+        """ Checks the breaker lets a request through, counting it if it doesn't """
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            self._circuit_rejections.inc(endpoint=breaker.name)
+            raise
+
+    def _record_circuit_state(self, breaker: CircuitBreaker):
+        """ Records the state of a circuit breaker when it changes """
+        self._circuit_state.set({CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[breaker.state], endpoint=breaker.name)
+        if breaker.state == OPEN:
+            self._circuit_opens.inc(endpoint=breaker.name)
+
+    def _wake_up(self, vehicle: teslapy.Vehicle, deadline: Deadline = None):
+        """
+        Wakes the car up if it is asleep, recording how often and how long it takes
+        Args:
+            vehicle: The vehicle handle
+            deadline: The time the car has to be awake by, the wake up times out at the wake_up_timeout otherwise
+        """
+        if vehicle.available():  # Uses the cached online state for up to a minute
+            return
+        self._wake_ups.inc()
+        with self._wake_up_seconds.time():
+            vehicle.sync_wake_up(
+                timeout=deadline.limit(self.wake_up_timeout) if deadline is not None else self.wake_up_timeout)
+
+    def _record_error(self, operation: str, error: Exception):
+        """
+        Counts a failed request by its status code, or the exception type if there was no response
+        Args:
+            operation: The operation that failed
+            error: The error raised by the request
+        """
+        response = getattr(error, 'response', None)
+        name = str(response.status_code) if response is not None else type(error).__name__
+        self._errors.inc(operation=operation, error=name)
+
+    def _get_vehicle(self, car_index: int = None) -> teslapy.Vehicle:
+        """
+        Returns a vehicle handle, only fetching the vehicle list if the cached handles are missing or expired
+        Args:
+            car_index: The index of the car, defaults to the car_index of this object
+        """
+        if not self._is_handle_valid(self._vehicles, self._vehicles_fetch_time):
+            self._vehicles = self.tesla.vehicle_list()
+            self._vehicles_fetch_time = time.monotonic()
+        return self._vehicles[self.car_index if car_index is None else car_index]
+
+    def _get_battery(self) -> teslapy.Battery:
+        """ Returns the battery handle, only fetching the product list if the cached handle is missing or expired """
+        if not self._is_handle_valid(self._battery, self._battery_fetch_time):
+            self._battery = self.tesla.battery_list()[self.battery_index]
+            self._battery_fetch_time = time.monotonic()
+        return self._battery
+
+    def _is_handle_valid(self, handle: object, fetch_time: float) -> bool:
+        """
+        Checks if a cached product handle can be reused
+        Args:
+            handle: The cached vehicle or battery handle
+            fetch_time: The monotonic time the handle was fetched
+
+        Returns:
+            True if the handle can be used without fetching it again
+        """
+        return (
+                self.persistent_session
+                and handle is not None
+                and time.monotonic() - fetch_time < self.handle_ttl
+        )
+
+    def _clear_handles(self):
+        """ Forgets the cached vehicle and battery handles so they are fetched on the next request """
+        self._vehicles = None
+        self._vehicles_fetch_time = None
+        self._battery = None
+        self._battery_fetch_time = None
+
+    def _handle_vehicle_error(self, error: Exception, car_index: int = None):
+        """
+        Resets any cached vehicle state that could be wrong after a failed vehicle request
+        Args:
+            error: The error raised by the request
+            car_index: The index of the car the request was for, defaults to the car_index of this object
+        """
+        # The cached online/asleep state may be out of date so force a refresh on the next wake up
+        car_index = self.car_index if car_index is None else car_index
+        if self._vehicles is not None and car_index < len(self._vehicles):
+            self._vehicles[car_index].timestamp = 0
+        self._handle_http_error(error)
+
+    def _handle_http_error(self, error: Exception):
+        """
+        Drops the session or the cached handles when the error shows they are no longer valid
+        Args:
+            error: The error raised by the request
+        """
+        response = getattr(error, 'response', None)
+        status_code = response.status_code if response is not None else None
+        if status_code == 401:  # Unauthorised, create a new session on the next request
+            self._session_expired = True
+            self._clear_handles()
+        elif status_code == 404:  # The vehicle or battery id has changed
+            self._clear_handles()
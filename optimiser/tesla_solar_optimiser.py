@@ -1,10 +1,21 @@
+import contextlib
 import datetime
-import json
+import functools
 import time
-from pathlib import Path
-from typing import Any
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Any, Callable, Dict, List
+from optimiser.command_queue import CommandQueue
+from optimiser.file_comm import FileComm
 from optimiser.force_charge_command import ForceChargeCommand
+from optimiser.metrics import MetricsRegistry
+from optimiser.poll_scheduler import PollScheduler
+from optimiser.resilience import CircuitOpenError, Deadline
+from optimiser.solar_allocator import allocate_spare_capacity
 from optimiser.solar_charge_state import SolarChargeState
+from optimiser.spare_capacity_forecaster import SpareCapacityForecaster
+from optimiser.state_publisher import StatePublisher
+from optimiser.tick_profiler import TickProfiler
+from optimiser.vehicle import POWERWALL_FULL, Vehicle, VehicleState
 from requests.exceptions import ConnectionError
 
 
@@ -16,24 +27,115 @@ class TeslaSolarOptimiser:
             new_command_interval: int = 120,
             car_index: int = 0,
             battery_index: int = 0,
-            data_logger: Any = None):
+            data_logger: Any = None,
+            battery_timeout: int = 15,
+            car_timeout: int = 90,
+            poll_scheduler: PollScheduler = None,
+            sample_store: Any = None,
+            clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+            comm: Any = None,
+            state_publisher: StatePublisher = None,
+            metrics: MetricsRegistry = None,
+            vehicles: List[Vehicle] = None,
+            forecaster: SpareCapacityForecaster = None,
+            tick_budget: float = 120,
+            profiler: TickProfiler = None):
         """
         The optimiser that fetches state data and makes decisions on whether to charge the car.
         Args:
             tesla_api: Any api object that satisfies the interface
-            new_command_interval: The time in seconds to wait between sending commands to avoid sending too many at once
-            car_index: The index in the list of vehicles output from the tesla api watched by this object
+            new_command_interval: The time in seconds to wait between sending commands of the same type to avoid
+                sending too many at once
+            car_index: The index in the list of vehicles output from the tesla api watched by this object, if vehicles
+                is None
             battery_index: The index in the list of batteries output from the tesla api watched by this object
             data_logger: Any logger object that satisfies the interface
+            battery_timeout: The time in seconds to wait for the battery data before continuing without it
+            car_timeout: The time in seconds to wait for the car data, including any wake up, before continuing
+                without it
+            poll_scheduler: Decides the time between polls and when to request the car data
+            sample_store: Any store that satisfies the interface, each sample is appended to it for analysis
+            clock: Returns the current time, replaced to replay historical data faster than real time
+            comm: Shares the state and force charge command with the server, json files are used if None
+            state_publisher: Decides when the state is published through the comm
+            metrics: The registry to record tick, request and command metrics in
+            vehicles: The cars to charge, the spare capacity is split between them if there is more than one. Each
+                car is polled at the same time and has its own command throttling.
+            forecaster: Forecasts the spare capacity so the charge current is set ahead of changes in generation,
+                the moving average of spare capacity is used if None
+            tick_budget: The time in seconds a tick may spend on requests, retries and commands. Each request is also
+                limited by its own timeout.
+            profiler: Profiles each tick of the run loop, the ticks aren't profiled if None
         """
         self.tesla_api = tesla_api
         self.new_command_interval = new_command_interval
-        self.solar_charge_state = SolarChargeState()
         self.car_index = car_index
         self.battery_index = battery_index
-        self.last_command_time = None
+        self.vehicles = vehicles if vehicles is not None else [Vehicle(car_index=car_index)]
+        self.vehicle_states = [
+            VehicleState(vehicle, SolarChargeState(), CommandQueue(new_command_interval)) for vehicle in self.vehicles]
         self._loggers = []
         self.data_logger = data_logger
+        self.battery_timeout = battery_timeout
+        self.car_timeout = car_timeout
+        self.tick_budget = tick_budget
+        self._tick_deadline = Deadline(tick_budget)
+        # One thread for the battery and one for each car so every request is made at the same time
+        self._executor = ThreadPoolExecutor(max_workers=1 + len(self.vehicles), thread_name_prefix='tesla_api')
+        # Commands have their own threads, a state request that missed its deadline keeps its thread busy
+        self._command_executor = ThreadPoolExecutor(
+            max_workers=len(self.vehicles), thread_name_prefix='tesla_api_command') if len(self.vehicles) > 1 else None
+        self._pending_requests: Dict[str, Future] = {}
+        self.poll_scheduler = poll_scheduler if poll_scheduler is not None else PollScheduler()
+        self.force_charge_command = ForceChargeCommand()
+        self.sample_store = sample_store
+        self._skipping_samples = False
+        self.clock = clock
+        self.comm = comm if comm is not None else FileComm()
+        self.forecaster = forecaster
+        self.profiler = profiler
+        self.state_publisher = state_publisher if state_publisher is not None else StatePublisher(self.comm)
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._tick_seconds = self.metrics.histogram('tso_tick_seconds', 'Time taken by each tick of the optimiser')
+        self._tick_overruns = self.metrics.counter(
+            'tso_tick_overruns_total', 'Ticks that took longer than the poll interval')
+        self._tick_overrun_seconds = self.metrics.counter(
+            'tso_tick_overrun_seconds_total', 'Time in seconds that ticks ran past the poll interval')
+        self._poll_interval = self.metrics.gauge('tso_poll_interval_seconds', 'The current time between polls')
+        self._last_tick = self.metrics.gauge('tso_last_tick_timestamp_seconds', 'The unix time of the last tick')
+        self._request_timeouts = self.metrics.counter(
+            'tso_request_timeouts_total', 'State requests that missed their deadline', ['request'])
+        self._request_errors = self.metrics.counter(
+            'tso_request_errors_total', 'State requests that failed after retrying', ['request'])
+        self._stale = self.metrics.gauge(
+            'tso_stale_data', 'Whether the last data of each request is being used because the latest failed',
+            ['request'])
+        self._command_seconds = self.metrics.histogram(
+            'tso_command_seconds', 'Time taken to send a command and read back the car data', ['command'])
+        self._commands = self.metrics.counter('tso_commands_total', 'Commands sent to the car', ['command', 'result'])
+        self._skipped_commands = self.metrics.counter(
+            'tso_commands_skipped_total', 'Queued commands not sent because they were throttled or would change nothing')
+        self._state = self.metrics.gauge('tso_state', 'The latest values of the solar charge state', ['field'])
+
+    @property
+    def solar_charge_state(self) -> SolarChargeState:
+        """ The state of the first car, which also has the household values used for every car """
+        return self.vehicle_states[0].solar_charge_state
+
+    @solar_charge_state.setter
+    def solar_charge_state(self, solar_charge_state: SolarChargeState):
+        self.vehicle_states[0].solar_charge_state = solar_charge_state
+
+    @property
+    def command_queue(self) -> CommandQueue:
+        """ The commands waiting to be sent to the first car """
+        return self.vehicle_states[0].command_queue
+
+    @property
+    def is_multi_vehicle(self) -> bool:
+        """ True if the spare capacity is split between more than one car """
+        return len(self.vehicle_states) > 1
 
     def connect(self):
         """ Connects to the API """
@@ -43,43 +145,177 @@ class TeslaSolarOptimiser:
         """
         The main run loop that displays charge state and makes decisions on weather to charge the vehicle
         """
-        loop_counter = 0
-        now = datetime.datetime.now()
         while True:
+            tick_start = time.monotonic()
+            with self.profiler.profile() if self.profiler is not None else contextlib.nullcontext():
+                interval = self.tick()
+            next_tick = tick_start + interval
+            # A change held back by the publisher's minimum interval is published before the next tick if it's due
+            flush_delay = self.state_publisher.flush_delay
+            if flush_delay is not None and time.monotonic() + flush_delay < next_tick:
+                time.sleep(flush_delay)
+                self.state_publisher.flush()
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    def tick(self) -> float:
+        """
+        Fetches the state, publishes and logs it and sends any commands it calls for
+        Returns:
+            The number of seconds between the start of this tick and the next
+        """
+        tick_start = time.monotonic()
+        now = self.clock()
+        self._tick_deadline = Deadline(self.tick_budget)
+
+        # The car data is only requested occasionally to minimise car awake time
+        self._fetch_state(update_car=self.poll_scheduler.should_update_car(
+            self.solar_charge_state, now, self._charge_states()))
+
+        self.state_publisher.publish(self._state_json())
+        if self.solar_charge_state is not None:
+            for vehicle_state in self.vehicle_states:
+                self._log(
+                    message=self._vehicle_message(vehicle_state, str(vehicle_state.solar_charge_state)),
+                    severity=self._get_message_severity(
+                        vehicle_state.solar_charge_state.charge_state))
+            self._log_data()
+            self._determine_command()
+
+        interval = self.poll_scheduler.poll_interval(
+            solar_charge_state=self.solar_charge_state,
+            threshold=self.force_charge_command.min_spare_capacity,
+            now=now,
+            charge_states=self._charge_states())
+        self._record_tick(time.monotonic() - tick_start, interval)
+        return interval
+
+    def _fetch_state(self, update_car: bool):
+        """
+        Requests the battery and car data at the same time so a slow car wake up doesn't delay the battery sample.
+        Each request has its own deadline within the tick's budget, a request that misses it keeps running in the
+        background and its data is merged into the state when it completes. A request that fails or misses its
+        deadline leaves the last data in place, marked as stale, so the tick carries on with it.
+        Args:
+            update_car: If True the car data is requested as well as the battery data
+        """
+        requests = {
+            'battery': (
+                self.tesla_api.update_battery_charge_state, self.solar_charge_state, self.battery_timeout, 'battery')}
+        if update_car:
+            for vehicle_state in self.vehicle_states:
+                requests[self._car_request_name(vehicle_state)] = (
+                    functools.partial(self.tesla_api.update_car_charge_state, **self._car_kwargs(vehicle_state)),
+                    vehicle_state.solar_charge_state,
+                    self.car_timeout,
+                    'car')
+
+        deadlines = {}
+        for name, (update_function, solar_charge_state, timeout, _) in requests.items():
+            deadline = self._tick_deadline.within(timeout)
+            if self._submit_request(name, functools.partial(update_function, deadline=deadline), solar_charge_state):
+                deadlines[name] = deadline
+
+        for name, deadline in deadlines.items():
+            _, solar_charge_state, timeout, data = requests[name]
             try:
-                self.solar_charge_state = self.tesla_api.update_battery_charge_state(
-                    solar_charge_state=self.solar_charge_state)
+                self._pending_requests[name].result(timeout=deadline.remaining())
+                self._set_stale(name, solar_charge_state, data, False)
+                if name != 'battery':
+                    self._log("Car data updated." if name == 'car' else f"{name} data updated.", severity='DEBUG')
+            except TimeoutError:
+                self._request_timeouts.inc(request=name)
+                self._set_stale(name, solar_charge_state, data, True)
+                self._log(f"The {name} data did not arrive within {timeout} seconds.", severity='ERROR')
             except ConnectionError as e:
+                self._request_errors.inc(request=name)
+                self._set_stale(name, solar_charge_state, data, True)
                 self._log(str(e), severity='ERROR')
+            except CircuitOpenError as e:
+                self._set_stale(name, solar_charge_state, data, True)
+                self._log(f"Using the last {name} data, {e}.", severity='DEBUG')
+
+        # Every car sees the same household
+        for vehicle_state in self.vehicle_states[1:]:
+            vehicle_state.solar_charge_state.current_load = self.solar_charge_state.current_load
+            vehicle_state.solar_charge_state.current_generation = self.solar_charge_state.current_generation
+            vehicle_state.solar_charge_state.battery_charge = self.solar_charge_state.battery_charge
+            vehicle_state.solar_charge_state.battery_stale = self.solar_charge_state.battery_stale
+
+    def _set_stale(self, name: str, solar_charge_state: SolarChargeState, data: str, stale: bool):
+        """
+        Marks whether a state is running on old data after a request
+        Args:
+            name: The name of the request
+            solar_charge_state: The state the request updates
+            data: The data the request fetches, battery or car
+            stale: True if the request failed so the last data is still in use
+        """
+        setattr(solar_charge_state, f'{data}_stale', stale)
+        self._stale.set(1 if stale else 0, request=name)
 
-            # Only update the car data every 60 loops to minimise car awake time
-            if (
-                    loop_counter % 40 == 0
-                    and (
-                    (now.hour >= 6 and now.hour <= 17)
-                    or self.solar_charge_state.charge_state != 'Stopped'
-            )
-            ):
-                try:
-                    self.solar_charge_state = self.tesla_api.update_car_charge_state(
-                        solar_charge_state=self.solar_charge_state)
-                    self._log("Car data updated.", severity='DEBUG')
-                except ConnectionError as e:
-                    self._log(str(e), severity='ERROR')
-
-            Path('current_state.json').write_text(
-                json.dumps(self.solar_charge_state.json))
-            if self.solar_charge_state is not None:
-                self._log(
-                    message=str(self.solar_charge_state),
-                    severity=self._get_message_severity(
-                        self.solar_charge_state.charge_state))
-                self._log_data()
-                self._determine_command()
+    def _car_request_name(self, vehicle_state: VehicleState) -> str:
+        """ The name of a car's data request, used to track it and in messages and metrics """
+        return vehicle_state.vehicle.name if self.is_multi_vehicle else 'car'
+
+    def _car_kwargs(self, vehicle_state: VehicleState) -> Dict:
+        """ The arguments that pick a car in api calls, the api's own car is used when there is only one car """
+        return {'car_index': vehicle_state.vehicle.car_index} if self.is_multi_vehicle else {}
+
+    def _charge_states(self) -> List[str]:
+        """ The charge state of every car, so polling follows the most active car """
+        return [vehicle_state.solar_charge_state.charge_state for vehicle_state in self.vehicle_states]
+
+    def _vehicle_message(self, vehicle_state: VehicleState, message: str) -> str:
+        """ Adds the name of the car to a message when there is more than one car """
+        return f"{vehicle_state.vehicle.name}: {message}" if self.is_multi_vehicle else message
+
+    def _state_json(self) -> Dict:
+        """ The state to publish, with the values of each car added when there is more than one """
+        state = self.solar_charge_state.json
+        if self.is_multi_vehicle:
+            state['vehicles'] = [vehicle_state.json for vehicle_state in self.vehicle_states]
+        return state
 
-            loop_counter += 1
+    def _record_tick(self, tick_duration: float, interval: float):
+        """
+        Records the metrics for a tick
+        Args:
+            tick_duration: The time in seconds the tick took
+            interval: The time in seconds between the start of this tick and the next
+        """
+        self._tick_seconds.observe(tick_duration)
+        self._poll_interval.set(interval)
+        self._last_tick.set(time.time())
+        if tick_duration > interval:
+            self._tick_overruns.inc()
+            self._tick_overrun_seconds.inc(tick_duration - interval)
+
+        for field in ('current_load', 'current_generation', 'spare_capacity', 'avg_spare_capacity',
+                      'charge_current_request', 'vehicle_charge', 'battery_charge'):
+            value = getattr(self.solar_charge_state, field)
+            if value is not None:
+                self._state.set(value, field=field)
+
+    def _submit_request(self, name: str, update_function: Callable, solar_charge_state: SolarChargeState) -> bool:
+        """
+        Starts an update of a solar charge state in the background unless the previous one is still running
+        Args:
+            name: The name of the request, used to track the request that is in flight
+            update_function: The api function that updates the solar charge state
+            solar_charge_state: The state to update
+
+        Returns:
+            True if a new request was started
+        """
+        pending = self._pending_requests.get(name)
+        if pending is not None and not pending.done():
+            self._log(f"Still waiting on the previous {name} data request.", severity='DEBUG')
+            return False
 
-            time.sleep(20)
+        # The api functions update the state objects in place, each one only sets its own fields
+        self._pending_requests[name] = self._executor.submit(
+            update_function, solar_charge_state=solar_charge_state)
+        return True
 
     def attach_logger(self, logger: Any):
         """
@@ -103,23 +339,19 @@ class TeslaSolarOptimiser:
             else:
                 logger.log(message, severity)
 
-    @property
-    def secs_since_last_command(self) -> int:
-        """ Returns the number of seconds since the last command was issued """
-        if self.last_command_time is None:
-            return None
-
-        return (datetime.datetime.now() - self.last_command_time).total_seconds()
-
-    @property
-    def commands_allowed(self) -> bool:
-        """ Returns true if a command can be issued """
-        return self.last_command_time is None or self.secs_since_last_command > self.new_command_interval
-
     def _log_data(self):
-        """ Logs the current charge state as a line of csv """
+        """ Logs the current charge state as a line of csv and appends it to the sample store unless it is stale """
         if self.data_logger is not None:
             self.data_logger.log(self.solar_charge_state.csv)
+        if self.sample_store is not None and not self.solar_charge_state.battery_stale:
+            stored = self.sample_store.append(self.solar_charge_state)
+            if not stored and not self._skipping_samples:
+                # Logged once rather than every tick until the clock catches up with the last sample
+                self._log(
+                    f"The clock has gone back, samples are not stored until it passes the last one stored at "
+                    f"{datetime.datetime.fromtimestamp(self.sample_store.last_timestamp)}.",
+                    severity='INFO')
+            self._skipping_samples = not stored
 
     @staticmethod
     def _get_message_severity(charge_state: str) -> str:
@@ -134,114 +366,206 @@ class TeslaSolarOptimiser:
             severity = 'ERROR'
         return severity
 
-    def _send_command(self, command: str, message: str = None, severity: str = 'DEBUG',
+    def _send_command(self, vehicle_state: VehicleState, command: str, message: str = None, severity: str = 'DEBUG',
                       force_command=False, **kwargs):
         """
-        Sends a command to the api
+        Queues a command to send to a car once the tick's decisions are made
         Args:
+            vehicle_state: The car to send the command to
             command: The command to send
             message: A message to log otherwise logs the command if none
             severity: The severity of the log message
             force_command: If True bypasses the commands allowed check
         """
-        if self.commands_allowed or force_command:
-            self.last_command_time = datetime.datetime.now()
-            result, success = self.tesla_api.send_command(command, **kwargs)
+        vehicle_state.command_queue.add(
+            command, self._vehicle_message(vehicle_state, message if message is not None else command), severity,
+            force_command, **kwargs)
+
+    def _send_queued_commands(self, vehicle_state: VehicleState):
+        """
+        Sends the commands queued for a car as one batch and then reads back the car data once
+        Args:
+            vehicle_state: The car to send the commands to
+        """
+        queued_count = len(vehicle_state.command_queue)
+        if queued_count > 0 and self._tick_deadline.expired:
+            # Keeps the loop's cadence, the commands are sent next tick unless a newer decision replaces them
+            self._log(self._vehicle_message(
+                vehicle_state, "The tick ran out of time, the commands will be sent next tick."), severity='ERROR')
+            return
+        commands = vehicle_state.command_queue.take(vehicle_state.solar_charge_state, self.clock())
+        self._skipped_commands.inc(queued_count - len(commands))
+        if len(commands) == 0:
+            return
+
+        car_kwargs = self._car_kwargs(vehicle_state)
+        for queued in commands:
+            with self._command_seconds.time(command=queued.command):
+                result, success = self.tesla_api.send_command(
+                    queued.command, deadline=self._tick_deadline, **car_kwargs, **queued.kwargs)
+            self._commands.inc(command=queued.command, result='success' if success else 'failure')
             if success:
-                self._log(message, severity) if message is not None else self._log(
-                    command, severity)
+                self._log(queued.message, queued.severity)
             else:
-                self._log(result, severity="ERROR")
-
-            # Update the car data
-            try:
-                self.solar_charge_state = self.tesla_api.update_car_charge_state(
-                    solar_charge_state=self.solar_charge_state)
-                self._log("Car data updated.", severity='DEBUG')
-            except ConnectionError as e:
-                self._log(str(e), severity='ERROR')
+                self._log(self._vehicle_message(vehicle_state, result), severity="ERROR")
+
+        # Update the car data
+        try:
+            vehicle_state.solar_charge_state = self.tesla_api.update_car_charge_state(
+                solar_charge_state=vehicle_state.solar_charge_state, deadline=self._tick_deadline, **car_kwargs)
+            self._set_stale(self._car_request_name(vehicle_state), vehicle_state.solar_charge_state, 'car', False)
+            self._log(self._vehicle_message(vehicle_state, "Car data updated."), severity='DEBUG')
+        except ConnectionError as e:
+            self._request_errors.inc(request=self._car_request_name(vehicle_state))
+            self._set_stale(self._car_request_name(vehicle_state), vehicle_state.solar_charge_state, 'car', True)
+            self._log(str(e), severity='ERROR')
+        except CircuitOpenError as e:
+            self._set_stale(self._car_request_name(vehicle_state), vehicle_state.solar_charge_state, 'car', True)
+            self._log(self._vehicle_message(vehicle_state, f"Using the last car data, {e}."), severity='DEBUG')
+
+    def _load_force_charge_command(self) -> ForceChargeCommand:
+        """ Loads the current force charge configuration """
+        return self.comm.load_force_charge_command()
+
+    def _save_force_charge_command(self, force_charge_command: ForceChargeCommand):
+        """
+        Saves changes to the force charge configuration
+        Args:
+            force_charge_command: The force charge configuration to save
+        """
+        self.comm.save_force_charge_command(force_charge_command)
 
     def _determine_command(self):
-        """ Logic to determine if a command to start charging the car should be sent. """
+        """ Decides on the commands for each car this tick and sends them """
 
         # Load any force charge commands
-        force_charge_command: ForceChargeCommand = ForceChargeCommand.load()
-        now = datetime.datetime.now()
+        force_charge_command = self._load_force_charge_command()
+        self.force_charge_command = force_charge_command
+
+        # A single car gets all of the spare capacity, otherwise it is split by priority and charge target
+        avg_spare_capacity = self.solar_charge_state.avg_spare_capacity
+        forecast_spare_capacity = self._forecast_spare_capacity()
+        if self.is_multi_vehicle:
+            threshold = force_charge_command.min_spare_capacity
+            shares = allocate_spare_capacity(self.vehicle_states, avg_spare_capacity, threshold)
+            forecast_shares = allocate_spare_capacity(self.vehicle_states, forecast_spare_capacity, threshold)
+        else:
+            shares = [avg_spare_capacity]
+            forecast_shares = [forecast_spare_capacity]
+
+        for vehicle_state, share, forecast_share in zip(self.vehicle_states, shares, forecast_shares):
+            vehicle_state.allocated_spare_capacity = share
+            vehicle_state.forecast_spare_capacity = forecast_share
+            self._queue_commands(vehicle_state, force_charge_command)
+
+        if self.is_multi_vehicle:
+            # Each car's commands are sent at the same time so extra cars don't lengthen the tick
+            list(self._command_executor.map(self._send_queued_commands, self.vehicle_states))
+        else:
+            self._send_queued_commands(self.vehicle_states[0])
+
+    def _forecast_spare_capacity(self) -> float:
+        """ The spare capacity expected over the next few minutes, the moving average if there is no forecaster """
+        avg_spare_capacity = self.solar_charge_state.avg_spare_capacity
+        if self.forecaster is None:
+            return avg_spare_capacity
+
+        # Every car's charging is in the household load so all of it is added back to find the available power
+        timestamp = self.clock().timestamp()
+        charge_power = sum(vehicle_state.solar_charge_state.charge_power for vehicle_state in self.vehicle_states)
+        self.forecaster.observe(timestamp, self.solar_charge_state.spare_capacity, charge_power)
+        forecast = self.forecaster.planned_spare_capacity(timestamp, charge_power)
+        return avg_spare_capacity if forecast is None else forecast
+
+    def _queue_commands(self, vehicle_state: VehicleState, force_charge_command: ForceChargeCommand):
+        """
+        Logic to determine if a command to start charging a car should be sent.
+        Args:
+            vehicle_state: The car, with the spare capacity allocated to it
+            force_charge_command: The force charge configuration
+        """
+        state = vehicle_state.solar_charge_state
+        avg_spare_capacity = vehicle_state.allocated_spare_capacity
+        possible_charge_current = state.charge_current_for(vehicle_state.forecast_spare_capacity)
+        now = self.clock()
         should_force_charge = (
-                self.solar_charge_state.vehicle_charge < force_charge_command.min_vehicle_charge
+                state.vehicle_charge < force_charge_command.min_vehicle_charge
                 or force_charge_command.force_charge is True
         )
 
-        if self.solar_charge_state.charge_state == "Complete" and self.solar_charge_state.port_open is False:
-            self._send_command('CHARGE_PORT_DOOR_OPEN')  # Unlock the charge port
+        if state.charge_state == "Complete" and state.port_open is False:
+            self._send_command(vehicle_state, 'CHARGE_PORT_DOOR_OPEN')  # Unlock the charge port
 
         # Check if we have enough excess solar to start charging or if we are force charging car
         elif (
-                self.solar_charge_state.avg_spare_capacity > force_charge_command.min_spare_capacity
+                avg_spare_capacity > force_charge_command.min_spare_capacity
                 or should_force_charge is True
         ):
             if (
-                    self.solar_charge_state.charge_state == 'Stopped' and
+                    state.charge_state == 'Stopped' and
                     (
-                            self.solar_charge_state.battery_charge > 98 or  # Fully charge house battery first
+                            state.battery_charge > POWERWALL_FULL or  # Fully charge house battery first
                             should_force_charge
                     )
             ):
-                self._send_command('START_CHARGE')
+                self._send_command(vehicle_state, 'START_CHARGE')
 
                 # If we are below the minimum charge then force charge for 'force_charge_hours'
-                if self.solar_charge_state.vehicle_charge < force_charge_command.min_vehicle_charge:
+                if state.vehicle_charge < force_charge_command.min_vehicle_charge:
                     self._log(
-                        f'Battery charge below minimum of {force_charge_command.min_vehicle_charge}',
+                        self._vehicle_message(
+                            vehicle_state, f'Battery charge below minimum of {force_charge_command.min_vehicle_charge}'),
                         severity='INFO')
                 # If we are below the minimum charge then force charge for 'force_charge_hours'
                 if force_charge_command.force_charge:
                     self._log(
-                        f'Force charge activated',
+                        self._vehicle_message(vehicle_state, 'Force charge activated'),
                         severity='INFO')
 
                 # If this was force charged then record the start time
-                if self.solar_charge_state.avg_spare_capacity <= force_charge_command.min_spare_capacity:
+                if avg_spare_capacity <= force_charge_command.min_spare_capacity:
                     force_charge_command.request_time = now
-                    force_charge_command.save()
+                    self._save_force_charge_command(force_charge_command)
 
         # Check if we should increase or decrease the charge current or stop charging all together
-        if self.solar_charge_state.charge_state == 'Charging':
+        if state.charge_state == 'Charging':
             new_charging_amps = 0
 
             # Stop charging because we don't have enough to even run a minimum charge but only if not force charging
-            if self.solar_charge_state.avg_spare_capacity < 0:
-                is_forcing = force_charge_command.is_forcing_charge(
-                    self.solar_charge_state.vehicle_charge)
-                self._log(f"Low Capacity; "
-                          f""
-                          f"Possible charge rate: "
-                          f"{self.solar_charge_state.possible_charge_current}, "
-                          f"Is forcing: {is_forcing}")
-
-                if self.solar_charge_state.possible_charge_current < 5 and \
-                        not is_forcing:
-                    self._send_command('STOP_CHARGE')
-                    self._send_command(
-                        'CHARGE_PORT_DOOR_OPEN')  # Unlock the charge port
+            if avg_spare_capacity < 0:
+                is_forcing = force_charge_command.is_forcing_charge(state.vehicle_charge)
+                if self.is_multi_vehicle:
+                    # The force charge start time is shared, so only a car that needs forcing is forced
+                    is_forcing = is_forcing and should_force_charge
+                self._log(self._vehicle_message(
+                    vehicle_state,
+                    f"Low Capacity; "
+                    f"Possible charge rate: "
+                    f"{possible_charge_current}, "
+                    f"Is forcing: {is_forcing}"))
+
+                if possible_charge_current < 5 and not is_forcing:
+                    self._send_command(vehicle_state, 'STOP_CHARGE')
+                    self._send_command(vehicle_state, 'CHARGE_PORT_DOOR_OPEN')  # Unlock the charge port
 
                     # Mark force charging as complete since is_forcing_charge returns False - meaning it completed.
                     if force_charge_command.request_time is not None:
                         force_charge_command.request_time = None
-                        force_charge_command.save()
+                        self._save_force_charge_command(force_charge_command)
 
                     return
 
             # Otherwise, see if we can increase the charge if the possible charge is different to current
-            if self.solar_charge_state.is_charge_change:
-                if self.solar_charge_state.vehicle_charge < force_charge_command.min_vehicle_charge:
+            if possible_charge_current != state.charge_current_request:
+                if state.vehicle_charge < force_charge_command.min_vehicle_charge:
                     new_charging_amps = force_charge_command.force_charge_amps
                 else:
-                    new_charging_amps = self.solar_charge_state.possible_charge_current
+                    new_charging_amps = possible_charge_current
 
             # A change in charging amps is required
             if new_charging_amps > 0:
                 self._send_command(
+                    vehicle_state,
                     'CHARGING_AMPS',
                     message=f'Setting CHARGING AMPS to {new_charging_amps}',
                     charging_amps=new_charging_amps)
@@ -0,0 +1,195 @@
+import cProfile
+import datetime
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional, Sequence
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sampling'
+MODES = (CPROFILE, SAMPLING)
+TICK_FILE_PREFIX = 'tick-'
+TICKS_FILE = 'ticks.csv'
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval: float = 0.005, thread_prefixes: Sequence[str] = ('tesla_api',)):
+        """
+        Records the call stacks of running threads at a fixed interval. Unlike cProfile it doesn't slow the profiled
+        code down and it sees the time spent waiting on the network in the request threads.
+        Args:
+            interval: The time in seconds between samples
+            thread_prefixes: The name prefixes of the threads to sample as well as the one that starts the profiler
+        """
+        self.interval = interval
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.stacks: Counter = Counter()
+        self._target_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """ Starts sampling in a background thread, the thread calling this is always sampled """
+        self.stacks = Counter()
+        self._target_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='tick_profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """
+        Stops sampling
+        Returns:
+            The number of samples of each collapsed stack
+        """
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        """ Takes samples until stopped """
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        """ Records the current stack of each sampled thread """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            name = names.get(thread_id, str(thread_id))
+            if thread_id == self._target_id or name.startswith(self.thread_prefixes):
+                self.stacks[collapse_stack(name, frame)] += 1
+
+
+def collapse_stack(thread_name: str, frame) -> str:
+    """
+    Formats a stack as one line of the collapsed stack format read by flame graph tools, from the root to the leaf
+    Args:
+        thread_name: The name of the thread, used as the root of the stack
+        frame: The innermost frame of the stack
+
+    Returns:
+        The frames separated by semicolons
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ';'.join(reversed(frames))
+
+
+class TickProfiler:
+
+    def __init__(
+            self,
+            directory: str = 'profiles',
+            mode: str = SAMPLING,
+            keep: int = 100,
+            sample_interval: float = 0.005,
+            memory_frames: int = 10,
+            top_allocations: int = 25):
+        """
+        Profiles each tick of the optimiser to find where the wall clock time and memory go. Each tick writes its own
+        files to a directory that only keeps the latest ticks:
+            tick-<time>-<number>.collapsed: the sampled stacks, for flame graph tools, in sampling mode
+            tick-<time>-<number>.prof: the cProfile stats, for pstats or snakeviz, in cprofile mode
+            tick-<time>-<number>.memory.txt: the lines that allocated the most memory during the tick
+        and a line is appended to ticks.csv with the time and memory used by the tick.
+        Args:
+            directory: The directory to write the profiles to
+            mode: sampling to sample the stacks of the optimiser and its request threads, cprofile to trace every
+                call of the optimiser thread
+            keep: The number of ticks to keep the profiles of, older ones are deleted
+            sample_interval: The time in seconds between samples in sampling mode
+            memory_frames: The number of frames tracemalloc records for each allocation
+            top_allocations: The number of lines listed in each memory report
+        """
+        if mode not in MODES:
+            raise ValueError(f"The profile mode must be one of {', '.join(MODES)}, got {mode}")
+        self.directory = directory
+        self.mode = mode
+        self.keep = keep
+        self.sample_interval = sample_interval
+        self.memory_frames = memory_frames
+        self.top_allocations = top_allocations
+        self.tick_count = 0
+        self._last_snapshot: Optional[tracemalloc.Snapshot] = None
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        """ Profiles the code run in the context as one tick """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+        tracemalloc.reset_peak()
+        name = f"{TICK_FILE_PREFIX}{datetime.datetime.now():%Y%m%d-%H%M%S}-{self.tick_count:06d}"
+        self.tick_count += 1
+
+        profiler = cProfile.Profile() if self.mode == CPROFILE else SamplingProfiler(self.sample_interval)
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        if self.mode == CPROFILE:
+            profiler.enable()
+        else:
+            profiler.start()
+        try:
+            yield
+        finally:
+            if self.mode == CPROFILE:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+            else:
+                self._write_collapsed(os.path.join(self.directory, f"{name}.collapsed"), profiler.stop())
+            seconds = time.perf_counter() - start
+            cpu_seconds = time.process_time() - cpu_start
+            current, peak = tracemalloc.get_traced_memory()
+            self._write_memory(os.path.join(self.directory, f"{name}.memory.txt"))
+            self._append_tick(name, seconds, cpu_seconds, current, peak)
+            self._remove_old_ticks()
+
+    @staticmethod
+    def _write_collapsed(path: str, stacks: Counter):
+        """ Writes the sampled stacks in the collapsed stack format, one stack and its count per line """
+        with open(path, 'w') as collapsed_file:
+            for stack, count in stacks.most_common():
+                collapsed_file.write(f"{stack} {count}\n")
+
+    def _write_memory(self, path: str):
+        """ Writes the lines that allocated the most memory since the last tick, leaving out the profiling itself """
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        if self._last_snapshot is None:
+            lines = [str(stat) for stat in snapshot.statistics('lineno')[:self.top_allocations]]
+        else:
+            lines = [str(stat) for stat in snapshot.compare_to(self._last_snapshot, 'lineno')[:self.top_allocations]]
+        self._last_snapshot = snapshot
+        with open(path, 'w') as memory_file:
+            memory_file.write('\n'.join(lines) + '\n')
+
+    def _append_tick(self, name: str, seconds: float, cpu_seconds: float, current: int, peak: int):
+        """ Appends the time and memory used by a tick to the ticks csv """
+        path = os.path.join(self.directory, TICKS_FILE)
+        is_new = not os.path.exists(path)
+        with open(path, 'a') as ticks_file:
+            if is_new:
+                ticks_file.write("tick,seconds,cpu_seconds,memory_bytes,peak_memory_bytes\n")
+            ticks_file.write(f"{name},{seconds:.6f},{cpu_seconds:.6f},{current},{peak}\n")
+
+    def _remove_old_ticks(self):
+        """ Deletes the files of all but the latest ticks, the names sort by time """
+        names = sorted({
+            file_name.split('.')[0] for file_name in os.listdir(self.directory)
+            if file_name.startswith(TICK_FILE_PREFIX)})
+        old_names = set(names[:max(0, len(names) - self.keep)])
+        for file_name in os.listdir(self.directory):
+            if file_name.split('.')[0] in old_names:
+                os.remove(os.path.join(self.directory, file_name))
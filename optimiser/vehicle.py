@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from optimiser.command_queue import CommandQueue
+from optimiser.solar_charge_state import SolarChargeState
+
+# The Powerwall charge in % above which a stopped car may start charging from solar, the house battery is filled first
+POWERWALL_FULL = 98
+
+
+@dataclass
+class Vehicle:
+    """
+    The configuration of a car charged by the optimiser
+
+    Args:
+        car_index: The index in the list of vehicles output from the tesla api
+        name: The name used in log messages, defaults to Car <car_index>
+        priority: Cars with a higher priority are given the spare capacity first
+        charge_target: The vehicle charge level in % after which a car only gets the spare capacity the cars below
+            their target can't use
+    """
+    car_index: int = 0
+    name: Optional[str] = None
+    priority: int = 0
+    charge_target: int = 100
+
+    def __post_init__(self):
+        if self.name is None:
+            self.name = f"Car {self.car_index}"
+
+    @classmethod
+    def parse(cls, text: str) -> 'Vehicle':
+        """
+        Creates a vehicle from a command line argument
+        Args:
+            text: INDEX[:PRIORITY[:CHARGE_TARGET]] e.g. 1:10:80
+
+        Returns:
+            The vehicle
+        """
+        parts = [int(part) for part in text.split(':')]
+        if not 1 <= len(parts) <= 3:
+            raise ValueError(f"{text} is not INDEX[:PRIORITY[:CHARGE_TARGET]]")
+        return cls(*parts[:1], None, *parts[1:])
+
+
+class VehicleState:
+
+    def __init__(self, vehicle: Vehicle, solar_charge_state: SolarChargeState, command_queue: CommandQueue):
+        """
+        The state the optimiser keeps for each car
+        Args:
+            vehicle: The configuration of the car
+            solar_charge_state: The car's charge state, the household values are shared by every car
+            command_queue: The commands waiting to be sent to the car, throttled separately for each car
+        """
+        self.vehicle = vehicle
+        self.solar_charge_state = solar_charge_state
+        self.command_queue = command_queue
+        self.allocated_spare_capacity = 0.0
+        self.forecast_spare_capacity = 0.0
+
+    @property
+    def is_plugged_in(self) -> bool:
+        """ True if the car can charge """
+        return self.solar_charge_state.charge_state not in ('Disconnected', 'Complete')
+
+    @property
+    def can_start_on_solar(self) -> bool:
+        """ True if the car is stopped and would start charging given enough spare capacity """
+        state = self.solar_charge_state
+        return state.charge_state == 'Stopped' and state.battery_charge > POWERWALL_FULL
+
+    @property
+    def is_below_target(self) -> bool:
+        """ True if the car is below its charge target """
+        return self.solar_charge_state.vehicle_charge < self.vehicle.charge_target
+
+    @property
+    def json(self) -> Dict:
+        """ Formats the car's values in json """
+        return {
+            'name': self.vehicle.name,
+            'car_index': self.vehicle.car_index,
+            'priority': self.vehicle.priority,
+            'charge_target': self.vehicle.charge_target,
+            'charge_state': self.solar_charge_state.charge_state,
+            'charge_current_request': self.solar_charge_state.charge_current_request,
+            'vehicle_charge': self.solar_charge_state.vehicle_charge,
+            'allocated_spare_capacity': self.allocated_spare_capacity,
+            'forecast_spare_capacity': self.forecast_spare_capacity,
+            'car_stale': self.solar_charge_state.car_stale
+        }
@@ -0,0 +1,47 @@
+import argparse
+from optimiser.force_charge_command import ForceChargeCommand
+from optimiser.replay import load_samples, replay
+from optimiser.spare_capacity_forecaster import SpareCapacityForecaster
+
+
+if __name__ == "__main__":
+    """
+    Replays historical samples through the charging decision logic with a simulated car, to see the commands that
+    would have been sent and the energy that would have been charged into the car.
+    """
+    parser = argparse.ArgumentParser(description='Replay historical data through the optimiser')
+    parser.add_argument('path', type=str,
+                        help='A data.csv or log_difference.txt file of historical samples')
+    parser.add_argument('--min-spare-capacity', type=int, default=ForceChargeCommand.min_spare_capacity,
+                        help='The spare capacity in W required to start charging')
+    parser.add_argument('--new-command-interval', type=int, default=120,
+                        help='The time in seconds to wait between sending commands')
+    parser.add_argument('--history-count', type=int, default=30,
+                        help='The number of samples in the spare capacity moving average')
+    parser.add_argument('--amps-per-kw', type=int, default=5,
+                        help='The factor to convert spare capacity to charging amps')
+    parser.add_argument('--max-amps', type=int, default=10,
+                        help='The max amps the charger can output')
+    parser.add_argument('--vehicle-charge', type=float, default=60,
+                        help='The vehicle charge percentage at the start of the replay')
+    parser.add_argument('--forecast', action='store_true',
+                        help='Set the charging amps from a forecast of the spare capacity rather than its average')
+    parser.add_argument('--commands', action='store_true',
+                        help='Print each command that would have been sent')
+    args = parser.parse_args()
+
+    result = replay(
+        samples=load_samples(args.path),
+        force_charge_command=ForceChargeCommand(min_vehicle_charge=0, min_spare_capacity=args.min_spare_capacity),
+        car_options={'vehicle_charge': args.vehicle_charge},
+        state_options={
+            'history_count': args.history_count,
+            'amps_per_kw': args.amps_per_kw,
+            'max_amps': args.max_amps},
+        new_command_interval=args.new_command_interval,
+        forecaster=SpareCapacityForecaster() if args.forecast else None)
+
+    if args.commands:
+        for time, command, parameters in result.commands:
+            print(f"{time} {command} {parameters if parameters else ''}")
+    print(result)
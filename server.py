@@ -1,39 +1,84 @@
+import argparse
 import datetime
-import json
-from pathlib import Path
+import gzip
+import math
 import os
+from collections import OrderedDict
+from typing import Any, Tuple
 from flask_cors import CORS
-from flask import Flask, request
+from flask import Flask, Response, request
+from optimiser.comm import create_comm
+from optimiser.downsampling import SERIES_NAMES, downsample
+from optimiser.metrics import PROMETHEUS_CONTENT_TYPE, MetricsRegistry
+from optimiser.sample_store import SampleStore
+from optimiser.state_stream import StateStream
+from optimiser.static_assets import StaticAssets
 
 # TODO: End points for force_charge configuration, getting tesla url and updating token ect.
 
 app = Flask(__name__, static_folder='./web_app/build/', static_url_path='/')
 
-if os.environ.get('ENV', 'DEV') == 'DEV':
-    # Configure app
-    CORS(app)
+# Shares the state and force charge command with the optimiser, replaced by the --comm-type argument.
+# The state is only read again when it changes, so polling dashboards don't cost a read per request.
+comm = create_comm()
+current_state_stream = StateStream(lambda: comm.read_state())
+# The samples stored by the optimiser, for charts of longer periods than the state's history
+sample_store = SampleStore('data')
+# The longest range of history that can be requested, each day in the range is a partition to look up
+MAX_HISTORY_SECONDS = 366 * 24 * 60 * 60
+# The range of timestamps that convert to dates
+MAX_TIMESTAMP = datetime.datetime(9999, 1, 1).timestamp()
+
+
+def cached_response(cached: Tuple[str, str, datetime.datetime]) -> Response:
+    """
+    Creates a response for a cached json object that answers with 304 Not Modified if the client already has it
+    Args:
+        cached: The json string, its etag and the time it was last modified
+
+    Returns:
+        The response
+    """
+    content, etag, last_modified = cached
+    response = Response(content, mimetype='application/json')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True  # Clients must check with the server before using their copy
+    return response.make_conditional(request)
 
 
 @app.route("/api/v1/solar_charge_state", methods=['GET'])
-def get_solar_charge_state() -> str:
+def get_solar_charge_state() -> Response:
     """
     Gets the current state of the charging system
     Returns:
         The charge state object as a json string
     """
-    current_state = Path('current_state.json').read_text()
-    return current_state
+    return cached_response(comm.read_state())
+
+
+@app.route("/api/v1/solar_charge_state/stream", methods=['GET'])
+def stream_solar_charge_state() -> Response:
+    """
+    Pushes the state of the charging system to the client as server sent events whenever the optimiser writes a new
+    state. A 'state' event has the whole state, an 'update' event only has the newly added spare capacity history.
+    Returns:
+        The event stream
+    """
+    response = Response(current_state_stream.events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop any reverse proxy holding back events
+    return response
 
 
 @app.route("/api/v1/force_charge", methods=['GET'])
-def get_force_charge() -> str:
+def get_force_charge() -> Response:
     """
     Gets the command object for the force charge command
     Returns:
         The command object as a json string
     """
-    force_charge = Path('force_charge.json').read_text()
-    return force_charge
+    return cached_response(comm.read_force_charge())
 
 
 @app.route("/api/v1/force_charge", methods=['PATCH'])
@@ -46,12 +91,51 @@ def update_force_charge() -> str:
     if 'force_charge' not in request.json or not isinstance(request.json['force_charge'], bool):
         return 'force_charge must be True or False', 400
 
-    command = {
-        'request_time': datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
-        'force_charge': request.json['force_charge']
+    return comm.request_force_charge(request.json['force_charge'])
+
+
+@app.route("/api/v1/history", methods=['GET'])
+def get_history():
+    """
+    Gets the stored samples in a time range, downsampled to a number of points that a chart can draw quickly.
+    Query args:
+        start: The unix timestamp of the start of the range, defaults to a day before the end
+        end: The unix timestamp of the end of the range, defaults to now
+        points: The maximum number of points in each series, defaults to 500
+        method: 'lttb' to keep the shape of each series (default) or 'minmax' to keep the peaks and troughs
+        series: A comma separated list of the series to return, defaults to load,generation,spare_capacity,amps
+    Returns:
+        The time range, the number of stored samples in it and each series as a list of {timestamp, value} entries
+    """
+    try:
+        end = float(request.args.get('end', datetime.datetime.now().timestamp()))
+        start = float(request.args.get('start', end - 24 * 60 * 60))
+        points = int(request.args.get('points', 500))
+        method = request.args.get('method', default='lttb')
+        series = request.args.get('series', default=','.join(SERIES_NAMES)).split(',')
+    except ValueError:
+        return 'start and end must be timestamps and points must be an integer', 400
+
+    if not (math.isfinite(start) and math.isfinite(end)) or start < 0 or end > MAX_TIMESTAMP:
+        return 'start and end must be timestamps', 400
+    if end <= start:
+        return 'start must be before end', 400
+    if end - start > MAX_HISTORY_SECONDS:
+        return f'The range can be at most {MAX_HISTORY_SECONDS // (24 * 60 * 60)} days', 400
+    if not 2 <= points <= 5000:
+        return 'points must be between 2 and 5000', 400
+    if method not in ('lttb', 'minmax'):
+        return 'method must be lttb or minmax', 400
+    if any(name not in SERIES_NAMES for name in series):
+        return f"series must be in {','.join(SERIES_NAMES)}", 400
+
+    samples = sample_store.read(start, end)
+    return {
+        'start': start,
+        'end': end,
+        'sample_count': len(samples),
+        'series': downsample(samples, points, method, series)
     }
-    Path('force_charge.json').write_text(json.dumps(command))
-    return json.dumps(command)
 
 
 # This is a catch all path to send any non-api requests to the React front end
@@ -60,9 +144,152 @@ def catch_all(path: str):
     return app.send_static_file('index.html')
 
 
+# Compressed json responses by etag, so a state polled by many clients is only compressed once per version
+compressed_json_cache = OrderedDict()
+
+
+def compress_json_response(response: Response) -> Response:
+    """
+    Gzips a json response if the client accepts it
+    Args:
+        response: The response to compress
+
+    Returns:
+        The response
+    """
+    if (response.status_code != 200
+            or response.mimetype != 'application/json'
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.accept_encodings):
+        return response
+
+    content = response.get_data()
+    if len(content) < 512:  # Not worth the cost of compressing
+        return response
+
+    etag, _ = response.get_etag()
+    compressed = compressed_json_cache.get(etag) if etag is not None else None
+    if compressed is None:
+        compressed = gzip.compress(content, compresslevel=6)
+        if etag is not None:
+            compressed_json_cache[etag] = compressed
+            if len(compressed_json_cache) > 16:
+                compressed_json_cache.popitem(last=False)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if etag is not None:
+        # The compressed body is a different representation, a weak etag still matches conditional requests
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def configure_development():
+    """ Allows cross origin requests, so the React dev server on another port can call the api """
+    if os.environ.get('ENV', 'DEV') == 'DEV':
+        CORS(app)
+
+
+def configure_production(build_directory: str = './web_app/build/'):
+    """
+    Serves the web app from precompressed files with long lived caching for hashed bundles and compresses json
+    responses. The static route is replaced so every file, including index.html, goes through the same handler.
+    Args:
+        build_directory: The directory of the built web app
+    """
+    assets = StaticAssets(build_directory)
+    print(f"Precompressed {assets.precompress()} web app files")
+
+    def serve_asset(filename: str = '', path: str = '') -> Response:
+        return assets.response(filename or path or assets.index, request)
+
+    app.view_functions['static'] = serve_asset
+    app.view_functions['catch_all'] = serve_asset
+    app.after_request(compress_json_response)
+
+
+def use_comm(new_comm: Any):
+    """
+    Replaces the comm the endpoints read from, e.g. with one shared with an optimiser running in this process
+    Args:
+        new_comm: Any comm object that satisfies the interface
+    """
+    global comm
+    comm = new_comm
+
+
+def serve_metrics(metrics: MetricsRegistry):
+    """
+    Serves metrics in the Prometheus format at /metrics, for an optimiser running in this process
+    Args:
+        metrics: The registry to serve
+    """
+    def get_metrics() -> Response:
+        return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', get_metrics)
+
+
+def run_threaded(port: int):
+    """
+    Runs the app on the Flask server with a thread for each request, so it can share a process with the optimiser
+    Args:
+        port: The port to listen on
+    """
+    app.run(host='0.0.0.0', port=port, threaded=True, use_reloader=False)
+
+
+def run_production(port: int, workers: int, threads: int):
+    """
+    Runs the app under gunicorn with several worker processes, each handling requests on several threads so
+    long lived event streams don't block other requests
+    Args:
+        port: The port to listen on
+        workers: The number of worker processes
+        threads: The number of threads in each worker
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set('bind', f'0.0.0.0:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('keepalive', 5)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
+
 if __name__ == '__main__':
     """
     Flask server to view current state and activate/deactivate force charging
     """
-    print("Booting Flask Server")
-    app.run(host='0.0.0.0')
+    parser = argparse.ArgumentParser(description='Boot the TSO web server')
+    parser.add_argument('--comm-type', type=str,
+                        help='How the state is shared with the optimiser, LOCAL for shared memory or FILE (default)')
+    parser.add_argument('--production', action='store_true',
+                        help='Serve with gunicorn and compressed, cached web app files instead of the Flask dev server')
+    parser.add_argument('--port', type=int, default=5000,
+                        help='The port to listen on')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='The number of worker processes in production')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='The number of threads in each worker process in production')
+    args = parser.parse_args()
+    use_comm(create_comm(args.comm_type))
+
+    if args.production:
+        print("Booting Production Server")
+        configure_production()
+        run_production(args.port, args.workers, args.threads)
+    else:
+        print("Booting Flask Server")
+        configure_development()
+        app.run(host='0.0.0.0', port=args.port)
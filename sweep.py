@@ -0,0 +1,47 @@
+import argparse
+from optimiser.parameter_sweep import parameter_grid, samples_to_arrays, sweep, format_table
+from optimiser.replay import load_samples
+
+
+def number_list(text: str):
+    """ Parses a comma separated list of numbers """
+    return [float(value) for value in text.split(',')]
+
+
+if __name__ == "__main__":
+    """
+    Searches for the best tuning of the charging rule by simulating every combination of the given parameter values
+    against historical samples, ranking them by the energy charged into the car from solar and the commands sent.
+    """
+    parser = argparse.ArgumentParser(description='Sweep the optimiser tuning parameters over historical data')
+    parser.add_argument('path', type=str,
+                        help='A data.csv or log_difference.txt file of historical samples')
+    parser.add_argument('--min-spare-capacity', type=number_list, default='0,250,500,750,1000,1250,1500,2000,2500',
+                        help='The spare capacities in W required to start charging')
+    parser.add_argument('--amps-per-kw', type=number_list, default='3,4,5,6,7',
+                        help='The factors to convert spare capacity to charging amps')
+    parser.add_argument('--history-count', type=number_list, default='5,10,20,30,60',
+                        help='The number of samples in the spare capacity moving average')
+    parser.add_argument('--max-amps', type=number_list, default='10',
+                        help='The max amps the charger can output')
+    parser.add_argument('--new-command-interval', type=number_list, default='60,120,300',
+                        help='The time in seconds to wait between sending commands')
+    parser.add_argument('--sort', type=str, default='solar_energy',
+                        choices=['solar_energy', 'self_consumption', 'commands', 'grid_energy'],
+                        help='The column to rank the results by')
+    parser.add_argument('--limit', type=int, default=20,
+                        help='The number of results to show')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='The number of processes to use, defaults to the number of cpus')
+    args = parser.parse_args()
+
+    grid = parameter_grid(
+        min_spare_capacity=args.min_spare_capacity,
+        amps_per_kw=args.amps_per_kw,
+        history_count=args.history_count,
+        max_amps=args.max_amps,
+        new_command_interval=args.new_command_interval)
+    print(f"Simulating {len(grid)} combinations")
+
+    rows = sweep(samples_to_arrays(load_samples(args.path)), grid, workers=args.workers)
+    print(format_table(rows, sort_by=args.sort, limit=args.limit))
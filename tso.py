@@ -1,25 +1,96 @@
 import argparse
+import subprocess
+import sys
 import threading
-from subprocess import Popen, PIPE
 from typing import List
 
 
-def run_process(process_args: List):
+def run_processes(processes_args: List[List[str]]):
     """
-    Runs a python process and prints the stderr to the current console
+    Runs python processes that write straight to this console and waits for them all to exit
     Args:
-        process_args: The args to pass through to the process
+        processes_args: The args to pass through to each process
     """
-    process = Popen(process_args, stderr=PIPE, universal_newlines=True)
+    processes = [subprocess.Popen([sys.executable] + process_args) for process_args in processes_args]
+    for process in processes:
+        process.wait()
 
-    while True:
 
-        line = process.stderr.readline()
-        if line:
-            print(line.strip())
+def run_separate_processes(args: argparse.Namespace):
+    """
+    Runs the optimiser and the server in processes of their own
+    Args:
+        args: The parsed command line arguments
+    """
+    comm_args = ['--comm-type', args.comm_type] if args.comm_type is not None else []
+    server_args = ['--port', str(args.port)] + (['--production'] if args.production else [])
+    optimiser_args = ['--metrics-port', args.metrics_port] if args.metrics_port is not None else []
+    optimiser_args += ['--forecast'] if args.forecast else []
+    optimiser_args += ['--profile', args.profile] if args.profile is not None else []
 
-        if process.poll() is not None:
-            break
+    # The shared memory is created before the processes start and removed once they have all exited
+    comm = None
+    if args.comm_type is not None and args.comm_type.upper() == 'LOCAL':
+        from optimiser.comm import create_comm
+        comm = create_comm(args.comm_type)
+        comm.open()
+
+    processes_args = []
+    if args.optimiser:
+        processes_args.append(['optimiser.py', args.username] + comm_args + optimiser_args)
+    if args.server:
+        processes_args.append(['server.py'] + comm_args + server_args)
+    try:
+        run_processes(processes_args)
+    finally:
+        if comm is not None:
+            comm.close()
+            comm.unlink()
+
+
+def run_single_process(args: argparse.Namespace):
+    """
+    Runs the optimiser loop and the web server in this process. The server handles requests on its own threads and
+    reads the state the optimiser publishes straight from memory, and /metrics is served by the web server. Each
+    part is only imported when it runs, so the server doesn't load teslapy and the optimiser doesn't load Flask.
+    Args:
+        args: The parsed command line arguments
+    """
+    from optimiser.comm import create_comm
+    from optimiser.metrics import MetricsRegistry
+
+    comm = create_comm('MEMORY')
+    metrics = MetricsRegistry()
+    if args.metrics_port is not None:
+        metrics.serve(int(args.metrics_port))
+
+    server_thread = None
+    if args.server:
+        import server
+        server.use_comm(comm)
+        if args.optimiser:
+            server.serve_metrics(metrics)
+        if args.production:
+            # Gunicorn's worker processes can't share the optimiser's memory, the Flask server is used instead
+            server.configure_production()
+        else:
+            server.configure_development()
+        print("Booting Flask Server")
+        server_thread = threading.Thread(target=server.run_threaded, args=(args.port,), name='server', daemon=True)
+        server_thread.start()
+
+    if args.optimiser:
+        from optimiser.optimiser_app import build_optimiser
+        tso = build_optimiser(
+            username=args.username,
+            comm=comm,
+            metrics=metrics,
+            forecast=args.forecast,
+            profile=args.profile)
+        tso.connect()
+        tso.run()
+    else:
+        server_thread.join()
 
 
 if __name__ == "__main__":
@@ -33,27 +104,35 @@ if __name__ == "__main__":
                         help='Boot the monitoring web server')
     parser.add_argument('--optimiser', action='store_true',
                         help='Boot the optimiser controller')
+    parser.add_argument('--single-process', action='store_true',
+                        help='Run the optimiser and the server in this process, sharing the state in memory')
     parser.add_argument('--comm-type', type=str,
-                        help='The type of communication between processors LOCAL, DATASTORE, CLOUD_STORAGE')
+                        help='The type of communication between processes, LOCAL for shared memory or FILE (default)')
+    parser.add_argument('--metrics-port', type=str,
+                        help='Serve the optimiser metrics in the Prometheus format at /metrics on this port')
+    parser.add_argument('--port', type=int, default=5000,
+                        help='The port the web server listens on')
+    parser.add_argument('--production', action='store_true',
+                        help='Run the web server under gunicorn with compressed, cached web app files')
+    parser.add_argument('--forecast', action='store_true',
+                        help='Set the charging amps from a forecast of the spare capacity rather than its average')
+    parser.add_argument('--profile', nargs='?', const='sampling', choices=('sampling', 'cprofile'),
+                        help='Profile each tick of the optimiser, written to the profiles directory')
     args = parser.parse_args()
 
     if not args.server and not args.optimiser:
         print("You must run the --optimiser or the --server or both.")
         exit(-1)
+    if args.single_process and args.comm_type is not None:
+        print("The --comm-type can't be set with --single-process, the state is shared in memory.")
+        exit(-1)
 
-    # Boot each process in a new thread, so we can print all output from all processes to this console
-    threads = []
-    if args.optimiser:
-        thread_1 = threading.Thread(target=run_process, args=(['python', 'optimiser.py', args.username],))
-        thread_1.start()
-        threads.append(thread_1)
-    if args.server:
-        thread_2 = threading.Thread(target=run_process, args=(['python', 'server.py'],))
-        thread_2.start()
-        threads.append(thread_2)
-
-    for thread in threads:
-        thread.join()
+    try:
+        if args.single_process:
+            run_single_process(args)
+        else:
+            run_separate_processes(args)
+    except KeyboardInterrupt:
+        pass
 
     print("Exiting...")
-
@@ -34,6 +34,27 @@ function axiosHelper (
 // Get the current charging state
 const getSolarChargeState = () => axiosHelper(`${base_url}/solar_charge_state`);
 
+// Stream the charging state as it changes. 'state' events have the whole state and 'update' events only have the
+// spare capacity history added since the previous event.
+const streamSolarChargeState = (
+    onState: (state: any) => void,
+    onUpdate: (update: any) => void,
+    onError: (error: any) => void) => {
+
+    const source = new EventSource(`${base_url}/solar_charge_state/stream`);
+    source.addEventListener('state', (event: any) => onState(keysToCamel(JSON.parse(event.data))));
+    source.addEventListener('update', (event: any) => onUpdate(keysToCamel(JSON.parse(event.data))));
+    source.onerror = onError;
+    return source;
+}
+
+// Get the stored load, generation, spare capacity and amps between two unix timestamps, downsampled to at most
+// 'points' entries per series
+const getHistory = (start: number, end: number, points: number=500, method: string='lttb') =>
+    axiosHelper(`${base_url}/history?start=${start}&end=${end}&points=${points}&method=${method}`);
+
 const api = {
-    getSolarChargeState: getSolarChargeState};
+    getSolarChargeState: getSolarChargeState,
+    streamSolarChargeState: streamSolarChargeState,
+    getHistory: getHistory};
 export default api;
\ No newline at end of file
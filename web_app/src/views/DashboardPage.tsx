@@ -165,14 +165,27 @@ const DashboardPage = () => {
 
     useEffect(() => {
 
-        const getSolarChargeState = () => {
-            api.getSolarChargeState().then(setSolarChargeState)
-                .catch((http_error: any) => setErrorMessage(http_error));
-        }
-
-        getSolarChargeState()
-        const interval = setInterval(() => getSolarChargeState(), 5000);
-        return () => clearInterval(interval);
+        // The server pushes the whole state when connecting and then only the newly added history. Any event means
+        // the stream is connected again, so it clears a lost connection message.
+        const source = api.streamSolarChargeState(
+            (state: SolarChargeState) => {
+                setErrorMessage(null);
+                setSolarChargeState(state);
+            },
+            (update: any) => {
+                setErrorMessage(null);
+                setSolarChargeState((current: null | SolarChargeState) => {
+                    if (current === null)
+                        return current;
+                    const history = current.spareCapacityHistory
+                        .concat(update.spareCapacityHistory)
+                        .filter((point: DataPoint) => update.historyStart === null || point.timestamp >= update.historyStart);
+                    const {historyStart, ...state} = update;
+                    return {...state, spareCapacityHistory: history};
+                });
+            },
+            () => setErrorMessage('Lost connection to the server, reconnecting ...' as any));
+        return () => source.close();
     }, []);
 
     return (